@@ -19,81 +19,85 @@
 
 cimport cython
 
+import os
+import mmap
+import stat
+
 from nagcat import errors
+from nagcat._object_store import ObjectStore, projection, _MISSING
 
 # libc memory functions
 cdef extern from "stdlib.h":
     ctypedef unsigned long size_t
     void free(void *ptr)
     void *malloc(size_t size)
+    void *realloc(void *ptr, size_t size)
 
 # libc string functions for parsing
 cdef extern from "string.h":
-    char *strsep(char **stringp, char *delim)
-    char *strchr(char *s, int c)
-    size_t strspn(char *s, char *accept)
-    size_t strcspn(char *s, char *reject)
-    size_t strlen(char *s)
-    int strcmp(char *s1, char *s2)
+    void *memchr(void *s, int c, size_t n)
+    int memcmp(void *s1, void *s2, size_t n)
 
+cdef extern from *:
+    ctypedef void const_void "const void"
 
-@cython.profile(False)
-cdef inline void _ignore(char **ptr):
-    """eat whitespace and comments"""
-    # ptr[0] == *ptr; ptr[0][0] == **ptr
+cdef extern from "Python.h":
+    object PyString_FromStringAndSize(char *v, Py_ssize_t length)
+    int PyObject_AsReadBuffer(object obj, const_void **buffer,
+                              Py_ssize_t *buffer_len) except -1
 
-    # position becomes NULL at EOF
-    if not ptr[0]:
-        return
+# A key and value in the file, sliced into strings only if needed
+cdef struct _Field:
+    char *key
+    Py_ssize_t key_len
+    char *value
+    Py_ssize_t value_len
 
-    while True:
-        # strip whitepsace
-        ptr[0] += strspn(ptr[0], " \t\n")
 
-        # strip comments
-        if ptr[0][0] == '#' or ptr[0][0] == ';':
-            ptr[0] += strcspn(ptr[0], "\n")
-        else:
-            return
+@cython.profile(False)
+cdef inline char* _find(char *pos, char *end, char c):
+    """Find c before end, returns end if there isn't one"""
+    cdef void *found = memchr(pos, c, end - pos)
+    if found == NULL:
+        return end
+    else:
+        return <char*>found
 
-cdef char* _strend(char *haystack, char *needle):
-    """Similar to strstr but checks if haystack ends with needle.
-    (It doesn't actually search for any needle like strstr does though)
+@cython.profile(False)
+cdef inline char* _token_end(char *pos, char *end):
+    """Find the end of a token in an object header"""
+    while pos < end and pos[0] != ' ' and pos[0] != '\t' and pos[0] != '\n':
+        pos += 1
+    return pos
 
-    The return value is the address of needle within haystack or NULL.
-    """
-    cdef size_t hlen = strlen(haystack)
-    cdef size_t nlen = strlen(needle)
-    cdef char* addr = haystack + hlen - nlen
-
-    if hlen < nlen:
-        return NULL
-    elif strcmp(addr, needle) == 0:
-        return addr
-    else:
-        return NULL
+@cython.profile(False)
+cdef inline bint _equals(char *s, Py_ssize_t length, bytes other):
+    return len(other) == length and memcmp(s, <char*>other, length) == 0
 
-cdef str _unescape(char *orig):
+cdef bytes _unescape(char *orig, Py_ssize_t length):
     """Unescape backslashed chars:
 
         '\\\\' '\\n' '\\_'
 
     Note that '\\_' == '|' because | is special in Nagios
     """
-    cdef char *buf = <char*>malloc(strlen(orig)+1)
+    cdef char *end = orig + length
+    cdef char *buf = <char*>malloc(length+1)
     cdef char *ptr = buf
-    cdef str ret
 
-    while orig[0]:
+    if buf == NULL:
+        raise MemoryError()
+
+    while orig < end:
         if orig[0] == '\\':
-            if orig[1] == 'n':
+            if orig + 1 == end:
+                break
+            elif orig[1] == 'n':
                 ptr[0] = '\n'
             elif orig[1] == '\\':
                 ptr[0] = '\\'
             elif orig[1] == '_':
                 ptr[0] = '|'
-            elif orig[1] == '\0':
-                break
             else:
                 ptr[0] = orig[0]
                 ptr[1] = orig[1]
@@ -105,10 +109,49 @@ cdef str _unescape(char *orig):
             orig += 1
             ptr += 1
 
-    ptr[0] = '\0'
-    ret = buf # Convert to a Python string
-    free(buf)
-    return ret
+    try:
+        return PyString_FromStringAndSize(buf, ptr - buf)
+    finally:
+        free(buf)
+
+cdef bytes _value(_Field *field):
+    if memchr(field.value, '\\', field.value_len) != NULL:
+        return _unescape(field.value, field.value_len)
+    else:
+        return PyString_FromStringAndSize(field.value, field.value_len)
+
+def _map_file(object_file, mapped):
+    """Get the contents of a file and a function to release them.
+
+    Regular files are mapped into memory rather than read if mapped is
+    true. Only do that for files that are replaced by renaming a new
+    file over the old one, as Nagios does with status.dat. Nagios
+    rewrites objects.cache in place and reading a mapped page past the
+    end of a truncated file raises SIGBUS.
+    """
+
+    if isinstance(object_file, basestring):
+        fd = open(object_file, 'rb')
+        try:
+            return _map_file(fd, mapped)
+        finally:
+            fd.close() # the map keeps its own copy of the descriptor
+
+    regular = False
+    if mapped:
+        try:
+            fileno = object_file.fileno()
+            info = os.fstat(fileno)
+            regular = stat.S_ISREG(info.st_mode) and object_file.tell() == 0
+        except (AttributeError, ValueError, EnvironmentError):
+            regular = False
+
+    # Empty files cannot be mapped
+    if regular and info.st_size:
+        data = mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+        return data, data.close
+    else:
+        return object_file.read(), lambda: None
 
 
 class ParseError(errors.InitError):
@@ -119,116 +162,299 @@ cdef class ObjectParser:
 
     Note that this expects files generated *by* Nagios
     such objects.cache or status.dat
+
+    Only the keys listed in fields are kept if it is given, a field
+    ending in * such as "_*" keeps all keys starting with the rest.
+
+    Set mapped to parse a file from a memory map instead of reading it,
+    this is only safe for files that are never truncated in place.
     """
 
     # Cython >= 0.12 uses the 3.x style bytes type for its
     # raw byte string instead of the 2.x style str type.
-    cdef dict _objects, _object_select
-    cdef bytes  _buffer
+    cdef object _objects, _buffer
+    cdef tuple _types, _select, _names, _prefixes
+    cdef list _key_cache
+    cdef dict _values
     cdef char *_pos
-
-    def __init__(self, object_file, object_types=(), object_select=()):
-        self._objects = {}
-        for obj in object_types:
-            self._objects[obj] = []
-        self._object_select = dict(object_select)
+    cdef char *_end
+    cdef _Field *_fields
+    cdef Py_ssize_t _fields_size
+
+    def __cinit__(self):
+        self._fields = NULL
+        self._fields_size = 0
+
+    def __dealloc__(self):
+        free(self._fields)
+
+    def __init__(self, object_file, object_types=(), object_select=(),
+            fields=(), mapped=False):
+        cdef const_void *data
+        cdef Py_ssize_t size
+
+        if isinstance(object_types, basestring):
+            object_types = (object_types,)
+
+        self._objects = ObjectStore(object_types)
+        self._key_cache = []
+        self._values = {}
+        self._types = tuple(object_types)
+        object_select = dict(object_select)
+        self._select = tuple(object_select.items())
+        names, self._prefixes = projection(fields, object_select)
+        if names is None:
+            self._names = None
+        else:
+            self._names = tuple(names)
 
         try:
-            if isinstance(object_file, basestring):
-                fd = open(object_file)
-                self._buffer = <bytes>fd.read()
-                fd.close()
-            else:
-                self._buffer = <bytes>object_file.read()
-            self._pos = self._buffer
-        except IOError, ex:
+            self._buffer, release = _map_file(object_file, mapped)
+        except EnvironmentError, ex:
             raise ParseError("Failed to read Nagios object file: %s" % ex)
 
-        self._parse()
-        self._pos = NULL
-        self._buffer = None
-
-        # filter data after the fact, dunno if filtering during is
-        # faster or slower yet, in python it seemed slower.
-        if object_types or object_select:
-            for objtype in self._objects:
-                if object_types and objtype not in object_types:
-                    del self._objects[objtype]
-                else:
-                    self._objects[objtype] = filter(
-                            self._select_filter,
-                            self._objects[objtype])
-
-    def _select_filter(self, obj):
-        for key, value in self._object_select.iteritems():
-            if key in obj and obj[key] != value:
-                return False
-        return True
+        try:
+            PyObject_AsReadBuffer(self._buffer, &data, &size)
+            self._pos = <char*>data
+            self._end = self._pos + size
+            self._parse()
+        finally:
+            self._pos = NULL
+            self._end = NULL
+            self._buffer = None
+            self._values = None
+            release()
+
+        self._objects.finish()
 
     cdef int _parse(self) except -1:
-        while self._pos:
-            self._parse_object()
+        while self._parse_object():
+            pass
+        return 0
 
-    cdef int _parse_object(self) except -1:
-        cdef char *tok, *delim, *tmp
-        cdef str objtype, attr
-        cdef dict objdata = {}
+    @cython.profile(False)
+    cdef inline void _ignore(self):
+        """eat whitespace and comments"""
+        cdef char c
 
-        _ignore(&self._pos)
+        while self._pos < self._end:
+            c = self._pos[0]
+            if c == ' ' or c == '\t' or c == '\n':
+                self._pos += 1
+            elif c == '#' or c == ';':
+                self._pos = _find(self._pos, self._end, '\n')
+            else:
+                return
 
-        tok = strsep(&self._pos, " \t")
-        if not tok or not strlen(tok):
+    @cython.profile(False)
+    cdef inline void _blanks(self):
+        """eat spaces and tabs"""
+        while self._pos < self._end and (
+                self._pos[0] == ' ' or self._pos[0] == '\t'):
+            self._pos += 1
+
+    cdef int _parse_object(self) except -1:
+        """Parse the next object, returns 0 at the end of the file"""
+        cdef char *tok
+        cdef char *tok_end
+        cdef bint define
+
+        self._ignore()
+        if self._pos == self._end:
             return 0
 
-        if strcmp(tok, "define") == 0:
-            tok = strsep(&self._pos, " \t")
-            if not tok:
+        tok = self._pos
+        tok_end = self._pos = _token_end(tok, self._end)
+
+        if tok_end - tok == 6 and memcmp(tok, "define", 6) == 0:
+            define = True
+            self._blanks()
+            tok = self._pos
+            tok_end = self._pos = _token_end(tok, self._end)
+            if tok == tok_end:
                 raise ParseError("Unexpected end of input.")
-            objtype = tok
-            delim = " \t"
         else:
+            define = False
             # If tok ends with status strip it off
-            tmp = _strend(tok, "status")
-            if tmp:
-                tmp[0] = '\0'
-            objtype = tok
-            delim = "="
-
-        tok = strsep(&self._pos, " \t\n")
-        if not tok:
+            if (tok_end - tok >= 6 and
+                    memcmp(tok_end - 6, "status", 6) == 0):
+                tok_end -= 6
+
+        objtype = PyString_FromStringAndSize(tok, tok_end - tok)
+
+        self._blanks()
+        tok = self._pos
+        tok_end = self._pos = _token_end(tok, self._end)
+        if tok == tok_end:
             raise ParseError("Unexpected end of input.")
-        if strcmp(tok, "{") != 0:
-            raise ParseError("Unexpected token: %s" % tok)
+        if tok_end - tok != 1 or tok[0] != '{':
+            raise ParseError("Unexpected token: %s" %
+                    PyString_FromStringAndSize(tok, tok_end - tok))
+
+        if self._types and objtype not in self._types:
+            self._skip_object()
+        else:
+            self._read_object(objtype, define)
+
+        return 1
+
+    cdef int _skip_object(self) except -1:
+        """Move past the current object without looking at it"""
 
         while True:
-            _ignore(&self._pos)
+            self._ignore()
+            if self._pos == self._end:
+                raise ParseError("Unexpected end of input.")
+            if self._pos[0] == '}':
+                self._pos += 1
+                return 0
+            self._pos = _find(self._pos, self._end, '\n')
+
+    cdef int _read_object(self, objtype, bint define) except -1:
+        """Find the fields of the current object, only the objects
+        and fields that are selected are copied into strings."""
+        cdef char *line_end
+        cdef char *key_end
+        cdef _Field *field
+        cdef Py_ssize_t count = 0, i
 
+        while True:
+            self._ignore()
+            if self._pos == self._end:
+                raise ParseError("Unexpected end of input.")
             if self._pos[0] == '}':
                 self._pos += 1
                 break
 
-            tok = strsep(&self._pos, delim)
-            if not tok:
-                raise ParseError("Unexpected end of input.")
+            line_end = _find(self._pos, self._end, '\n')
+            if define:
+                key_end = self._pos
+                while (key_end < line_end and
+                        key_end[0] != ' ' and key_end[0] != '\t'):
+                    key_end += 1
+            else:
+                key_end = _find(self._pos, line_end, '=')
+
+            if count == self._fields_size:
+                self._grow_fields()
+
+            field = &self._fields[count]
+            count += 1
+            field.key = self._pos
+            field.key_len = key_end - self._pos
+            if key_end < line_end:
+                field.value = key_end + 1
+                field.value_len = line_end - key_end - 1
+            else:
+                field.value = line_end
+                field.value_len = 0
 
-            name = tok
-            tok = strsep(&self._pos, "\n")
-            if not tok:
-                raise ParseError("Unexpected end of input.")
+            self._pos = line_end
+
+        if self._selected(count):
+            self._add(objtype, count)
+
+        return 0
 
-            # successfully got data!
-            if strchr(tok, '\\'):
-                objdata[name] = _unescape(tok)
+    cdef int _add(self, objtype, Py_ssize_t count) except -1:
+        """Add the wanted fields to the ObjectStore, this is the same
+        as ObjectStore.add but without building a list of pairs."""
+        cdef _Field *field
+        cdef Py_ssize_t i
+        cdef dict columns
+        cdef list keys, values
+
+        table = self._objects.table(objtype)
+        columns = table.columns
+        keys = table.keys
+        values = [_MISSING] * len(keys)
+
+        while len(self._key_cache) < count:
+            self._key_cache.append(None)
+
+        for i in range(count):
+            field = &self._fields[i]
+            if not self._wanted(field):
+                continue
+
+            key = self._key(i, field)
+            value = _value(field)
+            value = self._values.setdefault(value, value)
+            column = columns.get(key)
+            if column is None:
+                table.column(key)
+                values.append(value)
             else:
-                objdata[name] = tok
+                values[column] = value
 
-        if objtype in self._objects:
-            self._objects[objtype].append(objdata)
-        else:
-            self._objects[objtype] = [objdata]
+        table.rows.append(values)
+        return 0
+
+    cdef object _key(self, Py_ssize_t i, _Field *field):
+        """Get the key of a field, objects of the same type usually
+        have the same keys in the same order so the string used for
+        the same field of the last object is reused if it matches."""
+
+        key = self._key_cache[i]
+        if key is not None and _equals(field.key, field.key_len, key):
+            return key
+
+        key = intern(PyString_FromStringAndSize(field.key, field.key_len))
+        self._key_cache[i] = key
+        return key
 
+    cdef int _grow_fields(self) except -1:
+        cdef Py_ssize_t size = self._fields_size * 2
+        cdef _Field *fields
+
+        if size == 0:
+            size = 128
+
+        fields = <_Field*>realloc(self._fields, size * sizeof(_Field))
+        if fields == NULL:
+            raise MemoryError()
+
+        self._fields = fields
+        self._fields_size = size
         return 0
 
+    cdef bint _selected(self, Py_ssize_t count) except -1:
+        """Check the object against object_select"""
+        cdef _Field *field
+        cdef Py_ssize_t i
+
+        for key, selector in self._select:
+            for i in range(count):
+                field = &self._fields[i]
+                if not _equals(field.key, field.key_len, key):
+                    continue
+
+                value = _value(field)
+                if isinstance(selector, basestring):
+                    if value != selector:
+                        return False
+                elif value not in selector:
+                    return False
+
+        return True
+
+    cdef bint _wanted(self, _Field *field) except -1:
+        """Check the key against the fields projection"""
+
+        if self._names is None:
+            return True
+
+        for name in self._names:
+            if _equals(field.key, field.key_len, name):
+                return True
+
+        for prefix in self._prefixes:
+            if (field.key_len >= len(prefix) and
+                    memcmp(field.key, <char*>prefix, len(prefix)) == 0):
+                return True
+
+        return False
+
     def __getitem__(self, key):
         return self._objects[key]
 
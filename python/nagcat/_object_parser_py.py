@@ -17,35 +17,48 @@
 import re
 
 from nagcat import errors
+from nagcat._object_store import ObjectStore, projection
 
 class ObjectParser(object):
     """Parse a given config file for the requested objects.
 
     Note that this expects files generated *by* Nagios
     such objects.cache or status.dat
+
+    Only the keys listed in fields are kept if it is given, a field
+    ending in * such as "_*" keeps all keys starting with the rest.
+
+    mapped is only used by the C parser, this one always reads.
     """
 
     UNESCAPE = re.compile(r'(\\\\|\\n|\\_)')
 
-    def __init__(self, object_file, object_types=(), object_select=()):
-        self._objects = {}
+    def __init__(self, object_file, object_types=(), object_select=(),
+            fields=(), mapped=False):
+        if isinstance(object_types, basestring):
+            object_types = (object_types,)
+
+        self._objects = ObjectStore(object_types)
 
         object_select = dict(object_select)
+        fields = projection(fields, object_select)
 
         try:
             if isinstance(object_file, basestring):
                 fd = open(object_file)
                 try:
-                    self._parse(fd, object_types, object_select)
+                    self._parse(fd, object_types, object_select, fields)
                 finally:
                     fd.close()
             else:
-                self._parse(object_file, object_types, object_select)
+                self._parse(object_file, object_types, object_select, fields)
         except IOError, ex:
             raise errors.InitError(
                     "Failed to read Nagios object cache: %s" % ex)
 
-    def _parse(self, object_file, object_types, object_select):
+        self._objects.finish()
+
+    def _parse(self, object_file, object_types, object_select, fields):
 
         def unescape(match):
             esc = match.group(1)
@@ -58,8 +71,7 @@ class ObjectParser(object):
             else:
                 assert 0
 
-        for type_ in object_types:
-            self._objects[type_] = []
+        names, prefixes = fields
 
         splitter = None
         object_data = None
@@ -82,13 +94,10 @@ class ObjectParser(object):
                 assert type_
                 if object_types and type_ not in object_types:
                     continue
-                object_data = {}
+                object_data = []
                 object_type = type_
             elif line == '}':
-                if object_type not in self._objects:
-                    self._objects[object_type] = [object_data]
-                else:
-                    self._objects[object_type].append(object_data)
+                self._objects.add(object_type, object_data)
                 object_data = None
                 object_type = None
             else:
@@ -112,9 +121,13 @@ class ObjectParser(object):
                             object_type = None
                             continue
 
+                if (names is not None and key not in names and
+                        not (prefixes and key.startswith(prefixes))):
+                    continue
+
                 if '\\' in value:
                     value = self.UNESCAPE.sub(unescape, value)
-                object_data[key] = value
+                object_data.append((key, value))
 
     def __getitem__(self, key):
         return self._objects[key]
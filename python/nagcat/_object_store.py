@@ -0,0 +1,282 @@
+# Copyright 2010 ITA Software, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compact storage for parsed Nagios objects.
+
+Files like status.dat contain many objects of the same type with
+the same keys and many repeated values. Instead of a dict for every
+object each type gets one table of keys and every object is a list
+of values in the same order. Values are interned while parsing so
+repeated values such as "0" are only stored once. Objects are only
+wrapped in a dict-like ObjectRow when they are accessed.
+"""
+
+import collections
+from itertools import izip
+
+def projection(fields, object_select=()):
+    """Split the fields argument of the parsers into a set of names
+    and a tuple of prefixes, fields ending in * match any key that
+    starts with the rest. Keys used in object_select are always kept.
+
+    Returns (None, ()) if all keys should be kept.
+    """
+
+    if not fields:
+        return None, ()
+
+    names = set(object_select)
+    prefixes = []
+    for field in fields:
+        if field.endswith('*'):
+            prefixes.append(field[:-1])
+        else:
+            names.add(field)
+
+    return frozenset(names), tuple(prefixes)
+
+class _Missing(object):
+    """Placeholder for keys an object doesn't have"""
+
+    __slots__ = ()
+
+    def __repr__(self):
+        return "<missing>"
+
+    def __reduce__(self):
+        # Keep the one instance so identity checks work after unpickling
+        return '_MISSING'
+
+_MISSING = _Missing()
+
+class ObjectRow(object):
+    """A dict-like view of a single object in an ObjectTable"""
+
+    __slots__ = ('_table', '_values')
+
+    def __init__(self, table, values):
+        self._table = table
+        self._values = values
+
+    def __getitem__(self, key):
+        column = self._table.columns[key]
+        if column < len(self._values):
+            value = self._values[column]
+            if value is not _MISSING:
+                return value
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        column = self._table.column(key)
+        missing = column - len(self._values) + 1
+        if missing > 0:
+            self._values.extend([_MISSING] * missing)
+        self._values[column] = value
+
+    def __delitem__(self, key):
+        self[key] # raise KeyError if it is missing
+        self._values[self._table.columns[key]] = _MISSING
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        else:
+            return True
+
+    has_key = __contains__
+
+    def __len__(self):
+        return len(self._values) - self._values.count(_MISSING)
+
+    def iteritems(self):
+        for key, value in izip(self._table.keys, self._values):
+            if value is not _MISSING:
+                yield key, value
+
+    def iterkeys(self):
+        for key, value in self.iteritems():
+            yield key
+
+    __iter__ = iterkeys
+
+    def itervalues(self):
+        for key, value in self.iteritems():
+            yield value
+
+    def items(self):
+        return list(self.iteritems())
+
+    def keys(self):
+        return list(self.iterkeys())
+
+    def values(self):
+        return list(self.itervalues())
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def copy(self):
+        """Get a real dict, for things like xmlrpc that need one"""
+        return dict(self.iteritems())
+
+    def __eq__(self, other):
+        if isinstance(other, ObjectRow):
+            other = other.copy()
+        return self.copy() == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __reduce__(self):
+        # Pickle as the dict this stands for, not the whole table
+        return dict, (self.copy(),)
+
+    def __repr__(self):
+        return repr(self.copy())
+
+collections.MutableMapping.register(ObjectRow)
+
+class ObjectTable(object):
+    """All objects of a single type, used like a list of dicts.
+
+    Indexing, iteration, sort() and + work like they do for a list,
+    adding gives a real list of the rows and a table is pickled as
+    a list of dicts.
+    """
+
+    def __init__(self):
+        self.keys = []
+        self.columns = {}
+        self.rows = []
+
+    @classmethod
+    def from_rows(cls, keys, rows):
+        """Rebuild a table from its keys and rows"""
+
+        table = cls()
+        table.keys = keys
+        table.columns = dict((key, column)
+                for column, key in enumerate(keys))
+        table.rows = rows
+        return table
+
+    def column(self, key):
+        """Get the column of a key, adding it if it is new"""
+
+        column = self.columns.get(key, None)
+        if column is None:
+            column = self.columns[key] = len(self.keys)
+            self.keys.append(key)
+        return column
+
+    def append(self, items, intern=None):
+        """Add an object given as a sequence of (key, value) pairs.
+
+        intern is an optional dict's setdefault used to share values.
+        """
+
+        columns = self.columns
+        values = [_MISSING] * len(self.keys)
+        for key, value in items:
+            if intern is not None:
+                value = intern(value, value)
+            column = columns.get(key, None)
+            if column is None:
+                column = self.column(key)
+                values.append(value)
+            else:
+                values[column] = value
+        self.rows.append(values)
+
+    def filter(self, function):
+        """Get a new table with only the objects function accepts"""
+
+        table = ObjectTable()
+        table.keys = self.keys
+        table.columns = self.columns
+        table.rows = [values for values in self.rows
+                if function(ObjectRow(self, values))]
+        return table
+
+    def sort(self, cmp=None, key=None, reverse=False):
+        """Sort the objects in place, the same as list.sort"""
+        rows = sorted(self, cmp, key, reverse)
+        self.rows[:] = [row._values for row in rows]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [ObjectRow(self, values) for values in self.rows[index]]
+        else:
+            return ObjectRow(self, self.rows[index])
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        for values in self.rows:
+            yield ObjectRow(self, values)
+
+    def __add__(self, other):
+        return list(self) + list(other)
+
+    def __radd__(self, other):
+        return list(other) + list(self)
+
+    def __reduce__(self):
+        return list, (list(self),)
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(list(self))
+
+collections.Sequence.register(ObjectTable)
+
+class ObjectStore(dict):
+    """ObjectTables by object type, filled in by the parsers"""
+
+    def __init__(self, object_types=()):
+        super(ObjectStore, self).__init__()
+        self._values = {}
+        for object_type in object_types:
+            self[object_type] = ObjectTable()
+
+    def table(self, object_type):
+        """Get the table for a type, adding it if it is new"""
+
+        table = self.get(object_type, None)
+        if table is None:
+            table = self[object_type] = ObjectTable()
+        return table
+
+    def add(self, object_type, items):
+        """Add an object given as a sequence of (key, value) pairs"""
+        self.table(object_type).append(items, self._values.setdefault)
+
+    def finish(self):
+        """Parsing is done, drop the table of interned values"""
+        self._values = {}
@@ -65,6 +65,8 @@ def callback(method):
             else:
                 return Failure(result=result)
 
+    # Allow filters.Pipeline to skip the wrapper
+    catcher.unwrapped = method
     return catcher
 
 class TestError(Exception):
@@ -15,6 +15,9 @@
 """Data filters used by Test objects"""
 
 import re
+import copy
+
+from twisted.python import failure
 
 from nagcat import errors, plugin
 
@@ -41,15 +44,119 @@ def Filter(test, spec):
 
     return get_filter(test, name, default, arguments)
 
+# A filter without a test for each (name, default, arguments),
+# all filters with the same spec are copies of it.
+_filter_cache = {}
+
 def get_filter(test, name, default, arguments):
     """Search the plugins for the requested filter and create it"""
 
-    filter_class = plugin.search(IFilter, name, None)
-    if filter_class:
+    key = (name, default, arguments)
+    filter = _filter_cache.get(key, None)
+    if filter is None:
+        filter_class = plugin.search(IFilter, name, None)
+        if not filter_class:
+            raise errors.InitError("Invalid filter type '%s'" % name)
+
         assert issubclass(filter_class, _Filter)
-        return filter_class(test, default, arguments)
+        filter = filter_class(None, default, arguments)
+        _filter_cache[key] = filter
+
+    return filter.copy(test)
+
+def parse(test, parser, data):
+    """Parse data, reusing an earlier parse in this run if possible"""
+
+    get_cache = getattr(test, 'getParseCache', None)
+    if get_cache is None:
+        return parser(data)
     else:
-        raise errors.InitError("Invalid filter type '%s'" % name)
+        return get_cache().get(parser, data)
+
+class Pipeline(object):
+    """A list of filters compiled into a single synchronous callable.
+
+    Calling the pipeline has the same result as adding each filter
+    to a Deferred's callback chain (or to both chains for filters
+    that handle errors) but without the per-filter overhead.
+    """
+
+    def __init__(self, filter_list):
+        self.filters = list(filter_list)
+        self.dynamic = any(f.dynamic for f in self.filters)
+        self._steps = []
+
+        for filter in self.filters:
+            func = filter.filter
+            # Bypass errors.callback, __call__ does the same work
+            unwrapped = getattr(func, 'unwrapped', None)
+            if unwrapped is not None:
+                func = unwrapped.__get__(filter, filter.__class__)
+            self._steps.append((func, filter.handle_errors))
+
+    def __call__(self, result):
+        steps = self._steps
+        count = len(steps)
+        index = 0
+
+        while index < count:
+            try:
+                while index < count:
+                    func, handle_errors = steps[index]
+                    index += 1
+                    if (handle_errors or
+                            not isinstance(result, failure.Failure)):
+                        result = func(result)
+            except:
+                # mimic errors.callback, result is still
+                # the input to the filter that failed.
+                if isinstance(result, failure.Failure):
+                    result = errors.Failure()
+                else:
+                    result = errors.Failure(result=result)
+
+        return result
+
+    def __len__(self):
+        return len(self.filters)
+
+    def __iter__(self):
+        return iter(self.filters)
+
+class SharedPipeline(object):
+    """A pipeline shared by several queries that start with the
+    same filters. The output for the most recent input is saved
+    so the filters run only once per run of the underlying query.
+    """
+
+    def __init__(self, pipeline, parent=None):
+        self.pipeline = pipeline
+        self.parent = parent
+        self._input = None
+        self._run = None
+        self._output = None
+
+    def __call__(self, result, run):
+        """Filter result, run identifies the underlying query's run"""
+
+        if result is self._input and run == self._run:
+            return self._output
+
+        output = result
+        if self.parent is not None:
+            output = self.parent(result, run)
+        output = self.pipeline(output)
+
+        self._input = result
+        self._run = run
+        self._output = output
+        return output
+
+    def __len__(self):
+        if self.parent is not None:
+            return len(self.parent) + len(self.pipeline)
+        else:
+            return len(self.pipeline)
 
 class IFilter(plugin.INagcatPlugin):
     """Interface for finding Filter plugins"""
@@ -64,6 +171,12 @@ class _Filter(object):
     # Set weather this filter should be on the errorback chain
     # in addition to the normal callback chain.
     handle_errors = False
+    # Set whether this filter's output only depends on its input
+    # and may be shared between tests using the same query.
+    shareable = True
+    # Set whether this filter's output may change even if its input
+    # does not, such as tests comparing against $(NOW).
+    dynamic = False
 
     def __init__(self, test, default, arguments):
         self.test = test
@@ -78,6 +191,16 @@ class _Filter(object):
             raise errors.InitError("'%s' filters cannot take arguments"
                     % self.__class__.__name__.replace("Filter_",""))
 
+    def copy(self, test):
+        """Create the same filter for another test.
+
+        Compiled regexes, XPath expressions, etc are shared with this
+        filter so anything that changes while running must be reset.
+        """
+        new = copy.copy(self)
+        new.test = test
+        return new
+
     @errors.callback
     def filter(self, result):
         """Run the filter on the given input.
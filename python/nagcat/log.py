@@ -108,10 +108,8 @@ class LogLevelObserver(object):
             # seemed like an easier option than re-implementing things.
             # Also catch all starting/stopping factory noise if it exists.
             elif ('log_level' not in event and event.get('message', None) and
-                    (event['message'][0].startswith(
-                        'nagcat.plugins.query_ntp.NTPProtocol starting on') or
                     (event['message'][0].startswith('(Port ') and
-                     event['message'][0].endswith(' Closed)'))) or
+                     event['message'][0].endswith(' Closed)')) or
                     event['message'][0].startswith('Starting factory') or
                     event['message'][0].startswith('Stopping factory')):
                 level = 3 # DEBUG
@@ -21,7 +21,8 @@ from optparse import OptionParser
 from twisted.internet import reactor
 import coil
 
-from nagcat import errors, log, nagios, plugin, query, simple, util, merlin
+from nagcat import errors, log, nagios, nagios_api, plugin, query
+from nagcat import simple, util, merlin
 
 def parse_options():
     """Parse program options in sys.argv"""
@@ -65,10 +66,22 @@ def parse_options():
             help="path to nagios.cfg, enables Nagios support")
     parser.add_option("-T", "--tag", dest="tag",
             help="only load nagios tests with a specific tag")
+    parser.add_option("--nagios-batch-size", type="int",
+            default=nagios_api.BATCH_SIZE, metavar="COUNT",
+            help="submit at most this many results per spool file")
+    parser.add_option("--nagios-batch-window", type="float",
+            default=nagios_api.BATCH_WINDOW, metavar="SECONDS",
+            help="collect results for this long before submitting")
+    parser.add_option("--nagios-results", default="command",
+            type="choice", choices=("command", "checkresult"),
+            help="submit results via the command pipe (default) or "
+                 "by writing Nagios 3 checkresult files")
     parser.add_option("-C", "--core-dumps",
             help="set cwd to the given directory and enable core dumps")
     parser.add_option("--disable-snmp-bulk", action="store_true",
             help="disable the use of SNMPv2's GETBULK command")
+    parser.add_option("--snmp-mib-cache", metavar="FILE",
+            help="cache SNMP OID name lookups in the given file")
     parser.add_option("", "--profile-init", dest="profile_init",
             action="store_true", default=False,
             help="run profiler during startup")
@@ -114,6 +127,12 @@ def parse_options():
     if options.test and (not options.host or not options.port):
         err.append("--host and --port is required with --test")
 
+    if options.nagios_batch_size < 1:
+        err.append("--nagios-batch-size must be at least 1")
+
+    if options.nagios_batch_window < 0:
+        err.append("--nagios-batch-window cannot be negative")
+
     if options.loglevel not in log.LEVELS:
         err.append("invalid log level '%s'" % options.loglevel)
         err.append("must be one of: %s" % " ".join(log.LEVELS))
@@ -156,6 +175,8 @@ def init_plugins(options):
 
     snmp = plugin.search(query.IQuery, "snmp")
     snmp.use_bulk(not options.disable_snmp_bulk)
+    if options.snmp_mib_cache:
+        snmp.mib_cache(options.snmp_mib_cache)
 
 def init(options):
     """Prepare to start up NagCat"""
@@ -195,13 +216,19 @@ def init(options):
                      rrdcache=options.rrdcache,
                      monitor_port=options.status_port,
                      nagios_cfg=options.nagios, tag=options.tag,
+                     batch_size=options.nagios_batch_size,
+                     batch_window=options.nagios_batch_window,
+                     results=options.nagios_results,
                      merlin_db_info=merlin_db_info)
         else:
             nagcat = nagios.NagcatNagios(config,
                     rradir=options.rradir,
                     rrdcache=options.rrdcache,
                     monitor_port=options.status_port,
-                    nagios_cfg=options.nagios, tag=options.tag)
+                    nagios_cfg=options.nagios, tag=options.tag,
+                    batch_size=options.nagios_batch_size,
+                    batch_window=options.nagios_batch_window,
+                    results=options.nagios_results)
     except (errors.InitError, coil.errors.CoilError), ex:
         log.error(str(ex))
         sys.exit(1)
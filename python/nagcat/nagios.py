@@ -15,16 +15,253 @@
 """NagCat->Nagios connector"""
 
 import os
+import time
 import errno
+import signal
+import struct
+import cPickle
 
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+from twisted.internet import defer, process, protocol, reactor, task
 from coil.errors import CoilError
-from nagcat import errors, log, nagios_api, nagios_objects, scheduler
+from nagcat import errors, log, monitor_api, nagios_api
+from nagcat import nagios_objects, scheduler
+
+# Check status.dat for changes this often, in seconds
+STATUS_INTERVAL = 5.0
+# Stop using an out of date copy of status.dat after this many
+# seconds or this many failed reloads in a row.
+STATUS_MAX_AGE = 300.0
+STATUS_MAX_FAILURES = 3
+# Only these types are kept from status.dat
+STATUS_TYPES = ('host', 'service')
+
+# Reloads of status.dat are parsed by a forked child which sends the
+# result back as a pickle prefixed by its length on an extra pipe.
+RESULT_FD = 3
+_HEADER = struct.Struct("!I")
+
+class NagiosPage(monitor_api.XMLPage):
+    """Information on check results submitted to Nagios"""
+
+    def __init__(self, commander):
+        super(NagiosPage, self).__init__()
+        self.commander = commander
+
+    def xml(self, request):
+        nagios = etree.Element("Nagios", version="1.0")
+
+        data = self.commander.stats()
+
+        batches = etree.SubElement(nagios, "Batches",
+                count=str(data['batches']), commands=str(data['commands']),
+                coalesced=str(data['coalesced']),
+                pending=str(data['pending']))
+        size = etree.SubElement(batches, "Size")
+        etree.SubElement(size, "Maximum").text = "%d" % data['size']['max']
+        etree.SubElement(size, "Minimum").text = "%d" % data['size']['min']
+        etree.SubElement(size, "Average").text = "%f" % data['size']['avg']
+        lat = etree.SubElement(batches, "Latency")
+        etree.SubElement(lat, "Maximum").text = "%f" % data['latency']['max']
+        etree.SubElement(lat, "Minimum").text = "%f" % data['latency']['min']
+        etree.SubElement(lat, "Average").text = "%f" % data['latency']['avg']
+
+        return nagios
+
+class StatusProtocol(protocol.ProcessProtocol):
+    """Read the result sent back by a StatusParser"""
+
+    def __init__(self):
+        self.deferred = defer.Deferred()
+        self.data = []
+
+    def childDataReceived(self, fd, data):
+        assert fd == RESULT_FD
+        self.data.append(data)
+
+    def processEnded(self, reason):
+        data = "".join(self.data)
+        self.data = []
+
+        if len(data) >= _HEADER.size:
+            size, = _HEADER.unpack(data[:_HEADER.size])
+        else:
+            size = None
+
+        if size is None or len(data) != _HEADER.size + size:
+            self.deferred.errback(errors.Failure(Exception(
+                "Status parser exited unexpectedly: %s" % reason.value)))
+            return
+
+        try:
+            ok, result = cPickle.loads(data[_HEADER.size:])
+        except Exception:
+            self.deferred.errback(errors.Failure())
+        else:
+            if ok:
+                self.deferred.callback(result)
+            else:
+                self.deferred.errback(errors.Failure(result))
+
+class StatusParser(process.Process):
+    """A forked process that runs StatusLoader._load and sends
+    the result back to the parent, deferred fires with it."""
+
+    def __init__(self, loader):
+        self.loader = loader
+        proto = StatusProtocol()
+        self.deferred = proto.deferred
+        process.Process.__init__(self, reactor, executable=None, args=None,
+                environment=None, path=None, proto=proto,
+                childFDs={0:0, 1:1, 2:2, RESULT_FD:'r'})
+
+    def _execChild(self, *ignore, **kgnore):
+        """Parse the file instead of exec"""
+        try:
+            result = (True, self.loader._load())
+        except Exception, ex:
+            result = (False, ex)
+
+        # Failure objects don't survive pickling, send the
+        # exception itself and wrap it up again in the parent.
+        try:
+            data = cPickle.dumps(result, -1)
+        except (cPickle.PicklingError, TypeError):
+            data = cPickle.dumps((False, Exception(repr(result[1]))), -1)
+
+        data = _HEADER.pack(len(data)) + data
+        while data:
+            data = data[os.write(RESULT_FD, data):]
+        os._exit(0)
+
+    def _resetSignalDisposition(self):
+        """Reset non-standard signal handlers."""
+        for signalnum in xrange(1, signal.NSIG):
+            if signal.getsignal(signalnum) not in (None,
+                    signal.SIG_DFL, signal.SIG_IGN):
+                signal.signal(signalnum, signal.SIG_DFL)
+
+class StatusLoader(object):
+    """Keep a parsed copy of Nagios' status.dat up to date.
+
+    Changes are parsed by a StatusParser while the old copy is still
+    used and then swapped in, so status() never waits on the parser
+    other than for the first load. The reactor only spends the time
+    to unpickle the new copy. The copy it returns is at most interval
+    seconds (plus the parse time) older than the file.
+
+    If the file has changed but could not be loaded for max_age
+    seconds or max_failures reloads in a row status() raises
+    TestUnknown rather than return the out of date copy.
+    """
+
+    def __init__(self, status_file, interval=STATUS_INTERVAL,
+            max_age=STATUS_MAX_AGE, max_failures=STATUS_MAX_FAILURES):
+        self.status_file = status_file
+        self.interval = interval
+        self.max_age = max_age
+        self.max_failures = max_failures
+        self._status = None
+        self._mtime = 0
+        self._loading = False
+        self._call = None
+        # When the file was first seen to be newer than our copy
+        self._changed = None
+        self._failures = 0
+
+    def status(self):
+        """Get the latest nagios_objects.Status"""
+
+        if self._status is None:
+            self._status, self._mtime = self._load()
+            self._call = task.LoopingCall(self.check)
+            self._call.start(self.interval, now=False)
+
+        if self._failures >= self.max_failures:
+            raise errors.TestUnknown("Failed to reload Nagios status "
+                    "file %d times" % self._failures)
+
+        if (self._changed is not None and
+                time.time() - self._changed > self.max_age):
+            raise errors.TestUnknown("Nagios status is out of date "
+                    "by more than %d seconds" % self.max_age)
+
+        return self._status
+
+    def stop(self):
+        if self._call is not None:
+            self._call.stop()
+            self._call = None
+
+    def check(self):
+        """Start reloading in a child process if the file has changed"""
+
+        if self._loading:
+            return None
+
+        try:
+            mtime = os.stat(self.status_file).st_mtime
+        except OSError, ex:
+            log.warn("Failed to check Nagios status file: %s", ex)
+            self._failures += 1
+            return None
+
+        if mtime <= self._mtime:
+            # Our copy is current, earlier failures no longer matter
+            self._failures = 0
+            return None
+
+        if self._changed is None:
+            self._changed = time.time()
+
+        log.debug("Reloading Nagios status file: %s", self.status_file)
+        self._loading = True
+        try:
+            deferred = StatusParser(self).deferred
+        except OSError, ex:
+            deferred = defer.fail(ex)
+        deferred.addCallbacks(self._loaded, self._failed)
+        return deferred
+
+    def _load(self):
+        fd = open(self.status_file, 'r')
+        try:
+            mtime = os.fstat(fd.fileno()).st_mtime
+            status = nagios_objects.Status(fd, STATUS_TYPES)
+        finally:
+            fd.close()
+
+        return status, mtime
+
+    def _loaded(self, result):
+        self._status, self._mtime = result
+        self._loading = False
+        self._changed = None
+        self._failures = 0
+
+    def _failed(self, result):
+        log.error("Failed to reload Nagios status file: %s",
+                result.getErrorMessage())
+        self._loading = False
+        self._failures += 1
 
 class NagcatNagios(scheduler.Scheduler):
     """Setup tests defined by Nagios and report back"""
 
-    def __init__(self, config, nagios_cfg, **kwargs):
-        """Read given Nagios config file and load tests"""
+    def __init__(self, config, nagios_cfg,
+            batch_size=nagios_api.BATCH_SIZE,
+            batch_window=nagios_api.BATCH_WINDOW,
+            results="command", **kwargs):
+        """Read given Nagios config file and load tests.
+
+        results selects how check results are submitted: "command"
+        uses the command pipe, "checkresult" writes files directly
+        into Nagios 3's check_result_path.
+        """
 
         # TODO: The NagcatNagios class needs to be easier to test,
         # that way we can actually call the __init__ for it in unit tests
@@ -35,35 +272,42 @@ class NagcatNagios(scheduler.Scheduler):
                 ('object_cache_file', 'status_file',
                  'command_file', 'check_result_path'))
         self._nagios_obj = cfg['object_cache_file']
-        spool = nagios_api.spool_path(cfg['check_result_path'], 'nagcat')
-        self._nagios_cmd = nagios_api.NagiosCommander(
-                cfg['command_file'], spool)
+        if results == "command":
+            spool = nagios_api.spool_path(cfg['check_result_path'], 'nagcat')
+            self._nagios_cmd = nagios_api.NagiosCommander(
+                    cfg['command_file'], spool, batch_size, batch_window)
+            log.info("Using Nagios command file: %s", cfg['command_file'])
+        elif results == "checkresult":
+            self._nagios_cmd = nagios_api.CheckResultWriter(
+                    cfg['check_result_path'], batch_size, batch_window)
+            log.info("Using Nagios check result path: %s",
+                    cfg['check_result_path'])
+        else:
+            raise errors.InitError("Invalid Nagios results type: %s" % results)
 
-        self._status_file = cfg['status_file']
-        self._status_cache = None
-        self._status_mtime = 0
+        self._status = StatusLoader(cfg['status_file'])
 
         log.info("Using Nagios object cache: %s", self._nagios_obj)
-        log.info("Using Nagios command file: %s", cfg['command_file'])
-        log.info("Using Nagios status file: %s", self._status_file)
-        return super(NagcatNagios, self).__init__(config, **kwargs)
+        log.info("Using Nagios status file: %s", cfg['status_file'])
+        super(NagcatNagios, self).__init__(config, **kwargs)
+
+        if self.monitor:
+            self.monitor.includeChild("nagios", NagiosPage(self._nagios_cmd))
 
     def nagios_status(self):
-        fd = open(self._status_file, 'r')
-        try:
-            stat = os.fstat(fd.fileno())
-            if self._status_mtime < stat.st_mtime:
-                self._status_cache = nagios_objects.ObjectParser(fd)
-                self._status_mtime = stat.st_mtime
-            return self._status_cache
-        finally:
-            fd.close()
+        return self._status.status()
+
+    def stop(self):
+        self._status.stop()
+        self._nagios_cmd.stop()
+        super(NagcatNagios, self).stop()
 
     def _parse_tests(self, tag):
         """Get the list of NagCat services in the object cache"""
 
         parser = nagios_objects.ObjectParser(
-                self._nagios_obj, ('host', 'service'))
+                self._nagios_obj, ('host', 'service'),
+                fields=('host_name', 'address', 'service_description', '_*'))
         hosts = {}
         tests = []
 
@@ -143,6 +387,6 @@ class NagcatNagios(scheduler.Scheduler):
         log.debug("Submitting report for %s %s to Nagios",
                 host_name, service_description)
 
-        self._nagios_cmd.command(report['time'],
+        self._nagios_cmd.submit(report['time'],
                 'PROCESS_SERVICE_CHECK_RESULT', host_name,
                 service_description, report['state_id'], report['text'])
@@ -114,11 +114,15 @@ class NagiosWriter(Logger, object):
         """Remove writer from the reactor"""
         reactor.removeWriter(self)
 
+    def backlog(self):
+        """Number of commands that haven't been fully written yet"""
+        return len(self._data_queue) + bool(self._data)
+
     def write(self, data):
         """Adding data to the data_queue to be sent into the pipe."""
 
         if len(self._data_queue) >= self.MAXSIZE:
-            self._cleanup()
+            self._coalesce(data)
 
         self._data_queue.append(data)
         self.startWriting()
@@ -137,6 +141,26 @@ class NagiosWriter(Logger, object):
         if match and os.path.exists(match.group(1)):
             os.unlink(match.group(1))
 
+    def _coalesce(self, data):
+        """Make room for data by merging the oldest spool file into
+        the one submitted after it, only results that aren't replaced
+        by a newer one for the same service are kept. Commands other
+        than PROCESS_FILE are dropped as before."""
+
+        oldest = self.CLEANUP.match(self._data_queue[0])
+        if len(self._data_queue) > 1:
+            newer = self.CLEANUP.match(self._data_queue[1])
+        else:
+            newer = self.CLEANUP.match(data)
+
+        if oldest and newer and os.path.exists(oldest.group(1)):
+            try:
+                _merge_spool(oldest.group(1), newer.group(1))
+            except (IOError, OSError), ex:
+                log.warn("Failed to merge nagios spool files: %s" % ex)
+
+        self._cleanup()
+
     def _reopen_file(self):
         """Attempt to reopen the pipe."""
 
@@ -171,7 +195,226 @@ class NagiosWriter(Logger, object):
             self._fd = None
 
 
-class NagiosCommander(object):
+_ESCAPE = re.compile(r'(\\|\n|\|)')
+
+def _escape(match):
+    char = match.group(1)
+    if char == '\\':
+        return r'\\'
+    elif char == '\n':
+        return r'\n'
+    elif char == '|':
+        return r'\_'
+    else:
+        assert 0
+
+def escape_output(text):
+    """Escape check output for Nagios.
+
+    Newlines and backslashes are escaped, | is not allowed at all
+    so we use \_ as an escape sequence.
+    """
+    return _ESCAPE.sub(_escape, text)
+
+def _write_all(fd, text):
+    """Write all of text to fd, os.write may write only part of it"""
+
+    while text:
+        written = os.write(fd, text)
+        text = buffer(text, written)
+
+def _result_key(line):
+    """Get the (host, service) of a check result command or None"""
+
+    command = line.split('] ', 1)[-1].split(';', 3)
+    if command[0] == 'PROCESS_SERVICE_CHECK_RESULT' and len(command) == 4:
+        return tuple(command[1:3])
+    else:
+        return None
+
+def _merge_spool(old_path, new_path):
+    """Add the commands in old_path to the front of new_path,
+    dropping check results that new_path has a newer one for."""
+
+    fd = open(new_path)
+    try:
+        new_lines = fd.readlines()
+    finally:
+        fd.close()
+
+    fd = open(old_path)
+    try:
+        old_lines = fd.readlines()
+    finally:
+        fd.close()
+
+    replaced = set(_result_key(line) for line in new_lines)
+    replaced.discard(None)
+    lines = [line for line in old_lines if _result_key(line) not in replaced]
+    lines.extend(new_lines)
+
+    spool_fd, tmp = tempfile.mkstemp(dir=os.path.dirname(new_path))
+    try:
+        try:
+            os.fchmod(spool_fd, 0644)
+            _write_all(spool_fd, "".join(lines))
+        finally:
+            os.close(spool_fd)
+        os.rename(tmp, new_path)
+    except:
+        os.unlink(tmp)
+        raise
+
+# Default limits for batched check results, see BatchSubmitter.submit
+BATCH_SIZE = 500
+BATCH_WINDOW = 1.0
+# Seconds between checks for Nagios catching up while results are held
+BLOCKED_RETRY = 1.0
+
+class BatchSubmitter(object):
+    """Collect check results and write them out in batches.
+
+    Only the latest pending result for each host and service is
+    kept, if a newer one is submitted before the batch is written
+    the old one is dropped. While the subclass reports that Nagios
+    isn't keeping up results are held here rather than written so
+    the backlog stays bounded by the number of services.
+
+    Subclasses write out each batch by implementing _threaded_command.
+    """
+
+    def __init__(self, batch_size=1, batch_window=0):
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self._batch = []
+        self._batch_index = {}
+        self._batch_start = None
+        self._batch_timer = None
+        self._batch_stats = deque([], 60)
+        self._batch_count = 0
+        self._batch_total = 0
+        self._batch_coalesced = 0
+        self._shutdown_trigger = reactor.addSystemEventTrigger(
+                'before', 'shutdown', self._shutdown)
+
+    def submit(self, cmd_time, *args):
+        """Queue a command to be written along with others.
+
+        The queued commands are written to a single spool file once
+        batch_size commands have been queued or batch_window seconds
+        after the first one, whichever comes first.
+
+        @param cmd_time: a Unix timestamp or None
+        @param *args: the command name and its arguments arguments
+        """
+
+        if not cmd_time:
+            cmd_time = time.time()
+
+        if not self._batch:
+            self._batch_start = time.time()
+
+        if args[0] == 'PROCESS_SERVICE_CHECK_RESULT':
+            key = args[1:3]
+        else:
+            key = None
+
+        index = self._batch_index.get(key, None)
+        if index is not None:
+            # Keep the original position, replace the stale result
+            self._batch[index] = (int(cmd_time), args)
+            self._batch_coalesced += 1
+        else:
+            if key is not None:
+                self._batch_index[key] = len(self._batch)
+            self._batch.append((int(cmd_time), args))
+
+        if len(self._batch) >= self.batch_size and not self._blocked():
+            self.flush()
+        elif self._batch_timer is None:
+            self._batch_timer = reactor.callLater(
+                    self.batch_window, self.flush)
+
+    def stop(self):
+        """Write out any queued commands now, nothing may be
+        submitted after this is called."""
+
+        if self._shutdown_trigger is not None:
+            reactor.removeSystemEventTrigger(self._shutdown_trigger)
+            self._shutdown_trigger = None
+        self.flush(True)
+
+    def _shutdown(self):
+        self._shutdown_trigger = None
+        self.flush(True)
+
+    def flush(self, force=False):
+        """Write out any commands queued by submit()"""
+
+        if self._batch_timer is not None:
+            if self._batch_timer.active():
+                self._batch_timer.cancel()
+            self._batch_timer = None
+
+        if not self._batch:
+            return
+
+        if not force and self._blocked():
+            log.debug("Holding %d commands until Nagios catches up",
+                    len(self._batch))
+            self._batch_timer = reactor.callLater(
+                    max(self.batch_window, BLOCKED_RETRY), self.flush)
+            return
+
+        batch = self._batch
+        self._batch = []
+        self._batch_index = {}
+        cmd_time = int(time.time())
+
+        for i in xrange(0, len(batch), self.batch_size):
+            chunk = batch[i:i+self.batch_size]
+            if force:
+                self._threaded_command(cmd_time, chunk,
+                        self._batch_start, True)
+            else:
+                reactor.callInThread(self._threaded_command,
+                        cmd_time, chunk, self._batch_start)
+
+    def _blocked(self):
+        """True if Nagios isn't reading what has been written already"""
+        return False
+
+    def stats(self):
+        """Batch sizes and latencies for the last 60 batches"""
+
+        sizes = [size for size, latency in self._batch_stats] or [0]
+        latencies = [latency for size, latency in self._batch_stats] or [0]
+
+        return {'batches': self._batch_count,
+                'commands': self._batch_total,
+                'coalesced': self._batch_coalesced,
+                'pending': len(self._batch),
+                'size': {'max': max(sizes), 'min': min(sizes),
+                    'avg': float(sum(sizes)) / len(sizes)},
+                'latency': {'max': max(latencies), 'min': min(latencies),
+                    'avg': sum(latencies) / len(latencies)},
+                }
+
+    def _record_batch(self, size, start):
+        """Update the batch stats after a batch is written"""
+
+        latency = time.time() - start
+        self._batch_count += 1
+        self._batch_total += size
+        self._batch_stats.append((size, latency))
+        log.debug("Submitted %d commands to Nagios after %.3f seconds",
+                size, latency)
+
+    def _threaded_command(self, cmd_time, batch, start=None, force=False):
+        """Write out a list of (cmd_time, cmd) pairs"""
+        raise Exception("Unimplemented!")
+
+class NagiosCommander(BatchSubmitter):
 
     ALLOWED_COMMANDS = {
             'DEL_HOST_DOWNTIME': 1,
@@ -189,16 +432,18 @@ class NagiosCommander(object):
     # I'm setting it to a bit below the limit just to be safe.
     MAX_EXTERNAL_COMMAND_LENGTH = 8180
 
-    ESCAPE = re.compile(r'(\\|\n|\|)')
-
-    def __init__(self, command_file, spool_dir):
+    def __init__(self, command_file, spool_dir, batch_size=1, batch_window=0):
         """Create writer and add it to the reactor.
 
         command_file is the path to the nagios pipe
         spool_dir is where to write large commands to
+        batch_size and batch_window limit how many commands and for
+        how many seconds submit() will collect before writing them.
         """
 
+        super(NagiosCommander, self).__init__(batch_size, batch_window)
         self.spool_dir = spool_dir
+
         # Create or cleanup the spool dir
         if os.path.isdir(spool_dir):
             self._cleanup_spool()
@@ -217,6 +462,9 @@ class NagiosCommander(object):
 
         self.writer = NagiosWriter(command_file)
 
+    def _blocked(self):
+        return self.writer.backlog() > 0
+
     def command(self, cmd_time, *args):
         """Submit a command to Nagios.
 
@@ -236,34 +484,45 @@ class NagiosCommander(object):
         if not cmd_time:
             cmd_time = time.time()
         cmd_time = int(cmd_time)
+        batch = [(cmd_time, cmd) for cmd in cmd_list]
 
         if force:
-            self._threaded_command(cmd_time, cmd_list, True)
+            self._threaded_command(cmd_time, batch, None, True)
         else:
-            reactor.callInThread(self._threaded_command, cmd_time, cmd_list)
+            reactor.callInThread(self._threaded_command,
+                    cmd_time, batch, None)
 
-    def _threaded_command(self, cmd_time, cmd_list, force=False):
+    def _threaded_command(self, cmd_time, batch, start=None, force=False):
         """Write out out the temporary command file from a thread to
         avoid any momentary delays that may be caused by creating
         creating the file.
+
+        batch is a list of (cmd_time, cmd) pairs, the cmd_time
+        argument is used for the PROCESS_FILE command. If start is
+        given it is the time the batch was started for the stats.
         """
 
         spool_fd, spool_path = tempfile.mkstemp(dir=self.spool_dir)
         try:
             try:
                 os.fchmod(spool_fd, 0644)
-                for cmd in cmd_list:
-                    text = self._format_command(cmd_time, *cmd)
-                    log.trace("Writing Nagios command to spool: %s", text)
-                    os.write(spool_fd, text)
+                text = "".join([self._format_command(result_time, *cmd)
+                                for result_time, cmd in batch])
+                log.trace("Writing Nagios commands to spool: %s", text)
+                _write_all(spool_fd, text)
 
                 submit = self._format_command(cmd_time,
                         'PROCESS_FILE', spool_path, '1')
                 if force:
                     self.writer.write(submit)
                     self.writer.doWrite()
+                    if start is not None:
+                        self._record_batch(len(batch), start)
                 else:
                     reactor.callFromThread(self.writer.write, submit)
+                    if start is not None:
+                        reactor.callFromThread(
+                                self._record_batch, len(batch), start)
             except:
                 os.unlink(spool_path)
                 raise
@@ -282,20 +541,8 @@ class NagiosCommander(object):
             clean_args.append(arg)
 
         # The last argument may contain newlines but they must be escaped
-        # | is not allowed at all so we use \_ as an escape sequence.
-        def escape(match):
-            char = match.group(1)
-            if char == '\\':
-                return r'\\'
-            elif char == '\n':
-                return r'\n'
-            elif char == '|':
-                return r'\_'
-            else:
-                assert 0
-
         if args:
-            arg = self.ESCAPE.sub(escape, args[-1])
+            arg = escape_output(args[-1])
             # Workaround a bug in some Nagios versions
             arg.rstrip('\\')
             clean_args.append(arg)
@@ -348,6 +595,88 @@ class NagiosCommander(object):
         reactor.callLater(60, reactor.callInThread, self._cleanup_spool)
 
 
+class CheckResultWriter(BatchSubmitter):
+    """Write service check results directly into Nagios 3's
+    check_result_path rather than sending them through the command
+    pipe. Results are batched the same way as NagiosCommander.submit.
+    """
+
+    # Only service results can be submitted this way
+    COMMAND = 'PROCESS_SERVICE_CHECK_RESULT'
+
+    def __init__(self, check_result_path, batch_size=1, batch_window=0):
+        super(CheckResultWriter, self).__init__(batch_size, batch_window)
+        self.check_result_path = check_result_path
+
+        if not os.path.isdir(check_result_path):
+            raise errors.InitError(
+                    "Check result path %s is not a directory"
+                    % check_result_path)
+
+    def submit(self, cmd_time, *args):
+        assert args[0] == self.COMMAND and len(args) == 5
+        super(CheckResultWriter, self).submit(cmd_time, *args)
+
+    def _threaded_command(self, cmd_time, batch, start=None, force=False):
+        """Write out a checkresult file and its .ok file.
+
+        Nagios only reads files named c?????? that have a matching
+        .ok file so the result file is complete before it is seen.
+        """
+
+        text = ["### Nagcat Check Result File ###\n",
+                "file_time=%d\n\n" % cmd_time]
+        for result_time, cmd in batch:
+            text.append(self._format_result(result_time, *cmd[1:]))
+        text = "".join(text)
+
+        result_fd, result_path = tempfile.mkstemp(
+                prefix='c', dir=self.check_result_path)
+        try:
+            try:
+                os.fchmod(result_fd, 0644)
+                log.trace("Writing Nagios check results: %s", text)
+                _write_all(result_fd, text)
+            except:
+                os.unlink(result_path)
+                raise
+        finally:
+            os.close(result_fd)
+
+        ok_fd = os.open("%s.ok" % result_path,
+                os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0644)
+        os.close(ok_fd)
+
+        if start is not None:
+            if force:
+                self._record_batch(len(batch), start)
+            else:
+                reactor.callFromThread(self._record_batch, len(batch), start)
+
+    def _format_result(self, result_time, host_name,
+            service_description, return_code, output):
+        for arg in (host_name, service_description):
+            assert '\n' not in arg
+
+        return ("### Nagios Service Check Result ###\n"
+                "# Time: %s\n"
+                "host_name=%s\n"
+                "service_description=%s\n"
+                "check_type=1\n"
+                "check_options=0\n"
+                "scheduled_check=0\n"
+                "reschedule_check=0\n"
+                "latency=0.0\n"
+                "start_time=%d.0\n"
+                "finish_time=%d.0\n"
+                "early_timeout=0\n"
+                "exited_ok=1\n"
+                "return_code=%d\n"
+                "output=%s\n\n" % (time.ctime(result_time),
+                    host_name, service_description, result_time,
+                    result_time, int(return_code), escape_output(output)))
+
+
 class NagiosXMLRPC(xmlrpc.XMLRPC):
     """A XMLRPC Protocol for Nagios"""
 
@@ -397,8 +726,8 @@ class NagiosXMLRPC(xmlrpc.XMLRPC):
 
     def _status(self, object_types=(), object_select=()):
         try:
-            stat = nagios_objects.ObjectParser(
-                    self._status_file, object_types, object_select)
+            stat = nagios_objects.ObjectParser(self._status_file,
+                    object_types, object_select, mapped=True)
         except errors.InitError, ex:
             log.error("Failed to parse Nagios status file: %s" % ex)
             raise xmlrpc.Fault(1, "Failed to read Nagios status")
@@ -413,7 +742,7 @@ class NagiosXMLRPC(xmlrpc.XMLRPC):
         """get a struct defining a host"""
         if host_name not in self._objects['host']:
             raise xmlrpc.Fault(1, "Unknown host: %r" % host_name)
-        return self._objects['host'][host_name]
+        return self._objects['host'][host_name].copy()
 
     def xmlrpc_listHostServices(self, host_name):
         """get a list of services on a host"""
@@ -427,7 +756,7 @@ class NagiosXMLRPC(xmlrpc.XMLRPC):
             raise xmlrpc.Fault(1, "Unknown host: %r" % host_name)
         if service_description not in self._objects['service'][host_name]:
             raise xmlrpc.Fault(1, "Unknown service: %r" % service_description)
-        return self._objects['service'][host_name][service_description]
+        return self._objects['service'][host_name][service_description].copy()
 
     def xmlrpc_listHostGroups(self):
         """get a list of host groups"""
@@ -447,7 +776,7 @@ class NagiosXMLRPC(xmlrpc.XMLRPC):
         if servicegroup_name not in self._objects['servicegroup']:
             raise xmlrpc.Fault(1,
                     "Unknown servicegroup: %r" % servicegroup_name)
-        return self._objects['servicegroup'][servicegroup_name]
+        return self._objects['servicegroup'][servicegroup_name].copy()
 
     def xmlrpc_listDowntimes(self):
         """Get a list of currently scheduled downtimes"""
@@ -472,8 +801,9 @@ class NagiosXMLRPC(xmlrpc.XMLRPC):
                 downtime['expr'] = ""
 
         status = self._status(('hostdowntime', 'servicedowntime'))
-        result = {'host': status['hostdowntime'],
-                  'service': status['servicedowntime'] }
+        # Convert to plain dicts that xmlrpc can send
+        result = {'host': [x.copy() for x in status['hostdowntime']],
+                  'service': [x.copy() for x in status['servicedowntime']]}
 
         for dtype in result.itervalues():
             for downtime in dtype:
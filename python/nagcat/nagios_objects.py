@@ -17,6 +17,7 @@
 import re
 
 from nagcat import errors
+from nagcat._object_store import ObjectTable
 
 try:
     from nagcat._object_parser_c import ObjectParser
@@ -26,6 +27,65 @@ except ImportError:
 # Make ObjectParser show in pydoc
 ObjectParser.__module__ == __name__
 
+class Status(object):
+    """Parsed status.dat with lookups of hosts and services by name.
+
+    The indexes are built on first use so each status file is only
+    scanned once no matter how many tests look at it. Pickling keeps
+    only the tables of keys and rows, the indexes are built again.
+    """
+
+    def __init__(self, status_file, object_types=()):
+        parser = ObjectParser(status_file, object_types, mapped=True)
+        self._objects = dict((t, parser[t]) for t in parser.types())
+        self._hosts = None
+        self._services = None
+
+    def __getstate__(self):
+        return dict((t, (table.keys, table.rows))
+                for t, table in self._objects.iteritems())
+
+    def __setstate__(self, state):
+        self._objects = dict((t, ObjectTable.from_rows(keys, rows))
+                for t, (keys, rows) in state.iteritems())
+        self._hosts = None
+        self._services = None
+
+    def index(self):
+        """Build the host and service indexes now"""
+
+        if self._hosts is None:
+            # Reversed so the first entry wins like a linear search
+            self._hosts = dict((h['host_name'], h)
+                    for h in reversed(self._get('host')))
+            self._services = dict(
+                    ((s['host_name'], s['service_description']), s)
+                    for s in reversed(self._get('service')))
+
+    def host(self, host_name):
+        """Get the status of a host or None"""
+
+        self.index()
+        return self._hosts.get(host_name, None)
+
+    def service(self, host_name, description):
+        """Get the status of a service or None"""
+
+        self.index()
+        return self._services.get((host_name, description), None)
+
+    def _get(self, object_type):
+        return self._objects.get(object_type, [])
+
+    def __getitem__(self, key):
+        return self._objects[key]
+
+    def __contains__(self, key):
+        return key in self._objects
+
+    def types(self):
+        return self._objects.keys()
+
 class ConfigParser(object):
     """Parser for the main nagios config file (nagios.cfg)"""
 
@@ -0,0 +1,227 @@
+# Copyright 2010 ITA Software, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Numeric aggregation filters: sum, avg, max, min, count, percentile"""
+
+import math
+
+# Use numpy for the math if it is available
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from zope.interface import classProvides
+from nagcat import errors, filters, log
+
+def _format(value):
+    """Format a number, dropping the .0 from whole numbers"""
+
+    if isinstance(value, (int, long)):
+        return str(value)
+
+    value = float(value)
+    if value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    else:
+        return repr(value)
+
+class _AggregateFilter(filters._Filter):
+    """Collect a column of numbers from each line and combine them.
+
+    Arguments are "<column>,<delimiter>", both optional. Columns
+    start at 0 and are split by whitespace unless a delimiter is
+    given, with no column each whole line is used. Cells that are
+    not numbers, such as headers, are skipped.
+    """
+
+    def __init__(self, test, default, arguments):
+        super(_AggregateFilter, self).__init__(test, default, arguments)
+        self._parse_column(self.arguments)
+
+    def _parse_column(self, arguments):
+        args = arguments.split(",", 1)
+        column = args[0].strip()
+        if column:
+            try:
+                self.column = int(column)
+            except ValueError:
+                raise errors.InitError(
+                        "Invalid %s column: %r" % (self.name, column))
+        else:
+            self.column = None
+
+        if len(args) > 1 and args[1]:
+            self.delimiter = args[1]
+        else:
+            self.delimiter = None
+
+    def _cells(self, result):
+        """Get the selected cell from each line"""
+
+        lines = result.splitlines()
+        if self.column is None:
+            return lines
+
+        column = self.column
+        delimiter = self.delimiter
+        cells = []
+        for line in lines:
+            fields = line.split(delimiter)
+            if -len(fields) <= column < len(fields):
+                cells.append(fields[column])
+        return cells
+
+    def _values(self, result):
+        """Convert the selected cells to numbers"""
+
+        cells = self._cells(result)
+
+        if numpy is not None:
+            try:
+                return numpy.array(cells, dtype=float)
+            except ValueError:
+                pass # Some cells aren't numbers, filter them out.
+
+        values = []
+        for cell in cells:
+            try:
+                values.append(float(cell))
+            except ValueError:
+                pass
+
+        if numpy is not None:
+            return numpy.array(values, dtype=float)
+        else:
+            return values
+
+    @errors.callback
+    def filter(self, result):
+        log.debug("Aggregating %s of column %s", self.name, self.column)
+
+        values = self._values(result)
+
+        if len(values):
+            return _format(self.aggregate(values))
+        elif self.default is not None:
+            return self.default
+        else:
+            raise errors.TestCritical("No numbers found for %s" % self.name)
+
+    def aggregate(self, values):
+        """Combine the list (or numpy array) of floats"""
+        raise Exception("Unimplemented!")
+
+class SumFilter(_AggregateFilter):
+    """Sum of a column"""
+
+    classProvides(filters.IFilter)
+
+    name = "sum"
+
+    def aggregate(self, values):
+        if numpy is not None:
+            return values.sum()
+        else:
+            return math.fsum(values)
+
+class AvgFilter(_AggregateFilter):
+    """Average of a column"""
+
+    classProvides(filters.IFilter)
+
+    name = "avg"
+
+    def aggregate(self, values):
+        if numpy is not None:
+            return values.mean()
+        else:
+            return math.fsum(values) / len(values)
+
+class MaxFilter(_AggregateFilter):
+    """Largest value in a column"""
+
+    classProvides(filters.IFilter)
+
+    name = "max"
+
+    def aggregate(self, values):
+        if numpy is not None:
+            return values.max()
+        else:
+            return max(values)
+
+class MinFilter(_AggregateFilter):
+    """Smallest value in a column"""
+
+    classProvides(filters.IFilter)
+
+    name = "min"
+
+    def aggregate(self, values):
+        if numpy is not None:
+            return values.min()
+        else:
+            return min(values)
+
+class CountFilter(_AggregateFilter):
+    """Number of numeric values in a column"""
+
+    classProvides(filters.IFilter)
+
+    name = "count"
+    handle_default = False
+
+    @errors.callback
+    def filter(self, result):
+        return str(len(self._values(result)))
+
+class PercentileFilter(_AggregateFilter):
+    """Percentile of a column, interpolating between values.
+
+    Arguments are "<percent>,<column>,<delimiter>".
+    """
+
+    classProvides(filters.IFilter)
+
+    name = "percentile"
+
+    def _parse_column(self, arguments):
+        args = arguments.split(",", 1)
+        try:
+            self.percent = float(args[0])
+        except ValueError:
+            raise errors.InitError("Invalid percentile: %r" % args[0])
+
+        if not 0 <= self.percent <= 100:
+            raise errors.InitError("Invalid percentile: %r" % args[0])
+
+        if len(args) > 1:
+            super(PercentileFilter, self)._parse_column(args[1])
+        else:
+            super(PercentileFilter, self)._parse_column("")
+
+    def aggregate(self, values):
+        if numpy is not None:
+            return numpy.percentile(values, self.percent)
+
+        values = sorted(values)
+        index = (len(values) - 1) * self.percent / 100
+        low = int(math.floor(index))
+        high = int(math.ceil(index))
+        if low == high:
+            return values[low]
+        else:
+            return (values[low] * (high - index) +
+                    values[high] * (index - low))
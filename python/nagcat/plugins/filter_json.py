@@ -0,0 +1,159 @@
+# Copyright 2010 ITA Software, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""JSON Filters"""
+
+import re
+
+# Gracefully disable json support if not found
+try:
+    import json
+except ImportError:
+    try:
+        import simplejson as json
+    except ImportError:
+        json = None
+
+from zope.interface import classProvides
+from nagcat import errors, filters, log
+
+# Path steps: .name, ..name, .*, ..*, [0], [*], ['name'] or ["name"]
+_STEP = re.compile(r"""(\.\.?)([A-Za-z_$][\w$-]*|\*)"""
+                   r"""|\[\s*(?:(-?\d+)|(\*)|'([^']*)'|"([^"]*)")\s*\]""")
+
+def _parse_json(data):
+    try:
+        return json.loads(data)
+    except ValueError, ex:
+        raise errors.TestCritical("Invalid JSON: %s" % ex)
+
+def _compile_path(path):
+    """Split a JSONPath expression into a list of (descend, key) steps.
+
+    key is a str for object members, an int for array indexes or
+    None for wildcards. descend is True for the recursive .. step.
+    """
+
+    path = path.strip()
+    if path.startswith("$"):
+        path = path[1:]
+    if path and path[0] not in ".[":
+        path = "." + path
+
+    steps = []
+    index = 0
+    while index < len(path):
+        match = _STEP.match(path, index)
+        if not match:
+            raise errors.InitError(
+                    "Invalid JSON path '%s' at '%s'" % (path, path[index:]))
+
+        dots, name, number, star, quote1, quote2 = match.groups()
+        if dots:
+            if name == "*":
+                name = None
+            steps.append((dots == "..", name))
+        elif number is not None:
+            steps.append((False, int(number)))
+        elif star:
+            steps.append((False, None))
+        elif quote1 is not None:
+            steps.append((False, quote1))
+        else:
+            steps.append((False, quote2))
+
+        index = match.end()
+
+    return steps
+
+def _children(node):
+    if isinstance(node, dict):
+        return [node[k] for k in sorted(node)]
+    elif isinstance(node, list):
+        return node
+    else:
+        return []
+
+def _select(node, key):
+    if key is None:
+        return _children(node)
+    elif isinstance(key, int):
+        if isinstance(node, list) and -len(node) <= key < len(node):
+            return [node[key]]
+    elif isinstance(node, dict) and key in node:
+        return [node[key]]
+    return []
+
+def _descendants(node):
+    yield node
+    for child in _children(node):
+        for value in _descendants(child):
+            yield value
+
+def _format(value):
+    if isinstance(value, unicode):
+        return value.encode("utf-8")
+    elif isinstance(value, str):
+        return value
+    else:
+        return json.dumps(value, separators=(',',':'), sort_keys=True)
+
+class JSONPathFilter(filters._Filter):
+    """Fetch something out of a JSON document using a JSONPath."""
+
+    classProvides(filters.IFilter)
+
+    name = "jsonpath"
+
+    def __init__(self, test, default, arguments):
+        super(JSONPathFilter, self).__init__(test, default, arguments)
+
+        if not json:
+            raise errors.InitError("json or simplejson is required "
+                                   "for JSON support.")
+
+        self.path = _compile_path(self.arguments)
+
+    @errors.callback
+    def filter(self, result):
+        log.debug("Fetching JSON value %s", self.arguments)
+
+        matches = [filters.parse(self.test, _parse_json, result)]
+        for descend, key in self.path:
+            if descend:
+                nodes = []
+                for node in matches:
+                    nodes.extend(_descendants(node))
+            else:
+                nodes = matches
+
+            matches = []
+            for node in nodes:
+                matches.extend(_select(node, key))
+
+        if matches:
+            return "\n".join([_format(x) for x in matches])
+        elif self.default is not None:
+            return self.default
+        else:
+            raise errors.TestCritical(
+                    "Failed to find JSON value %s" % self.arguments)
+
+class JSONFilter(JSONPathFilter):
+    """Same as jsonpath, without arguments the whole document is
+    returned in its compact form."""
+
+    classProvides(filters.IFilter)
+
+    name = "json"
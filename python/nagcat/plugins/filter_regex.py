@@ -69,14 +69,10 @@ class GrepFilter(filters._Filter):
     def filter(self, result):
         log.debug("Grepping regex '%s'", self.arguments)
 
-        output = ""
-        for line in result.splitlines(True):
-            if self.regex.search(line):
-                if not self.invert:
-                    output += line
-            else:
-                if self.invert:
-                    output += line
+        search = self.regex.search
+        invert = self.invert
+        output = "".join([line for line in result.splitlines(True)
+                          if (search(line) is None) == invert])
 
         if output:
             return output
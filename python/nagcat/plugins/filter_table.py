@@ -15,6 +15,7 @@
 """Table (csv, etc) Filter"""
 
 import csv
+import itertools
 from cStringIO import StringIO
 from zope.interface import classProvides
 from nagcat import errors, filters, log
@@ -26,6 +27,9 @@ class TableFilter(filters._Filter):
 
     name = "table"
 
+    # Maximum amount of data given to csv.Sniffer
+    SNIFF_SIZE = 65536
+
     def __init__(self, test, default, arguments):
         super(TableFilter, self).__init__(test, default, arguments)
 
@@ -48,6 +52,16 @@ class TableFilter(filters._Filter):
         if self.row is None and self.col is None:
             raise errors.InitError("Empty table filter: %r" % self.arguments)
 
+        # Cached between runs, see _filter_without_default and _column
+        self._dialect = None
+        self._header = None
+
+    def copy(self, test):
+        new = super(TableFilter, self).copy(test)
+        new._dialect = None
+        new._header = None
+        return new
+
     @errors.callback
     def filter(self, result):
         try:
@@ -61,42 +75,66 @@ class TableFilter(filters._Filter):
     def _filter_without_default(self, result):
         log.debug("Fetching cell %s,%s from table", self.row, self.col)
 
+        # Reuse the dialect found last time, only sniffing again
+        # if the data no longer makes sense with it.
+        old = self._dialect
+        if old is not None:
+            try:
+                return self._select(result, old)
+            except errors.TestCritical, ex:
+                error = ex
+
+        self._dialect = dialect = self._sniff(result)
+        if old is not None and _dialect_key(old) == _dialect_key(dialect):
+            raise error
+
+        return self._select(result, dialect)
+
+    def _sniff(self, result):
+        # Only look at the start of large tables, it is plenty
+        sample = result
+        if len(sample) > self.SNIFF_SIZE:
+            sample = sample[:self.SNIFF_SIZE]
+            end = sample.rfind('\n')
+            if end > 0:
+                sample = sample[:end+1]
+
+        try:
+            return csv.Sniffer().sniff(sample)
+        except csv.Error, ex:
+            raise errors.TestCritical("Failed to parse table: %s" % ex)
+
+    def _select(self, result, dialect):
         try:
-            sniffer = csv.Sniffer()
-            dialect = sniffer.sniff(result)
             reader = csv.reader(StringIO(result), dialect)
-            table = list(reader)
+            return self._select_rows(reader, dialect)
         except csv.Error, ex:
             raise errors.TestCritical("Failed to parse table: %s" % ex)
 
-        if not table:
+    def _select_rows(self, reader, dialect):
+        try:
+            first = reader.next()
+        except StopIteration:
             raise errors.TestCritical("Empty table")
 
-        # If col is not an index, assume we have a header to work with.
-        if isinstance(self.col, str):
-            try:
-                col = table[0].index(self.col)
-            except ValueError:
-                raise errors.TestCritical("No such column %s" % self.col)
-        else:
-            col = self.col
+        rows = itertools.chain([first], reader)
+        col = self._column(first)
 
         if self.row is not None:
             if isinstance(self.row, int):
-                try:
-                    row = table[self.row]
-                except IndexError:
+                i = 0
+                for i, row in enumerate(rows):
+                    if i == self.row:
+                        break
+                else:
                     raise errors.TestCritical(
                             "No such row %s, last row is %s" %
-                            (self.row, len(table)-1))
+                            (self.row, i))
             else:
-                row = None
-                for r in table:
-                    if r and r[0] == self.row:
-                        row = r
+                for row in rows:
+                    if row and row[0] == self.row:
                         break
-
-                if row is None:
+                else:
                     raise errors.TestCritical(
                             "No row starting with %s" % (self.row,))
 
@@ -109,17 +147,38 @@ class TableFilter(filters._Filter):
             else:
                 table = [row]
         else:
-            data = []
-            for i, row in enumerate(table):
+            table = []
+            for i, row in enumerate(rows):
                 try:
-                    data.append([row[col]])
+                    table.append([row[col]])
                 except IndexError:
                     raise errors.TestCritical("No such column %s in row %s" %
                             (self.col, i))
-            table = data
 
         # Our result was a row or a column rather than cell so re-output
         io = StringIO()
         writer = csv.writer(io, dialect, lineterminator='\n')
         writer.writerows(table)
         return io.getvalue().rstrip()
+
+    def _column(self, header):
+        """Find the column index, looking up names in the header row"""
+
+        # If col is not an index, assume we have a header to work with.
+        if not isinstance(self.col, str):
+            return self.col
+
+        if self._header is not None and self._header[0] == header:
+            return self._header[1]
+
+        try:
+            col = header.index(self.col)
+        except ValueError:
+            raise errors.TestCritical("No such column %s" % self.col)
+
+        self._header = (header, col)
+        return col
+
+def _dialect_key(dialect):
+    return (dialect.delimiter, dialect.quotechar, dialect.escapechar,
+            dialect.doublequote, dialect.skipinitialspace, dialect.quoting)
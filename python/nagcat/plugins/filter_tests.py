@@ -25,6 +25,7 @@ class SaveFilter(filters._Filter):
 
     name = "save"
     handle_default = False
+    shareable = False
 
     def __init__(self, test, default, arguments):
         super(SaveFilter, self).__init__(test, default, arguments)
@@ -53,6 +54,9 @@ class BaseTestFilter(filters._Filter):
         except util.TesterError, ex:
             raise errors.InitError("Invalid %s test: %s" % (self.name, ex))
 
+        # Tests using $(NOW) must be re-evaluated every time
+        self.dynamic = self.tester.compiled is None
+
         # Only attempt to handle errors if we have something to override
         self.handle_errors = bool(self.override_errors)
         assert self.raise_error
@@ -14,6 +14,7 @@
 
 """XML Filters"""
 
+import re
 from cStringIO import StringIO
 
 # Gracefully disable xml/xpath support if not found
@@ -25,6 +26,22 @@ except ImportError:
 from zope.interface import classProvides
 from nagcat import errors, filters, log
 
+def _parse_xml(data):
+    try:
+        return etree.fromstring(data)
+    except etree.XMLSyntaxError, ex:
+        raise errors.TestCritical("Invalid XML: %s" % ex)
+
+def _parse_html(data):
+    try:
+        # Remove comments because HTML allows things in
+        # comments that XML does not. Are there other
+        # things that I should be filtering?
+        parser = etree.HTMLParser(remove_comments=True)
+        return etree.parse(StringIO(data), parser)
+    except etree.XMLSyntaxError, ex:
+        raise errors.TestCritical("Invalid HTML: %s" % ex)
+
 class XPathFilter(filters._Filter):
     """Fetch something out of an XML document using XPath."""
 
@@ -55,11 +72,7 @@ class XPathFilter(filters._Filter):
 
         log.debug("Fetching XML element %s", self.arguments)
 
-        try:
-            root = etree.fromstring(result)
-        except etree.XMLSyntaxError, ex:
-            raise errors.TestCritical("Invalid XML: %s" % ex)
-
+        root = filters.parse(self.test, _parse_xml, result)
         data = self.xpath(root)
 
         if isinstance(data, list) and data:
@@ -73,6 +86,96 @@ class XPathFilter(filters._Filter):
         else:
             return format(data)
 
+class XPathStreamFilter(filters._Filter):
+    """Fetch the first match for a simple XPath without loading the
+    whole XML document, useful for very large documents.
+
+    Only paths made of element names are supported, either absolute
+    (/a/b/c) or relative to any element (//b/c), optionally ending
+    with an attribute (/@name) or text() step.
+    """
+
+    classProvides(filters.IFilter)
+
+    name = "xpathstream"
+
+    path_format = re.compile(r"^(//?)([\w.-]+(?:/[\w.-]+)*)"
+                             r"(?:/(@[\w.-]+|text\(\)))?$")
+
+    def __init__(self, test, default, arguments):
+        super(XPathStreamFilter, self).__init__(test, default, arguments)
+
+        if not etree:
+            raise errors.InitError("lxml is required for XPath support.")
+
+        match = self.path_format.match(self.arguments)
+        if not match:
+            raise errors.InitError(
+                    "Invalid or unsupported streaming XPath '%s'" %
+                    self.arguments)
+
+        self.anywhere = match.group(1) == "//"
+        self.path = match.group(2).split("/")
+        self.attribute = None
+        self.text = False
+        if match.group(3) == "text()":
+            self.text = True
+        elif match.group(3):
+            self.attribute = match.group(3)[1:]
+
+    def _match(self, stack):
+        if self.anywhere:
+            return stack[-len(self.path):] == self.path
+        else:
+            return stack == self.path
+
+    @errors.callback
+    def filter(self, result):
+        log.debug("Streaming XML element %s", self.arguments)
+
+        stack = []
+        # Number of open elements matching the path, these must
+        # be kept intact until they are complete.
+        matching = 0
+
+        try:
+            for event, elem in etree.iterparse(StringIO(result),
+                                               events=("start", "end")):
+                if event == "start":
+                    # Ignore namespaces
+                    stack.append(elem.tag.rsplit("}", 1)[-1])
+                    if self._match(stack):
+                        if self.attribute is not None:
+                            value = elem.get(self.attribute)
+                            if value is not None:
+                                return value
+                        else:
+                            matching += 1
+                    continue
+
+                if self.attribute is None and self._match(stack):
+                    matching -= 1
+                    if not self.text:
+                        return etree.tostring(elem, pretty_print=True,
+                                with_tail=False).strip()
+                    elif elem.text:
+                        return elem.text.strip()
+
+                stack.pop()
+                if not matching:
+                    # Free everything we are done with
+                    elem.clear()
+                    while elem.getprevious() is not None:
+                        del elem.getparent()[0]
+        except etree.XMLSyntaxError, ex:
+            raise errors.TestCritical("Invalid XML: %s" % ex)
+
+        if self.default is not None:
+            return self.default
+        else:
+            raise errors.TestCritical(
+                    "Failed to find xml element %s" % self.arguments)
+
 class XSLTFilter(filters._Filter):
     """Transform XML with a given XSLT document"""
 
@@ -105,10 +208,7 @@ class XSLTFilter(filters._Filter):
 
     @errors.callback
     def filter(self, result):
-        try:
-            input = etree.fromstring(result)
-        except etree.XMLSyntaxError, ex:
-            raise errors.TestCritical("Invalid XML: %s" % ex)
+        input = filters.parse(self.test, _parse_xml, result)
 
         try:
             output = self.xslt(input)
@@ -136,13 +236,5 @@ class HtmlFilter(filters._Filter):
 
     @errors.callback
     def filter(self, result):
-        try:
-            # Remove comments because HTML allows things in
-            # comments that XML does not. Are there other
-            # things that I should be filtering?
-            parser = etree.HTMLParser(remove_comments=True)
-            html = etree.parse(StringIO(result), parser)
-        except etree.XMLSyntaxError, ex:
-            raise errors.TestCritical("Invalid HTML: %s" % ex)
-
+        html = filters.parse(self.test, _parse_html, result)
         return etree.tostring(html, pretty_print=True)
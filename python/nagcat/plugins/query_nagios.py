@@ -41,12 +41,7 @@ class HostQuery(query.Query):
 
     def _nagios_select(self):
         status = self._nagcat.nagios_status()
-        found = None
-        for host in status['host']:
-            if (host['host_name'] == self.host):
-                found = host
-                break
-
+        found = status.host(self.host)
         if not found:
             raise errors.TestCritical("No such host %s" % (self.host,))
 
@@ -95,13 +90,7 @@ class ServiceQuery(HostQuery):
 
     def _nagios_select(self):
         status = self._nagcat.nagios_status()
-        found = None
-        for service in status['service']:
-            if (service['service_description'] == self.conf['description']
-                    and service['host_name'] == self.host):
-                found = service
-                break
-
+        found = status.service(self.host, self.conf['description'])
         if not found:
             raise errors.TestCritical("No such service %s/%s" %
                     (self.host, self.conf['description']))
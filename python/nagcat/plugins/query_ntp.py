@@ -14,42 +14,99 @@
 
 """NTP Querys"""
 
+import time
 import struct
 
 from zope.interface import classProvides
 from twisted.internet import reactor, defer, protocol
 
-from nagcat import errors, query
+from nagcat import errors, log, query
 
 
 # Unix and NTP have different epoch values
 TIME1970 = 2208988800L
 
 class NTPProtocol(protocol.DatagramProtocol):
+    """Hand all packets received on the shared socket to the client"""
 
     noisy = False
 
-    def __init__(self, host, port, deferred):
-        """cb is a function to call with a time"""
-        self.host = host
-        self.port = port
-        self.deferred = deferred
+    def __init__(self, client):
+        self.client = client
 
-    def startProtocol(self):
-        self.transport.connect(self.host, self.port)
-        self.transport.write('\x1b' + 47 * '\0')
+    def datagramReceived(self, data, addr):
+        self.client.datagramReceived(data, addr)
+
+class NTPClient(object):
+    """A single UDP socket shared by all NTP queries.
+
+    Each request is sent with a unique transmit timestamp which the
+    server echos back as the originate timestamp in its reply so the
+    two can be matched up along with the server's address. The socket
+    is opened by the first request and then kept for the life of the
+    client so infrequent checks do not bind a new port every time.
+    """
+
+    def __init__(self):
+        self._pending = {}
+        self._listener = None
+        self._serial = 0
+
+    def request(self, addr, port, timeout):
+        """Send a request, returns a Deferred that fires with the time"""
+
+        if self._listener is None:
+            self._listener = reactor.listenUDP(0, NTPProtocol(self))
+
+        # The seconds field is the real time so servers that care
+        # see a sane value, the fraction just needs to be unique.
+        self._serial = (self._serial + 1) & 0xffffffff
+        stamp = (int(time.time()) + TIME1970, self._serial)
+        key = (addr, port) + stamp
+
+        deferred = defer.Deferred()
+        call_id = reactor.callLater(timeout, self._timeout, key)
+        self._pending[key] = (deferred, call_id)
+
+        packet = struct.pack('!B39xII', 0x1b, *stamp)
+        try:
+            self._listener.write(packet, (addr, port))
+        except Exception:
+            del self._pending[key]
+            call_id.cancel()
+            return defer.fail(errors.Failure())
+
+        return deferred
+
+    def close(self):
+        """Stop listening, outstanding requests will time out"""
+        if self._listener is not None:
+            deferred = self._listener.stopListening()
+            self._listener = None
+            return deferred
+
+    def _timeout(self, key):
+        deferred, call_id = self._pending.pop(key)
+        deferred.errback(errors.Failure(errors.TestCritical(
+            "Timeout waiting for NTP response")))
 
     def datagramReceived(self, data, addr):
         if len(data) != 12*4:
-            self.deferred.errback(errors.Failure(errors.TestCritical(
-                "Invalid packet size: %s" % len(data))))
+            log.debug("Invalid NTP packet size from %s: %s", addr, len(data))
+            return
 
         pkt = struct.unpack('!12I', data)
-        self.deferred.callback(str(pkt[10] - TIME1970))
+        key = addr + pkt[6:8]
+        if key not in self._pending:
+            log.debug("Unexpected NTP packet from %s", addr)
+            return
+
+        deferred, call_id = self._pending.pop(key)
+        call_id.cancel()
+        deferred.callback(str(pkt[10] - TIME1970))
 
-    def connectionRefused(self):
-        self.deferred.errback(errors.Failure(
-            errors.TestCritical("Connection Refused")))
+# All NTP queries use this client
+_client = NTPClient()
 
 class NTPQuery(query.Query):
     """Fetch the time from a NTP server"""
@@ -64,21 +121,8 @@ class NTPQuery(query.Query):
         self.conf['port'] = int(conf.get('port', 123))
 
     def _start(self):
-        deferred = defer.Deferred()
-        protocol = NTPProtocol(self.addr, self.conf['port'], deferred)
-        listener = reactor.listenUDP(0, protocol)
-        timeout = reactor.callLater(self.conf['timeout'],
-                lambda: deferred.errback(errors.Failure(errors.TestCritical(
-                        "Timeout waiting for NTP response"))))
-
-        def stop(result):
-            if timeout.active():
-                timeout.cancel()
-            listener.stopListening()
-            return result
-
-        deferred.addBoth(stop)
-        return deferred
+        return _client.request(self.addr, self.conf['port'],
+                self.conf['timeout'])
 
     def __str__(self):
         # disable query grouping for ntp, it is light weight enough
@@ -17,10 +17,12 @@
 import os
 import re
 import signal
+import struct
 import cPickle
+from collections import deque
 
 from zope.interface import classProvides
-from twisted.internet import defer, error, process, protocol, reactor
+from twisted.internet import defer, process, protocol, reactor
 from twisted.python import failure
 from coil.struct import Struct
 
@@ -37,88 +39,153 @@ except ImportError:
 from nagcat import errors, log, query
 
 
-class PickleReader(protocol.ProcessProtocol):
+# Jobs and results are passed between the parent and the workers
+# as pickles prefixed by their length on a pair of extra pipes.
+JOB_FD = 3
+RESULT_FD = 4
+_HEADER = struct.Struct("!I")
 
-    def __init__(self, fd):
-        self.fd = fd
+def _write_frame(fd, obj):
+    data = cPickle.dumps(obj, -1)
+    data = _HEADER.pack(len(data)) + data
+    while data:
+        data = data[os.write(fd, data):]
+
+def _read_exactly(fd, size):
+    data = ""
+    while len(data) < size:
+        chunk = os.read(fd, size - len(data))
+        if not chunk:
+            raise EOFError("Lost connection to parent")
+        data += chunk
+    return data
+
+def _read_frame(fd):
+    size, = _HEADER.unpack(_read_exactly(fd, _HEADER.size))
+    return cPickle.loads(_read_exactly(fd, size))
+
+
+class WorkerProtocol(protocol.ProcessProtocol):
+    """Read results sent back by an OracleWorker"""
+
+    def __init__(self, worker):
+        self.worker = worker
         self.data = ""
-        self.timedout = False
-        self.deferred = defer.Deferred()
 
     def childDataReceived(self, fd, data):
-        assert self.fd == fd
+        assert fd == RESULT_FD
         self.data += data
 
-    def timeout(self):
-        self.timedout = True
-        if self.transport.pid:
-            try:
-                os.kill(self.transport.pid, signal.SIGTERM)
-            except OSError, ex:
-                log.warn("Failed to send TERM to a subprocess: %s", ex)
+        while len(self.data) >= _HEADER.size:
+            size, = _HEADER.unpack(self.data[:_HEADER.size])
+            end = _HEADER.size + size
+            if len(self.data) < end:
+                break
 
-    def processEnded(self, reason):
-        if isinstance(reason.value, error.ProcessDone):
+            frame = self.data[_HEADER.size:end]
+            self.data = self.data[end:]
             try:
-                self.deferred.callback(cPickle.loads(self.data))
+                ok, result = cPickle.loads(frame)
             except Exception:
-                self.deferred.errback(failure.Failure())
-        elif (isinstance(reason.value, error.ProcessTerminated)
-                and self.timedout):
-            self.deferred.errback(errors.Failure(errors.TestCritical(
-                    "Timeout waiting for Oracle query to finish.")))
-        else:
-            self.deferred.errback(reason)
-
-
-class ForkIt(process.Process):
+                result = failure.Failure()
+            else:
+                if not ok:
+                    result = errors.Failure(result)
+            self.worker.resultReceived(result)
 
-    def __init__(self, timeout, func, *args, **kwargs):
-        readfd, writefd = os.pipe()
-        self._write = os.fdopen(writefd, 'w')
-        self._func = func
-        self._args = args
-        self._kwargs = kwargs
-        proto = PickleReader(writefd)
+    def processEnded(self, reason):
+        self.worker.workerEnded(reason)
 
-        # Setup timeout
-        call_id = reactor.callLater(timeout, proto.timeout)
-        proto.deferred.addBoth(self._cancelTimeout, call_id)
 
-        # Setup shutdown cleanup
-        call_id = reactor.addSystemEventTrigger(
-                'after', 'shutdown', proto.timeout)
-        proto.deferred.addBoth(self._cancelCleanup, call_id)
+class OracleWorker(process.Process):
+    """A forked process that keeps an Oracle connection open
+    and runs queries sent to it by the parent one at a time."""
 
+    def __init__(self, pool, key):
+        self.pool = pool
+        self.key = key
+        self.job = None
+        self.ended = defer.Deferred()
+        proto = WorkerProtocol(self)
         process.Process.__init__(self, reactor, executable=None, args=None,
                 environment=None, path=None, proto=proto,
-                childFDs={0:0, 1:1, 2:2, writefd: writefd})
-        self.pipes[writefd] = self.processReaderFactory(
-                reactor, self, writefd, readfd)
-        self._write.close()
-
-    def getResult(self):
-        return self.proto.deferred
+                childFDs={0:0, 1:1, 2:2, JOB_FD:'w', RESULT_FD:'r'})
+
+    def run(self, job):
+        """Send a job to the worker, it must be idle"""
+        assert self.job is None
+        self.job = job
+        job.worker = self
+        data = cPickle.dumps(job.request, -1)
+        self.writeToChild(JOB_FD, _HEADER.pack(len(data)) + data)
+
+    def resultReceived(self, result):
+        job, self.job = self.job, None
+        if job is not None:
+            job.finish(result)
+        self.pool.dispatch(self.key)
+
+    def workerEnded(self, reason):
+        self.pool.remove(self)
+        job, self.job = self.job, None
+        if job is not None:
+            job.finish(errors.Failure(errors.TestCritical(
+                "Oracle worker exited unexpectedly: %s" % reason.value)))
+        self.ended.callback(None)
+        self.pool.dispatch(self.key)
+
+    def stop(self):
+        """Ask the worker to exit once it is idle"""
+        self.closeChildFD(JOB_FD)
+
+    def kill(self):
+        """Terminate the worker immediately"""
+        if self.pid:
+            try:
+                os.kill(self.pid, signal.SIGTERM)
+            except OSError, ex:
+                log.warn("Failed to send TERM to a subprocess: %s", ex)
 
-    def _cancelTimeout(self, result, call_id):
-        if call_id.active():
-            call_id.cancel()
-        return result
+    def _execChild(self, *ignore, **kgnore):
+        """Run the worker loop instead of exec"""
+        connection = None
+        while True:
+            try:
+                query_class, conf = _read_frame(JOB_FD)
+            except EOFError:
+                break
 
-    def _cancelCleanup(self, result, call_id):
-        reactor.removeSystemEventTrigger(call_id)
-        return result
+            try:
+                if connection is None:
+                    connection = cx_Oracle.connect(user=self.key[0],
+                            password=self.key[1], dsn=self.key[2])
+                result = (True, query_class._run_query(connection, conf))
+            except cx_Oracle.Error, ex:
+                result = (False, errors.TestCritical(
+                        "Oracle query failed: %s" % ex))
+                # The connection may be unusable, start over next time
+                connection = self._close(connection)
+            except Exception, ex:
+                result = (False, ex)
+
+            # Failure objects don't survive pickling, send the
+            # exception itself and wrap it up again in the parent.
+            try:
+                _write_frame(RESULT_FD, result)
+            except (cPickle.PicklingError, TypeError):
+                _write_frame(RESULT_FD, (False, Exception(repr(result[1]))))
 
-    def _execChild(self, *ignore, **kgnore):
-        """Run our function instead of exec"""
-        try:
-            result = self._func(*self._args, **self._kwargs)
-        except Exception:
-            result = failure.Failure()
-        cPickle.dump(result, self._write, -1)
-        self._write.close()
+        self._close(connection)
         os._exit(0)
 
+    def _close(self, connection):
+        if connection is not None:
+            try:
+                connection.close()
+            except cx_Oracle.Error:
+                pass
+        return None
+
     def _resetSignalDisposition(self):
         """Reset non-standard signal handlers."""
         for signalnum in xrange(1, signal.NSIG):
@@ -127,6 +194,116 @@ class ForkIt(process.Process):
                 signal.signal(signalnum, signal.SIG_DFL)
 
 
+class _OracleJob(object):
+    """A query waiting for or running in a worker"""
+
+    def __init__(self, key, request, timeout, on_timeout):
+        self.key = key
+        self.request = request
+        self.worker = None
+        self.deferred = defer.Deferred()
+        self.timer = reactor.callLater(timeout, on_timeout, self)
+
+    def finish(self, result):
+        if self.timer.active():
+            self.timer.cancel()
+        self.deferred.callback(result)
+
+
+class OraclePool(object):
+    """Persistent worker processes shared by all Oracle queries.
+
+    Workers are grouped by login so each keeps a single connection
+    open across queries rather than forking and connecting every
+    time. A worker whose query hits the timeout is killed and a new
+    one is started when the next query needs it.
+    """
+
+    #: Maximum number of concurrent workers for each login
+    max_workers = 4
+
+    def __init__(self):
+        self._workers = {}
+        self._queues = {}
+        self._trigger = None
+
+    def submit(self, key, request, timeout):
+        """Queue request to be run by a worker for key.
+
+        Returns a Deferred with the query result.
+        """
+        job = _OracleJob(key, request, timeout, self._timeout)
+        self._queues.setdefault(key, deque()).append(job)
+        self.dispatch(key)
+        return job.deferred
+
+    def dispatch(self, key):
+        """Hand queued jobs to idle workers, starting more as needed"""
+
+        queue = self._queues.get(key)
+        workers = self._workers.setdefault(key, [])
+
+        while queue:
+            for worker in workers:
+                if worker.job is None:
+                    break
+            else:
+                if len(workers) >= self.max_workers:
+                    return
+                try:
+                    worker = self._spawn(key)
+                except Exception:
+                    queue.popleft().finish(failure.Failure())
+                    continue
+
+            worker.run(queue.popleft())
+
+    def remove(self, worker):
+        """Stop giving jobs to worker"""
+        workers = self._workers.get(worker.key, ())
+        if worker in workers:
+            workers.remove(worker)
+
+    def shutdown(self):
+        """Stop all workers.
+
+        Returns a Deferred that fires once they have all exited.
+        """
+        ended = []
+        for workers in self._workers.values():
+            for worker in workers[:]:
+                ended.append(worker.ended)
+                if worker.job is None:
+                    worker.stop()
+                else:
+                    worker.kill()
+        return defer.DeferredList(ended)
+
+    def _spawn(self, key):
+        if self._trigger is None:
+            self._trigger = reactor.addSystemEventTrigger(
+                    'before', 'shutdown', self.shutdown)
+        worker = OracleWorker(self, key)
+        self._workers[key].append(worker)
+        return worker
+
+    def _timeout(self, job):
+        worker = job.worker
+        if worker is None:
+            self._queues[job.key].remove(job)
+        else:
+            # The worker is stuck, abandon it.
+            worker.job = None
+            self.remove(worker)
+            worker.kill()
+
+        job.deferred.errback(errors.Failure(errors.TestCritical(
+                "Timeout waiting for Oracle query to finish.")))
+        self.dispatch(job.key)
+
+pool = OraclePool()
+
+
 class _DBColumn:
     """describes the name and type of a column, to facilitate mapping the
     attributes of a DB column into XML attribs (taken by processing
@@ -176,7 +353,7 @@ class _DBColumn:
 class OracleBase(query.Query):
     """Base query code for both SQL and PL/SQL queries.
 
-    Subclasses must provide _start_oracle()
+    Subclasses must provide _query() which is run in a worker process.
     """
 
     def __init__(self, nagcat, conf):
@@ -192,28 +369,25 @@ class OracleBase(query.Query):
             self.conf[param] = conf[param]
 
     def _start(self):
-        proc = ForkIt(self.conf['timeout'], self._forked)
-        return proc.getResult()
+        key = (self.conf['user'], self.conf['password'], self.conf['dsn'])
+        return pool.submit(key, (self.__class__, self.conf),
+                           self.conf['timeout'])
 
-    def _forked(self):
+    @classmethod
+    def _run_query(cls, connection, conf):
+        """Called in the worker process with an open connection"""
+        cursor = connection.cursor()
         try:
-            connection = cx_Oracle.connect(
-                    user=self.conf['user'],
-                    password=self.conf['password'],
-                    dsn=self.conf['dsn'])
-            cursor = connection.cursor()
-            try:
-                return self._forked_query(cursor)
-            finally:
-                cursor.close()
-                connection.close()
-        except cx_Oracle.Error, ex:
-            return errors.Failure(errors.TestCritical("Oracle query failed: %s" % ex))
+            return cls._query(cursor, conf)
+        finally:
+            cursor.close()
 
-    def _forked_query(self, cursor):
+    @classmethod
+    def _query(cls, cursor, conf):
         raise Exception("unimplemented")
 
-    def _to_xml(self, cursor, root="queryresult"):
+    @classmethod
+    def _to_xml(cls, cursor, root="queryresult"):
         """Convert a table to XML Elements
 
         example: select 1 as foo from dual
@@ -238,8 +412,9 @@ class OracleBase(query.Query):
             tree.append(xmlrow)
         return tree
 
-    def _to_string(self, cursor):
-        return etree.tostring(self._to_xml(cursor), pretty_print=True)
+    @classmethod
+    def _to_string(cls, cursor):
+        return etree.tostring(cls._to_xml(cursor), pretty_print=True)
 
 
 class OracleSQL(OracleBase):
@@ -277,9 +452,10 @@ class OracleSQL(OracleBase):
 
         self.conf['parameters'] = parameters
 
-    def _forked_query(self, cursor):
-        cursor.execute(self.conf['sql'], self.conf['parameters'])
-        return self._to_string(cursor)
+    @classmethod
+    def _query(cls, cursor, conf):
+        cursor.execute(conf['sql'], conf['parameters'])
+        return cls._to_string(cursor)
 
 
 class OracleSQL2(OracleSQL):
@@ -345,9 +521,10 @@ class OraclePLSQL(OracleBase):
 
         return param
 
-    def _build_params(self, cursor):
+    @classmethod
+    def _build_params(cls, cursor, conf):
         params = []
-        for param in self.conf['parameters']:
+        for param in conf['parameters']:
             if param[0] == "in":
                 params.append(param[2])
             elif param[0] == "out":
@@ -356,18 +533,19 @@ class OraclePLSQL(OracleBase):
                 assert 0
         return params
 
-    def _forked_query(self, cursor):
-        result = cursor.callproc(self.conf['procedure'],
-                                 self._build_params(cursor))
+    @classmethod
+    def _query(cls, cursor, conf):
+        result = cursor.callproc(conf['procedure'],
+                                 cls._build_params(cursor, conf))
 
         # Convert the 'out' parameters into XML.
         root = etree.Element('result')
-        for i, param in enumerate(self.conf['parameters']):
+        for i, param in enumerate(conf['parameters']):
             if param[0] != 'out':
                 continue
 
             if isinstance(result[i], cx_Oracle.Cursor):
-                tree = self._to_xml(result[i], param[1])
+                tree = cls._to_xml(result[i], param[1])
                 root.append(tree)
             else:
                 item = _DBColumn.single_element(
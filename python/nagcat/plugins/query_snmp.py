@@ -15,6 +15,7 @@
 """SNMP Querys"""
 
 from zope.interface import classProvides
+from twisted.internet import reactor
 from twisted.internet import error as neterror
 from twisted.python import failure
 
@@ -66,6 +67,16 @@ class SNMPCommon(query.Query):
         """This attribute is global across all SNMP classes"""
         SNMPCommon._use_bulk = bool(value)
 
+    @staticmethod
+    def mib_cache(path):
+        """Persist OID name lookups across restarts in the given file.
+
+        The cache is written out once the reactor starts, by then all
+        tests have been configured and their OIDs resolved.
+        """
+        netsnmp.load_mib_cache(path)
+        reactor.callWhenRunning(netsnmp.save_mib_cache)
+
 class SNMPQuery(SNMPCommon):
     """Fetch a single value via SNMP"""
 
@@ -166,12 +166,43 @@ class SubprocessQuery(SubprocessBase):
         else:
             return reason
 
-class NagiosPluginQuery(query.Query):
-    """Query that runs a command"""
+class PerfValue(str):
+    """A single performance data value.
+
+    The string itself is the value including any unit, the number
+    and unit are also available separately along with the remaining
+    fields as attributes which are None if they were not given.
+    """
+
+    # value[UOM], the value may also be U for unknown
+    number_format = re.compile(r'^([-+]?(?:\d+\.?\d*|\.\d+)'
+                               r'(?:[eE][-+]?\d+)?)(.*)$')
+
+    def __new__(cls, match):
+        self = str.__new__(cls, match.group('value'))
+        self.label = match.group('label')
+        self.warn = match.group('warn')
+        self.crit = match.group('crit')
+        self.min = match.group('min')
+        self.max = match.group('max')
+
+        number = self.number_format.match(self)
+        if number:
+            self.number, self.uom = number.groups()
+        else:
+            self.number = self.uom = None
 
-    classProvides(query.IQuery)
+        return self
 
-    name = "nagios_plugin"
+    def fields(self):
+        """Get all fields as a dict, used by trending to record
+        the value without its unit of measure."""
+        return {'value': self.number, 'uom': self.uom,
+                'warn': self.warn, 'crit': self.crit,
+                'min': self.min, 'max': self.max}
+
+class PerfData(dict):
+    """Performance data indexed by label"""
 
     # 'label'=value[UOM];[warn];[crit];[min];[max]
     # where UOM (unit of measure) will usually be:
@@ -182,16 +213,76 @@ class NagiosPluginQuery(query.Query):
     #   e. c - a continous counter
     # See http://nagiosplug.sourceforge.net/developer-guidelines.html
     perf_format = re.compile(r'''(?P<label>\S+)=
-                                (?P<value>[^;]*)
-                                (;(?P<warn>[^;]*)
-                                (;(?P<crit>[^;]*)
-                                (;(?P<min>[^;]*)
-                                (;(?P<max>[^;]*))?)?)?)?''', re.X)
+                                (?P<value>[^;\s]*)
+                                (;(?P<warn>[^;\s]*)
+                                (;(?P<crit>[^;\s]*)
+                                (;(?P<min>[^;\s]*)
+                                (;(?P<max>[^;\s]*))?)?)?)?''', re.X)
+
+    def __init__(self, perfdata):
+        super(PerfData, self).__init__()
+        for match in self.perf_format.finditer(perfdata):
+            # The first instance of a label wins
+            if match.group('label') not in self:
+                self[match.group('label')] = PerfValue(match)
+
+class PluginOutput(str):
+    """Nagios plugin output split into text and performance data.
+
+    This is parsed once per run of the plugin and shared by all
+    of the nagios_plugin queries that use the same command.
+    """
+
+    def __new__(cls, output):
+        self = str.__new__(cls, output)
+
+        # grab performance data from the first line
+        lines = output.split('\n', 1)
+        split = lines[0].split('|', 1)
+
+        # The text sans perf data
+        self.text = split[0] + '\n'.join(lines[1:]) + '\n'
+
+        if len(split) == 2:
+            self.perfdata = PerfData(split[1])
+        else:
+            self.perfdata = None
+
+        return self
+
+class NagiosPluginBase(SubprocessBase):
+    """Runs a nagios plugin and parses the output"""
+
+    name = "nagios_plugin_base"
+
+    def _start(self):
+        deferred = super(NagiosPluginBase, self)._start()
+        deferred.addCallbacks(self._parseOutput, self._parseError)
+        return deferred
+
+    def _parseOutput(self, result):
+        if isinstance(result, basestring):
+            return PluginOutput(result)
+        else:
+            return result
+
+    def _parseError(self, reason):
+        if (isinstance(reason, errors.Failure) and
+                isinstance(reason.result, basestring)):
+            reason.result = PluginOutput(reason.result)
+        return reason
+
+class NagiosPluginQuery(query.Query):
+    """Query that runs a command"""
+
+    classProvides(query.IQuery)
+
+    name = "nagios_plugin"
 
     def __init__(self, nagcat, conf):
         super(NagiosPluginQuery, self).__init__(nagcat, conf)
 
-        self.subquery = nagcat.new_query(conf, qcls=SubprocessBase)
+        self.subquery = nagcat.new_query(conf, qcls=NagiosPluginBase)
         self.addDependency(self.subquery)
         self.conf.update(self.subquery.conf)
 
@@ -208,23 +299,21 @@ class NagiosPluginQuery(query.Query):
         if not isinstance(result, basestring):
             return result
 
-        # grab performance data from the first line
-        lines = result.split('\n', 1)
-        split = lines[0].split('|', 1)
+        if not isinstance(result, PluginOutput):
+            result = PluginOutput(result)
 
         if self.conf['perfdata']:
-            if len(split) != 2:
-                raise errors.Critical("No performance data found")
+            if result.perfdata is None:
+                raise errors.TestCritical("No performance data found")
 
-            for match in self.perf_format.finditer(split[1]):
-                if match.group('label') == self.conf['perfdata']:
-                    return match.group('value')
-
-            raise errors.Critical("No performance data found for %s" %
-                                    (self.conf['perfdata'],))
+            try:
+                return result.perfdata[self.conf['perfdata']]
+            except KeyError:
+                raise errors.TestCritical(
+                        "No performance data found for %s" %
+                        (self.conf['perfdata'],))
         else:
-            # Return the text sans perf data
-            return split[0] + '\n'.join(lines[1:]) + '\n'
+            return result.text
 
     def _checkError(self, reason):
         if isinstance(reason.value, SubprocessError):
@@ -36,6 +36,56 @@ class QueryManager(object):
         self._nagcat = nagcat
         self._queries = {}
 
+    def finalize(self):
+        """Share the leading filters of FilteredQuery objects that
+        wrap the same query so they are only run once per run."""
+
+        groups = {}
+        for qobj in self._queries.itervalues():
+            if isinstance(qobj, FilteredQuery):
+                groups.setdefault(qobj.getQuery(), []).append(qobj)
+
+        for group in groups.itervalues():
+            if len(group) > 1:
+                self._sharePrefixes(group)
+
+    def _sharePrefixes(self, group):
+        # Count the number of queries using each prefix
+        counts = {}
+        for qobj in group:
+            specs = qobj.shareableFilters()
+            for i in xrange(1, len(specs)+1):
+                counts[specs[:i]] = counts.get(specs[:i], 0) + 1
+
+        # Find the longest prefix each query has in common with another
+        longest = {}
+        for qobj in group:
+            specs = qobj.shareableFilters()
+            for i in xrange(len(specs), 0, -1):
+                if counts[specs[:i]] > 1:
+                    longest[qobj] = specs[:i]
+                    break
+
+        # Each of those prefixes is built on the next shorter one
+        shared = {}
+        for prefix in sorted(set(longest.itervalues()), key=len):
+            for i in xrange(len(prefix)-1, 0, -1):
+                if prefix[:i] in shared:
+                    parent = shared[prefix[:i]]
+                    break
+            else:
+                parent = None
+                i = 0
+
+            # The filters must be pure so any query's instances will do
+            owner = [q for q, p in longest.iteritems() if p == prefix][0]
+            pipeline = filters.Pipeline(owner.getFilters()[i:len(prefix)])
+            shared[prefix] = filters.SharedPipeline(pipeline, parent)
+
+        for qobj, prefix in longest.iteritems():
+            log.debug("Sharing %d filters of '%s'", len(prefix), qobj)
+            qobj.setPrefix(shared[prefix])
+
     def new_query(self, conf, qcls=None):
         """Create a new query and register it or return an existing one"""
 
@@ -88,6 +138,11 @@ class Query(runnable.Runnable):
         # extra pieces of metadata such as Request ID/URL.
         self.saved = {}
 
+        # Used by filters to avoid parsing the same result twice,
+        # kept only while something is still filtering this result.
+        self._parse_cache = util.ParseCache()
+        self._parse_users = 0
+
         # All queries should handle timeouts
         try:
             interval = util.Interval(conf.get('timeout', 15))
@@ -103,6 +158,20 @@ class Query(runnable.Runnable):
         self.saved.clear()
         return super(Query, self)._start_self()
 
+    def getParseCache(self):
+        """Get the ParseCache for this query's current result"""
+        return self._parse_cache
+
+    def holdParseCache(self):
+        """Keep the ParseCache until releaseParseCache is called"""
+        self._parse_users += 1
+
+    def releaseParseCache(self):
+        """Clear the ParseCache once everything holding it is done"""
+        self._parse_users -= 1
+        if not self._parse_users:
+            self._parse_cache.clear()
+
     @errors.callback
     def _failure_tcp(self, result):
         """Catch common TCP failures and convert them to a TestError"""
@@ -239,22 +308,80 @@ class FilteredQuery(Query):
             if expr:
                 filter_list.append("%s:%s" % (check, expr))
 
-        self._filters = [filters.Filter(self, x) for x in filter_list]
+        self._specs = tuple(filter_list)
+        self._filters = filters.Pipeline(
+                [filters.Filter(self, x) for x in filter_list])
+        self._dynamic = self._filters.dynamic
+        self._prefix = None
+        # Signature of the last input, the input itself and everything
+        # it saved so an unchanged result can skip the filters.
+        self._last_input = (None, None)
+        self._last_saved = None
         self._query = nagcat.new_query(conf)
         self.conf['filters'] = str(filter_list)
         self.conf['query'] = str(self._query)
         self.addDependency(self._query)
 
+    def getQuery(self):
+        return self._query
+
+    def getParseCache(self):
+        # Share with everything else filtering the same result
+        return self._query.getParseCache()
+
+    def getFilters(self):
+        return self._filters.filters
+
+    def shareableFilters(self):
+        """Get the specs of the leading filters that may be shared,
+        nothing more is shared once a prefix has been set."""
+        if self._prefix is not None:
+            return ()
+        for i, filter in enumerate(self._filters):
+            if not filter.shareable:
+                return self._specs[:i]
+        return self._specs
+
+    def setPrefix(self, prefix):
+        """Use a SharedPipeline in place of the first filters"""
+        assert self._prefix is None
+        self._prefix = prefix
+        self._specs = self._specs[len(prefix):]
+        self._filters = filters.Pipeline(self.getFilters()[len(prefix):])
+
+    def _start_dependencies(self):
+        # Parsed versions of the query's result are kept until
+        # everything filtering this run of the query is done.
+        self._query.holdParseCache()
+        return super(FilteredQuery, self)._start_dependencies()
+
     def _start(self):
-        self.saved.update(self._query.saved)
+        try:
+            return self._filter()
+        finally:
+            self._query.releaseParseCache()
+
+    def _filter(self):
+        result = self._query.result
+
+        # Reuse the last result if the input hasn't changed, the hash
+        # rules out most changes and the comparison confirms a match.
+        signature = util.result_hash(result)
+        last_signature, last_result = self._last_input
+        if (signature is not None and not self._dynamic and
+                signature == last_signature and
+                (result is last_result or result == last_result) and
+                self._query.saved == self._last_saved[0]):
+            log.debug("Input unchanged, reusing result of %s", self)
+            self.saved.update(self._last_saved[1])
+            return defer.succeed(self.result)
 
-        deferred = defer.Deferred()
-        deferred.callback(self._query.result)
+        self.saved.update(self._query.saved)
 
-        for filter in self._filters:
-            if filter.handle_errors:
-                deferred.addBoth(filter.filter)
-            else:
-                deferred.addCallback(filter.filter)
+        if self._prefix is not None:
+            result = self._prefix(result, self._query.lastrun)
+        result = self._filters(result)
 
-        return deferred
+        self._last_input = (signature, self._query.result)
+        self._last_saved = (self._query.saved.copy(), self.saved.copy())
+        return defer.succeed(result)
@@ -78,6 +78,12 @@ class SchedulerPage(monitor_api.XMLPage):
                 etree.SubElement(task_node, task_type, type=sub_type,
                         count=str(data['tasks'][task_type][sub_type]['count']))
 
+        skips = etree.SubElement(sch, "Unchanged")
+        for template, info in sorted(data['unchanged'].iteritems()):
+            etree.SubElement(skips, "Test", template=template,
+                    runs=str(info['runs']), skipped=str(info['skipped']),
+                    rate="%f" % (float(info['skipped']) / info['runs']))
+
         return sch
 
 class Scheduler(object):
@@ -102,6 +108,8 @@ class Scheduler(object):
                 'Test':  {'count': 0},
                 'Query': {'count': 0},
             }
+        # Runs of each test template that reused the last report
+        self._skip_stats = {}
 
         if monitor_port:
             self._monitor_port = monitor_port
@@ -175,9 +183,20 @@ class Scheduler(object):
                 'min': min(self._latency),
                 'avg': sum(self._latency) / len(self._latency),
             }
+        data['unchanged'] = self._skip_stats
 
         return data
 
+    def record_skip(self, template, skipped):
+        """Count a run of a test and whether its inputs were unchanged"""
+
+        info = self._skip_stats.get(template, None)
+        if info is None:
+            info = self._skip_stats[template] = {'runs': 0, 'skipped': 0}
+        info['runs'] += 1
+        if skipped:
+            info['skipped'] += 1
+
     def _update_stats(self, runnable, inc=1):
         """Record a previously unknown runnable"""
 
@@ -222,6 +241,8 @@ class Scheduler(object):
 
         self._log_stats()
 
+        self.query.finalize()
+
         # Collect runnables that query the same host so that we can
         # avoid hitting a host with many queries at once
         host_groups = {}
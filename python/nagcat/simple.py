@@ -20,7 +20,7 @@ from nagcat import errors, log
 from nagcat import scheduler
 
 class ObjectDummy(defaultdict):
-    """Provide a replacement for a real ObjectParser"""
+    """Provide a replacement for a real nagios_objects.Status"""
 
     def __init__(self):
         super(ObjectDummy, self).__init__(list)
@@ -28,6 +28,12 @@ class ObjectDummy(defaultdict):
     def types(self):
         return self.keys()
 
+    def host(self, host_name):
+        return None
+
+    def service(self, host_name, description):
+        return None
+
 class NagcatDummy(scheduler.Scheduler):
     """For testing"""
 
@@ -68,6 +74,7 @@ class NagcatSimple(NagcatDummy):
         assert self._startup
         self._startup = False
         del self._group_index
+        self.query.finalize()
 
         runnable = self._registered.pop()
         return runnable.start()
@@ -30,6 +30,14 @@ from nagcat import errors, filters, log, query, runnable, util
 
 STATES = ["OK", "WARNING", "CRITICAL", "UNKNOWN"]
 
+# The only builtins available to compound query return expressions
+RETURN_BUILTINS = {
+        'abs': abs, 'divmod': divmod, 'pow': pow, 'round': round,
+        'min': min, 'max': max, 'sum': sum, 'len': len,
+        'int': int, 'long': long, 'float': float, 'str': str,
+        'bool': bool, 'True': True, 'False': False, 'None': None,
+    }
+
 TEMPLATE_OK = """%(test)s %(state)s: %(summary)s
 Port: %(port)s
 Test: %(test)s
@@ -68,6 +76,46 @@ Investigation:
 %(url)s
 """
 
+# Used by compact reports when the long output is not needed
+TEMPLATE_SHORT = """%(test)s %(state)s: %(summary)s
+"""
+
+REPORT_MODES = ("full", "compact")
+
+def indent(string, prefix="    "):
+    """Indent all non-blank lines in string"""
+
+    lines = []
+    for line in string.splitlines():
+        if line.strip():
+            line = prefix+line
+        lines.append(line+'\n')
+    return "".join(lines)
+
+class Report(dict):
+    """The report passed to report callbacks.
+
+    Values that are expensive to build such as 'text' and 'extra' are
+    given as functions that are only called the first time the value
+    is looked up. Until then the key is not in the dict.
+    """
+
+    def __init__(self, lazy, *args, **kwargs):
+        dict.__init__(self, *args, **kwargs)
+        self._lazy = lazy
+
+    def __missing__(self, key):
+        if key not in self._lazy:
+            raise KeyError(key)
+        value = self[key] = self._lazy.pop(key)(self)
+        return value
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
 
 class BaseTest(runnable.Runnable):
     """Shared base between SimpleTest and Test"""
@@ -85,28 +133,24 @@ class BaseTest(runnable.Runnable):
 
         # Create the filter objects
         filter_list = conf.get('filters', [])
-        self._filters = [filters.Filter(self, x) for x in filter_list]
+        filter_list = [filters.Filter(self, x) for x in filter_list]
 
         # Add final critical and warning tests
         if 'critical' in conf:
-            self._filters.append(filters.get_filter(
+            filter_list.append(filters.get_filter(
                 self, 'critical', None, conf['critical']))
         if 'warning' in conf:
-            self._filters.append(filters.get_filter(
+            filter_list.append(filters.get_filter(
                 self, 'warning', None, conf['warning']))
 
+        self._filters = filters.Pipeline(filter_list)
+
     def _start(self):
         # Subclasses must override this and fire the deferred!
         self.saved.clear()
 
         deferred = defer.Deferred()
-
-        for filter in self._filters:
-            if filter.handle_errors:
-                deferred.addBoth(filter.filter)
-            else:
-                deferred.addCallback(filter.filter)
-
+        deferred.addBoth(self._filters)
         return deferred
 
 
@@ -146,10 +190,26 @@ class Test(BaseTest):
         if self._priority:
             self._priority = "Priority: %s\n\n" % self._priority
 
+        # In compact mode the full report is only sent when the state
+        # changes or report_refresh has passed since the last one.
+        self._report_mode = conf.get('report_mode', "full")
+        if self._report_mode not in REPORT_MODES:
+            raise errors.ConfigError(conf,
+                    "report_mode must be one of: %s" % ", ".join(REPORT_MODES))
+        self._report_refresh = util.Interval(
+                conf.get('report_refresh', "1 hour"))
+        self._report_state = None
+        self._report_full_time = 0
+        self._report_full = None
+        # The sub-test results and final result from the last run
+        self._last_inputs = None
+        self._last_result = None
+
         if conf['query.type'] == "compound":
             self._compound = True
             conf['query'].expand(recursive=False)
             self._return = conf.get('query.return', None)
+            self._return_code = None
 
             for name, qconf in conf['query'].iteritems():
                 if not isinstance(qconf, struct.Struct):
@@ -172,6 +232,13 @@ class Test(BaseTest):
                 self._return = re.sub("\\$\\(([^\\)]+)\\)",
                         lambda m: "data['%s']" % m.group(1), self._return)
 
+                try:
+                    self._return_code = compile(
+                            self._return, "<return>", "eval")
+                except SyntaxError, ex:
+                    raise errors.ConfigError(conf['query'],
+                            "Syntax error in return: %s" % ex)
+
                 test_values = {'NOW': util.MathString('9999')}
                 for name in self._subtests:
                     #XXX this test string isn't fool-proof but will mostly work
@@ -180,13 +247,13 @@ class Test(BaseTest):
                 try:
                     log.trace("Testing expr %r with data=%r" %
                             (self._return, test_values))
-                    eval(self._return, {'data': test_values})
-                except SyntaxError, ex:
-                    raise errors.ConfigError(conf['query'],
-                            "Syntax error in return: %s" % ex)
+                    self._evalReturn(test_values)
                 except KeyError, ex:
                     raise errors.ConfigError(conf['query'],
                             "Unknown sub-query in return: %s" % ex)
+                except NameError, ex:
+                    raise errors.ConfigError(conf['query'],
+                            "Invalid name in return: %s" % ex)
         else:
             self._compound = False
             qconf = conf.get('query')
@@ -197,6 +264,12 @@ class Test(BaseTest):
 
         self._report_callbacks = []
 
+        # The last report can be reused when no sub-test has changed
+        # unless the result depends on the time or the Nagios status.
+        self._reusable = not (self._warning_time_limit or
+                self._filters.dynamic or
+                (self._compound and self._return and "NOW" in self._return))
+
     def _addDefaults(self, conf):
         """Add default values based on this test to a subtest config"""
         conf.setdefault('host', self.host)
@@ -210,6 +283,16 @@ class Test(BaseTest):
     def _start(self):
         self._now = time.time()
 
+        # Nothing to do but update the time if no sub-test changed
+        inputs = [subtest.result for subtest in self._subtests.itervalues()]
+        unchanged = (self._reusable and isinstance(self.result, Report) and
+                all(a is b for a, b in zip(inputs, self._last_inputs)))
+        self._last_inputs = inputs
+        self._nagcat.record_skip(self._test, unchanged)
+        if unchanged:
+            log.debug("Inputs unchanged, reusing report of %s", self)
+            return defer.succeed(self._refresh_report())
+
         # All sub-tests are now complete, process them!
         deferred = BaseTest._start(self)
         deferred.addBoth(self._report)
@@ -234,7 +317,7 @@ class Test(BaseTest):
             log.debug("Evaluating return '%s' with data = %s",
                     self._return, data)
 
-            result = str(eval(self._return, {'data': data}))
+            result = str(self._evalReturn(data))
         else:
             subtest = self._subtests['query']
             if isinstance(subtest.result, failure.Failure):
@@ -244,6 +327,10 @@ class Test(BaseTest):
 
         return result
 
+    def _evalReturn(self, data):
+        namespace = {'__builtins__': RETURN_BUILTINS, 'data': data}
+        return eval(self._return_code, namespace)
+
     def addReportCallback(self, func, *args, **kwargs):
         """The given callback function will be called each time
         this test finishes and has a test to report.
@@ -258,15 +345,14 @@ class Test(BaseTest):
         if not self._warning_time_limit or state != "WARNING":
             return state
 
-        status = self._nagcat.nagios_status()
-
-        found = None
-        for service in status['service']:
-            if (service['service_description'] == self._description
-                    and service['host_name'] == self.host):
-                found = service
-                break
+        try:
+            status = self._nagcat.nagios_status()
+        except errors.TestUnknown, ex:
+            # The test's own result is still good, skip the limit
+            log.warn("Cannot check warning time limit of %s: %s", self, ex)
+            return state
 
+        found = status.service(self.host, self._description)
         if not found:
             return state
 
@@ -282,18 +368,25 @@ class Test(BaseTest):
 
         return state
 
-    def _report(self, result):
+    def _refresh_report(self):
+        """Send the last report again with the current time"""
+
+        last = self.result
+        full = self._full_report(last['state'])
+        if full != self._report_full:
+            return self._report(self._last_result, full)
+
+        report = Report(dict(last._lazy), last)
+        report['time'] = self._now
+        self._send_report(report)
+        return report
+
+    def _report(self, result, full=None):
         """Generate a report of the final result, pass that report off
         to all registered report callbacks. (ie nagios reporting)
         """
 
-        def indent(string, prefix="    "):
-            ret = ""
-            for line in string.splitlines():
-                if line.strip():
-                    line = prefix+line
-                ret += line+'\n'
-            return ret
+        self._last_result = result
 
         # Choose what to report at the main result
         if isinstance(result, failure.Failure):
@@ -347,59 +440,45 @@ class Test(BaseTest):
             if state == "OK" and self.label:
                 summary = "%s %s" % (summary, self.label)
 
-        # Fill in the Extra Output area and all valid values
-        extra = ""
+        # Collect all valid values, the Extra Output area is filled
+        # in from a snapshot of the sub-tests only if it is needed.
         results = {}
+        subtests = []
         for subname, subtest in self._subtests.iteritems():
-            subextra = ""
-            for savedname, savedval in subtest.saved.iteritems():
-                subextra += "    %s:\n" % savedname
-                subextra += indent(str(savedval), " "*8)
-
             if isinstance(subtest.result, failure.Failure):
                 results[subname] = ""
-
-                if (isinstance(subtest.result, errors.Failure) and
-                        subtest.result.result is not errors.NO_RESULT):
-                    subout = str(subtest.result.result)
-                else:
-                    subout = ""
-
-                if isinstance(subtest.result.value, errors.TestError):
-                    suberr = str(subtest.result.value)
-                else:
-                    suberr = str(subtest.result)
             else:
                 results[subname] = subtest.result
-                subout = str(subtest.result)
-                suberr = ""
+            subtests.append(
+                    (subname, subtest.saved.items(), subtest.result))
 
-            if subout and subout != output:
-                subextra += "    Output:\n"
-                subextra += indent(subout, " "*8)
+        assert state in STATES
 
-            if suberr and suberr != error:
-                subextra += "    Error:\n"
-                subextra += indent(suberr, " "*8)
+        if full is None:
+            full = self._full_report(state)
+        self._report_full = full
 
-            if subextra:
-                extra += indent("%s:\n%s" % (subname, subextra))
+        if full:
+            if state == "OK":
+                template = TEMPLATE_OK
+            else:
+                template = TEMPLATE_BAD
+        else:
+            template = TEMPLATE_SHORT
 
-        assert state in STATES
+        def render_extra(report):
+            return self._render_extra(subtests, output, error)
 
-        if state == "OK":
-            text = TEMPLATE_OK
-        else:
-            text = TEMPLATE_BAD
+        def render_text(report):
+            return template % report
 
-        report = {
+        report = Report({'extra': render_extra, 'text': render_text}, {
                 'test': self._test,
                 'state': state,
                 'state_id': STATES.index(state),
                 'summary': summary,
                 'output': output,
                 'error': error,
-                'extra': extra,
                 'host': self.host,
                 'addr': self.addr,
                 'port': self._port,
@@ -409,10 +488,13 @@ class Test(BaseTest):
                 'priority': self._priority,
                 'url': self._url,
                 'results': results,
-                }
+                })
+
+        self._send_report(report)
+        return report
 
-        text = text % report
-        report['text'] = text
+    def _send_report(self, report):
+        """Pass the report to all registered report callbacks"""
 
         # Don't fire callbacks (which write out to stuff) during shutdown
         if reactor.running:
@@ -422,4 +504,54 @@ class Test(BaseTest):
                 except:
                     log.error("Report callback failed: %s" % failure.Failure())
 
-        return report
+    def _full_report(self, state):
+        """Check if the full report should be sent this time"""
+
+        if self._report_mode == "full":
+            return True
+
+        if (state != self._report_state or
+                self._now >= self._report_full_time + self._report_refresh):
+            self._report_state = state
+            self._report_full_time = self._now
+            return True
+        else:
+            return False
+
+    def _render_extra(self, subtests, output, error):
+        """Fill in the Extra Output area of the report"""
+
+        extra = []
+        for subname, saved, result in subtests:
+            subextra = []
+            for savedname, savedval in saved:
+                subextra.append("    %s:\n" % savedname)
+                subextra.append(indent(str(savedval), " "*8))
+
+            if isinstance(result, failure.Failure):
+                if (isinstance(result, errors.Failure) and
+                        result.result is not errors.NO_RESULT):
+                    subout = str(result.result)
+                else:
+                    subout = ""
+
+                if isinstance(result.value, errors.TestError):
+                    suberr = str(result.value)
+                else:
+                    suberr = str(result)
+            else:
+                subout = str(result)
+                suberr = ""
+
+            if subout and subout != output:
+                subextra.append("    Output:\n")
+                subextra.append(indent(subout, " "*8))
+
+            if suberr and suberr != error:
+                subextra.append("    Error:\n")
+                subextra.append(indent(suberr, " "*8))
+
+            if subextra:
+                extra.append(indent("%s:\n%s" % (subname, "".join(subextra))))
+
+        return "".join(extra)
@@ -350,6 +350,11 @@ class Trend(object):
             else:
                 value = report['results'][ds_name]
 
+            # Perfdata values may include a unit such as 5ms
+            fields = getattr(value, 'fields', None)
+            if fields is not None:
+                value = fields()['value']
+
             try:
                 value = float(value)
             except:
@@ -0,0 +1,67 @@
+# Copyright 2010 ITA Software, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from twisted.trial import unittest
+from nagcat import errors, filters
+
+class AggregateTestCase(unittest.TestCase):
+
+    example = """name   requests  latency
+web1   10        0.5
+web2   20        1.5
+web3   40        2.5
+web4   30        3.5
+"""
+
+    def check(self, spec, expect, data=None):
+        f = filters.Filter(object(), spec)
+        self.assertEquals(f.filter(data or self.example), expect)
+
+    def testSum(self):
+        self.check("sum:1", "100")
+        self.check("sum:2", "8")
+        self.check("sum", "6", "1\n2\n3\n")
+
+    def testAvg(self):
+        self.check("avg:1", "25")
+        self.check("avg:-1", "2")
+
+    def testMaxMin(self):
+        self.check("max:1", "40")
+        self.check("min:2", "0.5")
+
+    def testCount(self):
+        self.check("count:1", "4")
+        self.check("count:0", "0")
+
+    def testPercentile(self):
+        self.check("percentile:50,1", "25")
+        self.check("percentile:100,1", "40")
+        self.check("percentile:0,2", "0.5")
+        self.check("percentile:95,0", "9.5", "\n".join(map(str, range(11))))
+
+    def testDelimiter(self):
+        self.check("sum:2,:", "15", "a:b:5\nc:d:10\n")
+        self.check("max:1,,", "7", "a,7\nb,3\n")
+
+    def testEmpty(self):
+        f = filters.Filter(object(), "sum:0")
+        self.assertIsInstance(f.filter(self.example), errors.Failure)
+        self.check("sum[none]:0", "none")
+
+    def testBadArgs(self):
+        self.assertRaises(errors.InitError,
+                filters.Filter, object(), "sum:foo")
+        self.assertRaises(errors.InitError,
+                filters.Filter, object(), "percentile:200,1")
@@ -0,0 +1,73 @@
+# Copyright 2010 ITA Software, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from twisted.trial import unittest
+from nagcat import errors, filters, util
+from nagcat.unittests.filters.test_xml import DummyQuery
+
+class JSONTestCase(unittest.TestCase):
+
+    example = """{
+        "status": "ok",
+        "uptime": 1234.5,
+        "pools": [
+            {"name": "web", "active": 10, "idle": 2},
+            {"name": "db", "active": 3, "idle": 7, "meta": {"x": null}}
+        ]
+    }"""
+
+    def testMember(self):
+        f = filters.Filter(object(), "jsonpath:$.status")
+        self.assertEquals(f.filter(self.example), "ok")
+        f = filters.Filter(object(), "jsonpath:uptime")
+        self.assertEquals(f.filter(self.example), "1234.5")
+
+    def testIndex(self):
+        f = filters.Filter(object(), "jsonpath:$.pools[1].active")
+        self.assertEquals(f.filter(self.example), "3")
+        f = filters.Filter(object(), "jsonpath:$['pools'][-1]['name']")
+        self.assertEquals(f.filter(self.example), "db")
+
+    def testWildcard(self):
+        f = filters.Filter(object(), "jsonpath:$.pools[*].idle")
+        self.assertEquals(f.filter(self.example), "2\n7")
+        f = filters.Filter(object(), "jsonpath:$..name")
+        self.assertEquals(f.filter(self.example), "web\ndb")
+
+    def testCompact(self):
+        f = filters.Filter(object(), "jsonpath:$.pools[1].meta")
+        self.assertEquals(f.filter(self.example), '{"x":null}')
+        f = filters.Filter(object(), "json")
+        self.assertEquals(f.filter('[1, 2, {"b": true, "a": "x"}]'),
+                '[1,2,{"a":"x","b":true}]')
+
+    def testMissing(self):
+        f = filters.Filter(object(), "jsonpath:$.pools[5].name")
+        self.assertIsInstance(f.filter(self.example), errors.Failure)
+        f = filters.Filter(object(), "jsonpath[none]:$.nothing")
+        self.assertEquals(f.filter(self.example), "none")
+
+    def testBad(self):
+        f = filters.Filter(object(), "jsonpath:$.status")
+        self.assertIsInstance(f.filter("{'bad json"), errors.Failure)
+        self.assertRaises(errors.InitError,
+                filters.Filter, object(), "jsonpath:$.status[")
+
+    def testShared(self):
+        query = DummyQuery()
+        status = filters.Filter(query, "jsonpath:$.status")
+        uptime = filters.Filter(query, "jsonpath:$.uptime")
+        self.assertEquals(status.filter(self.example), "ok")
+        self.assertEquals(uptime.filter(self.example), "1234.5")
+        self.assertEquals(len(query.cache), 1)
@@ -0,0 +1,114 @@
+# Copyright 2010 ITA Software, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from twisted.trial import unittest
+from twisted.internet import defer
+from nagcat import errors, filters
+
+class PipelineTestCase(unittest.TestCase):
+
+    def pipeline(self, *specs):
+        return filters.Pipeline([filters.Filter(object(), x) for x in specs])
+
+    def deferred(self, specs, result):
+        """Run the filters the old way for comparison"""
+        output = []
+        deferred = defer.Deferred()
+        for filter in [filters.Filter(object(), x) for x in specs]:
+            if filter.handle_errors:
+                deferred.addBoth(filter.filter)
+            else:
+                deferred.addCallback(filter.filter)
+        deferred.addBoth(output.append)
+        deferred.callback(result)
+        return output[0]
+
+    def testBasic(self):
+        p = self.pipeline("regex:^(\d+)", "critical:> 5")
+        self.assertEquals(p("3 things"), "3")
+        self.assertEquals(len(p), 2)
+
+    def testEmpty(self):
+        p = self.pipeline()
+        self.assertEquals(p("foo"), "foo")
+
+    def testError(self):
+        specs = ("regex:^foo$", "lines", "critical:== 1")
+        p = self.pipeline(*specs)
+        result = p("bar")
+        self.assertIsInstance(result, errors.Failure)
+        self.assertEquals(result.result, "bar")
+        expect = self.deferred(specs, "bar")
+        self.assertEquals(result.type, expect.type)
+        self.assertEquals(result.result, expect.result)
+
+    def testOverride(self):
+        # critical overrides a warning and sees the original result
+        specs = ("warning:> 1", "critical:> 5")
+        p = self.pipeline(*specs)
+        self.assertIsInstance(p("3"), errors.Failure)
+        self.assertIsInstance(p("3").value, errors.TestWarning)
+        result = p("7")
+        self.assertIsInstance(result.value, errors.TestCritical)
+        self.assertEquals(result.result, "7")
+        expect = self.deferred(specs, "7")
+        self.assertEquals(result.type, expect.type)
+        self.assertEquals(result.result, expect.result)
+
+    def testFailureInput(self):
+        p = self.pipeline("lines", "critical:> 5")
+        failure = errors.Failure(errors.TestCritical("oops"), result="x")
+        self.assertIdentical(p(failure), failure)
+
+    def testNumericResult(self):
+        # thresholds don't change the type of the result
+        p = self.pipeline("critical:> 5", "warning:> 3")
+        result = p("2")
+        self.assertIdentical(type(result), str)
+        self.assertEquals(result, "2")
+        result = p("4")
+        self.assertIdentical(type(result.result), str)
+
+class FilterCacheTestCase(unittest.TestCase):
+
+    def testShared(self):
+        test1 = object()
+        test2 = object()
+        f1 = filters.Filter(test1, "regex[x]:^(\d+) cached")
+        f2 = filters.Filter(test2, "regex[x]:^(\d+) cached")
+        self.assertNotIdentical(f1, f2)
+        self.assertIdentical(f1.test, test1)
+        self.assertIdentical(f2.test, test2)
+        self.assertIdentical(f1.regex, f2.regex)
+        self.assertEquals(f2.filter("2 cached"), "2")
+        self.assertEquals(f2.filter("bar"), "x")
+
+    def testNoTestCached(self):
+        test = object()
+        filters.Filter(test, "regex[x]:^(\d+) unpinned")
+        cached = filters._filter_cache[("regex", "x", "^(\\d+) unpinned")]
+        self.assertIdentical(cached.test, None)
+
+    def testDifferent(self):
+        f1 = filters.Filter(object(), "regex[x]:^(\d+) different")
+        f2 = filters.Filter(object(), "regex[y]:^(\d+) different")
+        self.assertEquals(f1.filter("bar"), "x")
+        self.assertEquals(f2.filter("bar"), "y")
+
+    def testState(self):
+        f1 = filters.Filter(object(), "table:0,1")
+        f1.filter("a b\nc d")
+        f2 = filters.Filter(object(), "table:0,1")
+        self.assertIdentical(f2._dialect, None)
+        self.assertEquals(f2.filter("a,b\nc,d"), "b")
@@ -69,3 +69,27 @@ class TableTestCase(unittest.TestCase):
     def testGetRowByName(self):
         f = filters.Filter(object(), "table:daemon,6")
         self.assertEquals(f.filter(self.pw), "/bin/sh")
+
+    def testDialectCached(self):
+        f = filters.Filter(object(), "table:1,1")
+        self.assertEquals(f.filter(self.csv), "buz")
+        self.assertEquals(f._dialect.delimiter, ",")
+        self.assertEquals(f.filter("a,b\nc,d\n"), "d")
+
+    def testDialectChanged(self):
+        f = filters.Filter(object(), "table:1,1")
+        self.assertEquals(f.filter(self.csv), "buz")
+        self.assertEquals(f.filter(self.tab), "bar")
+        self.assertEquals(f._dialect.delimiter, "\t")
+
+    def testHeaderChanged(self):
+        f = filters.Filter(object(), "table:1,Col2")
+        self.assertEquals(f.filter(self.tab), "bar")
+        swapped = ("Col2\tCol1\tCol3\n"
+                   "foo\tbar\tbaz\n")
+        self.assertEquals(f.filter(swapped), "foo")
+
+    def testLargeTable(self):
+        rows = ["%d,%d,%d" % (i, i*2, i*3) for i in xrange(100000)]
+        f = filters.Filter(object(), "table:5,2")
+        self.assertEquals(f.filter("\n".join(rows)), "15")
@@ -15,7 +15,7 @@
 import os
 from lxml import etree
 from twisted.trial import unittest
-from nagcat import errors, filters
+from nagcat import errors, filters, util
 
 class XPathTestCase(unittest.TestCase):
 
@@ -56,6 +56,86 @@ class XPathTestCase(unittest.TestCase):
         self.assertEquals(f.filter(self.example),
                 "<p>Text #1</p>\n<p>Text #2</p>")
 
+class XPathStreamTestCase(unittest.TestCase):
+
+    example = XPathTestCase.example
+
+    def testBasic(self):
+        f = filters.Filter(object(), "xpathstream:/html/body/div/text()")
+        self.assertEquals(f.filter(self.example), "This has been a test")
+
+    def testAnywhere(self):
+        f = filters.Filter(object(), "xpathstream://p/text()")
+        self.assertEquals(f.filter(self.example), "Text #1")
+
+    def testAttribute(self):
+        f = filters.Filter(object(), "xpathstream://div/@class")
+        self.assertEquals(f.filter(self.example), "title")
+
+    def testXML(self):
+        f = filters.Filter(object(), "xpathstream:/html/head")
+        self.assertEquals(f.filter(self.example),
+                "<head>\n            <title>Test XML</title>\n        </head>")
+
+    def testMissing(self):
+        f = filters.Filter(object(), "xpathstream://span/text()")
+        self.assertIsInstance(f.filter(self.example), errors.Failure)
+
+    def testDefault(self):
+        f = filters.Filter(object(), "xpathstream[none]:/body/p")
+        self.assertEquals(f.filter(self.example), "none")
+
+    def testBad(self):
+        f = filters.Filter(object(), "xpathstream://span/text()")
+        self.assertIsInstance(f.filter("<foo></bar>"), errors.Failure)
+
+    def testUnsupported(self):
+        self.assertRaises(errors.InitError, filters.Filter,
+                object(), "xpathstream://div[@id='x']")
+
+    def testEarlyMatch(self):
+        # Anything after the match is never parsed
+        f = filters.Filter(object(), "xpathstream:/a/b/text()")
+        self.assertEquals(f.filter("<a><b>1</b><c></a>"), "1")
+
+class DummyQuery(object):
+
+    def __init__(self):
+        self.cache = util.ParseCache()
+
+    def getParseCache(self):
+        return self.cache
+
+class ParseCacheTestCase(unittest.TestCase):
+
+    example = XPathTestCase.example
+
+    def testShared(self):
+        query = DummyQuery()
+        title = filters.Filter(query, "xpath://title/text()")
+        para = filters.Filter(query, "xpath://p[1]/text()")
+        self.assertEquals(title.filter(self.example), "Test XML")
+        self.assertEquals(len(query.cache), 1)
+        self.assertEquals(para.filter(self.example), "Text #1")
+        self.assertEquals(len(query.cache), 1)
+
+    def testIdentity(self):
+        # Equal strings are not the same result
+        query = DummyQuery()
+        title = filters.Filter(query, "xpath://title/text()")
+        other = "".join(list(self.example))
+        title.filter(self.example)
+        title.filter(other)
+        self.assertEquals(len(query.cache), 2)
+        query.cache.clear()
+        self.assertEquals(len(query.cache), 0)
+
+    def testBad(self):
+        query = DummyQuery()
+        f = filters.Filter(query, "xpath://span/text()")
+        self.assertIsInstance(f.filter("<foo></bar>"), errors.Failure)
+        self.assertEquals(len(query.cache), 0)
+
 class XSLTTestCase(unittest.TestCase):
 
     # example swiped from wikipedia
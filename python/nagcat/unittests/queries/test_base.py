@@ -12,7 +12,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from nagcat import errors, query
+from twisted.internet import defer
+from nagcat import errors, query, util
 from nagcat.unittests.queries import QueryTestCase
 from coil.struct import Struct
 
@@ -100,6 +101,171 @@ class FilteredQueryCase(QueryTestCase):
         d.addBoth(check)
         return d
 
+    def testSharedPrefix(self):
+        def new(filters):
+            return self.nagcat.new_query(Struct({
+                    'type': "noop",
+                    'data': "3 things",
+                    'filters': filters,
+                }), qcls=query.FilteredQuery)
+
+        a = new([ "regex:(\\d+) things", "critical: > 5" ])
+        b = new([ "regex:(\\d+) things", "warning: > 2" ])
+        c = new([ "save:x", "regex:(\\d+) things" ])
+        self.nagcat.query.finalize()
+
+        self.assertIdentical(a._prefix, b._prefix)
+        self.assertEquals(len(a._prefix), 1)
+        self.assertIdentical(c._prefix, None)
+
+        calls = []
+        pipeline = a._prefix.pipeline
+        def count(result):
+            calls.append(result)
+            return pipeline(result)
+        a._prefix.pipeline = count
+
+        def check(result):
+            self.assertEquals(calls, ["3 things"])
+            self.assertEquals(a.result, "3")
+            self.assertIsInstance(b.result, errors.Failure)
+            self.assertIsInstance(b.result.value, errors.TestWarning)
+            self.assertEquals(b.result.result, "3")
+            self.assertEquals(c.result, "3")
+            self.assertEquals(c.saved['x'], "3 things")
+
+        d = defer.DeferredList([a.start(), b.start(), c.start()])
+        d.addCallback(check)
+        return d
+
+    def testSharedPrefixTwice(self):
+        def new(filters):
+            return self.nagcat.new_query(Struct({
+                    'type': "noop",
+                    'data': "3 things",
+                    'filters': filters,
+                }), qcls=query.FilteredQuery)
+
+        a = new([ "regex:(\\d+) things", "critical: > 5" ])
+        b = new([ "regex:(\\d+) things", "warning: > 2" ])
+        self.nagcat.query.finalize()
+        prefix = a._prefix
+
+        # What is left of each query still matches its specs
+        self.assertEquals(len(a.getFilters()), 1)
+        self.assertEquals(a._specs, ("critical: > 5",))
+        self.assertEquals(a.shareableFilters(), ())
+        self.assertEquals(b.shareableFilters(), ())
+
+        self.nagcat.query.finalize()
+        self.assertIdentical(a._prefix, prefix)
+        self.assertIdentical(b._prefix, prefix)
+
+        def check(result):
+            self.assertEquals(a.result, "3")
+            self.assertIsInstance(b.result, errors.Failure)
+            self.assertIsInstance(b.result.value, errors.TestWarning)
+            self.assertEquals(b.result.result, "3")
+
+        d = defer.DeferredList([a.start(), b.start()])
+        d.addCallback(check)
+        return d
+
+    def testParseCacheCleared(self):
+        def new(filters):
+            return self.nagcat.new_query(Struct({
+                    'type': "noop",
+                    'data': "<a>3</a>",
+                    'filters': filters,
+                }), qcls=query.FilteredQuery)
+
+        a = new([ "xpath:/a/text()" ])
+        b = new([ "xpath:/a/text()", "critical: > 5" ])
+        cache = a.getParseCache()
+        self.assertIdentical(b.getParseCache(), cache)
+
+        sizes = []
+        get = cache.get
+        def record(parser, data):
+            sizes.append(len(cache))
+            return get(parser, data)
+        cache.get = record
+
+        def check(result):
+            self.assertEquals(a.result, "3")
+            self.assertEquals(b.result, "3")
+            # b still needed the cache after a was done
+            self.assertEquals(sizes, [0, 1])
+            self.assertEquals(len(cache), 0)
+
+        d = defer.DeferredList([a.start(), b.start()])
+        d.addCallback(check)
+        return d
+
+    def countFilters(self, filters):
+        t = query.FilteredQuery(self.nagcat, Struct({
+                'type': "noop",
+                'data': "3 things",
+                'repeat': "0",
+                'filters': filters,
+            }))
+
+        calls = []
+        pipeline = t._filters
+        def count(result):
+            calls.append(result)
+            return pipeline(result)
+        t._filters = count
+        return t, calls
+
+    def testUnchanged(self):
+        t, calls = self.countFilters(["save:x", "regex:(\\d+) things"])
+
+        def rerun(result):
+            first = t.result
+            d = t.start()
+            d.addCallback(check, first)
+            return d
+
+        def check(result, first):
+            self.assertEquals(len(calls), 1)
+            self.assertIdentical(t.result, first)
+            self.assertEquals(t.saved['x'], "3 things")
+
+        d = t.start()
+        d.addCallback(rerun)
+        return d
+
+    def testUnchangedCollision(self):
+        t, calls = self.countFilters(["regex:(\d+) things"])
+        self.patch(util, 'result_hash', lambda result: (1, 1))
+
+        def rerun(result):
+            t.getQuery().conf['data'] = "4 things"
+            return t.start()
+
+        def check(result):
+            self.assertEquals(len(calls), 2)
+            self.assertEquals(t.result, "4")
+
+        d = t.start()
+        d.addCallback(rerun)
+        d.addCallback(check)
+        return d
+
+    def testUnchangedNow(self):
+        t, calls = self.countFilters(["regex:(\\d+) things",
+                                      "critical: > $(NOW)"])
+
+        def check(result):
+            self.assertEquals(len(calls), 2)
+            self.assertEquals(t.result, "3")
+
+        d = t.start()
+        d.addCallback(lambda x: t.start())
+        d.addCallback(check)
+        return d
+
 
 class NoOpQueryTestCase(QueryTestCase):
 
@@ -14,8 +14,11 @@
 
 import os
 import time
+import struct
+from twisted.internet import defer, protocol, reactor
 from nagcat.unittests.queries import QueryTestCase
 from nagcat import errors
+from nagcat.plugins import query_ntp
 
 
 class NTPTestCase(QueryTestCase):
@@ -40,8 +43,77 @@ class NTPTestCase(QueryTestCase):
             self.assertIsInstance(result, errors.Failure)
             self.assertIsInstance(result.value, errors.TestCritical)
 
-        d = self.startQuery(type="ntp", host='localhost', port=9)
+        d = self.startQuery(type="ntp", host='localhost', port=9, timeout=1)
         d.addBoth(check)
         return d
 
-    # TODO: test timeout
+    def tearDown(self):
+        return query_ntp._client.close()
+
+class DummyNTPServer(protocol.DatagramProtocol):
+    """Reply to requests with a fixed time, or not at all"""
+
+    noisy = False
+    time = 1234567890
+    reply = True
+
+    def datagramReceived(self, data, addr):
+        if not self.reply:
+            return
+        request = struct.unpack('!12I', data)
+        reply = [0] * 12
+        reply[6:8] = request[10:12]
+        reply[10] = self.time + query_ntp.TIME1970
+        self.transport.write(struct.pack('!12I', *reply), addr)
+
+class NTPDummyTestCase(QueryTestCase):
+
+    def setUp(self):
+        super(NTPDummyTestCase, self).setUp()
+        self.server = DummyNTPServer()
+        self.port = reactor.listenUDP(0, self.server, interface="127.0.0.1")
+
+    def tearDown(self):
+        query_ntp._client.close()
+        return self.port.stopListening()
+
+    def startNTP(self, **kwargs):
+        return self.startQuery(type="ntp", host="localhost",
+                port=self.port.getHost().port, **kwargs)
+
+    def testShared(self):
+        def check(result):
+            for success, value in result:
+                self.assert_(success)
+                self.assertEquals(value, str(self.server.time))
+
+        d = defer.DeferredList([self.startNTP() for i in range(3)])
+        d.addCallback(check)
+        return d
+
+    def testKeepListening(self):
+        def second(result):
+            listener = query_ntp._client._listener
+            self.assertNotEquals(listener, None)
+            d = self.startNTP()
+            d.addCallback(check, listener)
+            return d
+
+        def check(result, listener):
+            self.assertEquals(result, str(self.server.time))
+            self.assertIdentical(query_ntp._client._listener, listener)
+
+        d = self.startNTP()
+        d.addCallback(second)
+        return d
+
+    def testTimeout(self):
+        def check(result):
+            self.assertIsInstance(result, errors.Failure)
+            self.assertIsInstance(result.value, errors.TestCritical)
+            self.assert_(str(result.value).startswith("Timeout"))
+
+        self.server.reply = False
+        d = self.startNTP(timeout=0.5)
+        d.addBoth(check)
+        return d
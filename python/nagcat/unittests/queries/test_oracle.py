@@ -13,19 +13,24 @@
 # limitations under the License.
 
 import os
+import time
 import subprocess
 
-from twisted.internet import protocol, reactor
+from twisted.internet import defer, protocol, reactor
 from twisted.python import log
 from nagcat.unittests.queries import QueryTestCase
+from nagcat.plugins import query_oracle
 from nagcat import errors
 from coil.struct import Struct
 
 try:
     import cx_Oracle
-    from lxml import etree
 except ImportError:
     cx_Oracle = None
+
+try:
+    from lxml import etree
+except ImportError:
     etree = None
 
 class OracleBase(QueryTestCase):
@@ -54,6 +59,7 @@ class OracleBase(QueryTestCase):
     def tearDown(self):
         if self.SQL_CLEAN:
             self.execute(self.SQL_CLEAN)
+        return query_oracle.pool.shutdown()
 
     def execute(self, sqlseq):
         conn = cx_Oracle.Connection(user=self.config['user'],
@@ -227,7 +233,7 @@ class TimeoutQueryTestCase(OracleBase):
     def tearDown(self):
         self.locked_conn.close()
         self.locked_conn = None
-        super(TimeoutQueryTestCase, self).tearDown()
+        return super(TimeoutQueryTestCase, self).tearDown()
 
     def test_timeout(self):
         def check(result):
@@ -263,7 +269,8 @@ class TimeoutConnectionTestCase(QueryTestCase):
                 'dsn': 'localhost/blackhole'}
 
     def tearDown(self):
-        return self.server.stopListening()
+        return defer.gatherResults([self.server.stopListening(),
+                                    query_oracle.pool.shutdown()])
 
     def test_timeout(self):
         def check(result):
@@ -276,6 +283,136 @@ class TimeoutConnectionTestCase(QueryTestCase):
         return d
 
 
+class FakeError(Exception):
+    pass
+
+class FakeCursor(object):
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.description = None
+        self.rows = []
+
+    def execute(self, sql, parameters):
+        if sql == "hang":
+            time.sleep(60)
+        elif sql == "error":
+            raise FakeError("ORA-03113: end-of-file on communication channel")
+        self.description = [("PID", int), ("CONNECTION", int)]
+        self.rows = [(os.getpid(), self.connection.number)]
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def close(self):
+        pass
+
+class FakeConnection(object):
+
+    def __init__(self, number):
+        self.number = number
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def close(self):
+        pass
+
+class FakeOracle(object):
+    """Just enough of cx_Oracle to exercise the worker pool"""
+
+    Error = FakeError
+    connections = 0
+
+    @classmethod
+    def connect(cls, user, password, dsn):
+        cls.connections += 1
+        return FakeConnection(cls.connections)
+
+class PoolTestCase(QueryTestCase):
+    """Test worker reuse without a real database"""
+
+    if not etree:
+        skip = "Missing lxml"
+
+    def setUp(self):
+        super(PoolTestCase, self).setUp()
+        self.real_cx_Oracle = query_oracle.cx_Oracle
+        query_oracle.cx_Oracle = FakeOracle
+        self.config = {
+                'type': 'oracle_sql',
+                'user': 'nobody',
+                'password': 'ponies',
+                'dsn': 'localhost/fake'}
+
+    def tearDown(self):
+        query_oracle.cx_Oracle = self.real_cx_Oracle
+        return query_oracle.pool.shutdown()
+
+    def startQuery(self, **kwargs):
+        d = super(PoolTestCase, self).startQuery(self.config, **kwargs)
+        d.addCallback(self.parse)
+        return d
+
+    def parse(self, result):
+        tree = etree.fromstring(result)
+        return (int(tree.findtext("row/pid")),
+                int(tree.findtext("row/connection")))
+
+    def testReuse(self):
+        def check(results):
+            self.assertEquals(results[0], results[1])
+            self.assertEquals(results[0][1], 1)
+
+        d = self.startQuery()
+        d.addCallback(lambda first: self.startQuery(sql="select 2 from dual")
+                .addCallback(lambda second: [first, second]))
+        d.addCallback(check)
+        return d
+
+    def testReconnect(self):
+        def check_error(result):
+            self.assertIsInstance(result, errors.Failure)
+            self.assert_(str(result.value).startswith("Oracle query failed"),
+                    "Wrong error, got: %s" % result.value)
+            return self.startQuery(sql="select 2 from dual")
+
+        def check(result):
+            # Same worker, new connection
+            self.assertEquals(result[0], first[0])
+            self.assertEquals(result[1], 2)
+
+        first = []
+        d = self.startQuery()
+        d.addCallback(first.extend)
+        d.addCallback(lambda x: QueryTestCase.startQuery(
+                self, self.config, sql="error"))
+        d.addBoth(check_error)
+        d.addCallback(check)
+        return d
+
+    def testTimeout(self):
+        def check_timeout(result):
+            self.assertIsInstance(result, errors.Failure)
+            self.assert_(str(result.value).startswith("Timeout"),
+                    "Wrong error, got: %s" % result.value)
+            return self.startQuery(sql="select 2 from dual")
+
+        def check(result):
+            # The hung worker was replaced
+            self.assertNotEquals(result[0], first[0])
+            self.assertEquals(result[1], 1)
+
+        first = []
+        d = self.startQuery()
+        d.addCallback(first.extend)
+        d.addCallback(lambda x: QueryTestCase.startQuery(
+                self, self.config, sql="hang", timeout=0.5))
+        d.addBoth(check_timeout)
+        d.addCallback(check)
+        return d
+
+
 class PLSQLTestCase(OracleBase):
 
     SQL_CLEAN = ("drop package pltest", "commit")
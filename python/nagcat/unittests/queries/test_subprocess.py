@@ -13,6 +13,7 @@
 # limitations under the License.
 
 import os
+from twisted.internet import defer
 from nagcat.unittests.queries import QueryTestCase
 from nagcat import errors
 
@@ -109,3 +110,64 @@ class NagiosPluginQueryTestCase(QueryTestCase):
         d = self.startQuery(type='nagios_plugin', command='echo hello; exit 4')
         d.addBoth(check)
         return d
+
+    def testPerfData(self):
+        def check(result):
+            self.assertEquals(result, "1")
+            self.assertEquals(result.fields(), {'value': "1", 'uom': "",
+                    'warn': "2", 'crit': "3", 'min': "0", 'max': "10"})
+
+        d = self.startQuery(type='nagios_plugin', perfdata='a',
+                command='echo "hello|a=1;2;3;0;10 b=5s"')
+        d.addCallback(check)
+        return d
+
+    def testPerfDataUnit(self):
+        def check(result):
+            self.assertEquals(result, "5.5ms")
+            self.assertEquals(result.fields()['value'], "5.5")
+            self.assertEquals(result.fields()['uom'], "ms")
+
+        d = self.startQuery(type='nagios_plugin', perfdata='b',
+                command='echo "hello|a=U b=5.5ms"')
+        d.addCallback(check)
+        return d
+
+    def testPerfDataUnknown(self):
+        def check(result):
+            self.assertEquals(result, "U")
+            self.assertEquals(result.fields()['value'], None)
+
+        d = self.startQuery(type='nagios_plugin', perfdata='a',
+                command='echo "hello|a=U b=5.5ms"')
+        d.addCallback(check)
+        return d
+
+    def testPerfDataMissing(self):
+        def check(reason):
+            self.assertIsInstance(reason, errors.Failure)
+            self.assertIsInstance(reason.value, errors.TestCritical)
+
+        d = self.startQuery(type='nagios_plugin', perfdata='c',
+                command='echo "hello|a=1;2;3;0;10 b=5s"')
+        d.addBoth(check)
+        return d
+
+    def testPerfDataShared(self):
+        command = 'echo "hello|a=1;2;3;0;10 b=5s"'
+        qa, da = self.startQuery2(type='nagios_plugin',
+                                  perfdata='a', command=command)
+        qb, db = self.startQuery2(type='nagios_plugin',
+                                  perfdata='b', command=command)
+        self.assertIdentical(qa.subquery, qb.subquery)
+
+        def check(results):
+            self.assertEquals(results, ["1", "5s"])
+            # Both values came from the same parsed table
+            perfdata = qa.subquery.result.perfdata
+            self.assertIdentical(results[0], perfdata['a'])
+            self.assertIdentical(results[1], perfdata['b'])
+
+        d = defer.gatherResults([da, db])
+        d.addCallback(check)
+        return d
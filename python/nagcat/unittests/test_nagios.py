@@ -0,0 +1,116 @@
+# Copyright 2010 ITA Software, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+from twisted.trial import unittest
+from nagcat import errors, nagios
+
+class StatusLoaderTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.path = self.mktemp()
+        self.write("host1", 1000)
+        self.loader = nagios.StatusLoader(self.path, 60)
+
+    def tearDown(self):
+        self.loader.stop()
+
+    def write(self, host_name, mtime):
+        fd = open(self.path, 'w')
+        fd.write("hoststatus {\n    host_name=%s\n    }\n" % host_name)
+        fd.close()
+        os.utime(self.path, (mtime, mtime))
+
+    def testReload(self):
+        first = self.loader.status()
+        self.assertEquals(first.host('host1')['host_name'], 'host1')
+        self.assertIdentical(self.loader.check(), None)
+
+        self.write("host2", 2000)
+        deferred = self.loader.check()
+        # The old copy is used until the new one is ready
+        self.assertIdentical(self.loader.status(), first)
+        self.assertIdentical(self.loader.check(), None)
+
+        def check(result):
+            status = self.loader.status()
+            self.assertNotIdentical(status, first)
+            self.assertEquals(status.host('host1'), None)
+            self.assertEquals(status.host('host2')['host_name'], 'host2')
+
+        deferred.addCallback(check)
+        return deferred
+
+    def testMissing(self):
+        first = self.loader.status()
+        os.unlink(self.path)
+        self.assertIdentical(self.loader.check(), None)
+        self.assertIdentical(self.loader.status(), first)
+
+    def testFailures(self):
+        self.loader.max_failures = 2
+        first = self.loader.status()
+
+        def broken():
+            raise IOError("broken")
+        self.loader._load = broken
+
+        def fail(result=None):
+            self.write("host2", self.loader._mtime + 1)
+            return self.loader.check()
+
+        def check(result):
+            self.assertRaises(errors.TestUnknown, self.loader.status)
+            del self.loader._load
+            return self.loader.check()
+
+        def recovered(result):
+            self.assertEquals(
+                    self.loader.status().host('host2')['host_name'], 'host2')
+
+        deferred = fail()
+        deferred.addCallback(lambda x: self.loader.status())
+        deferred.addCallback(self.assertIdentical, first)
+        deferred.addCallback(fail)
+        deferred.addCallback(check)
+        deferred.addCallback(recovered)
+        return deferred
+
+    def testFailuresReset(self):
+        self.loader.status()
+        os.unlink(self.path)
+        self.loader.check()
+        self.assertEquals(self.loader._failures, 1)
+
+        # The file is back and our copy of it is still current
+        self.write("host1", 1000)
+        self.assertIdentical(self.loader.check(), None)
+        self.assertEquals(self.loader._failures, 0)
+
+    def testOutOfDate(self):
+        first = self.loader.status()
+        self.write("host2", 2000)
+        deferred = self.loader.check()
+        self.assertIdentical(self.loader.status(), first)
+
+        # Pretend the reload has been running for too long
+        self.loader._changed -= self.loader.max_age + 1
+        self.assertRaises(errors.TestUnknown, self.loader.status)
+
+        def check(result):
+            status = self.loader.status()
+            self.assertEquals(status.host('host2')['host_name'], 'host2')
+
+        deferred.addCallback(check)
+        return deferred
@@ -0,0 +1,361 @@
+# Copyright 2010 ITA Software, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import re
+import time
+import errno
+from twisted.trial import unittest
+from twisted.internet import defer, reactor
+from nagcat import errors, nagios_api
+
+class FakeNagios(object):
+    """Just enough of Nagios to read what is written to it"""
+
+    PROCESS_FILE = re.compile(r'^\[\d+\] PROCESS_FILE;([^;]+);1$')
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        os.makedirs(self.path)
+        self.command_file = "%s/nagios.cmd" % self.path
+        self.spool_dir = "%s/spool" % self.path
+        self.check_result_path = "%s/checkresults" % self.path
+        os.mkfifo(self.command_file)
+        os.mkdir(self.check_result_path)
+        self.fifo = os.open(self.command_file, os.O_RDONLY | os.O_NONBLOCK)
+        self.buffer = ""
+
+    def read_commands(self):
+        """Read the commands written to the fifo so far"""
+
+        while True:
+            try:
+                data = os.read(self.fifo, 4096)
+            except OSError, ex:
+                if ex.errno == errno.EAGAIN:
+                    break
+                raise
+            if not data:
+                break
+            self.buffer += data
+
+        lines = self.buffer.split("\n")
+        self.buffer = lines.pop()
+        return lines
+
+    def read_results(self):
+        """Read the commands in each PROCESS_FILE spool file"""
+
+        results = []
+        for line in self.read_commands():
+            match = self.PROCESS_FILE.match(line)
+            assert match, "Unexpected command: %r" % line
+            fd = open(match.group(1))
+            results.append(fd.read().splitlines())
+            fd.close()
+            os.unlink(match.group(1))
+        return results
+
+    def read_check_results(self):
+        """Read checkresult files the same way Nagios 3 does"""
+
+        results = []
+        for name in sorted(os.listdir(self.check_result_path)):
+            path = "%s/%s" % (self.check_result_path, name)
+            if (len(name) != 7 or name[0] != 'c' or
+                    not os.path.exists("%s.ok" % path)):
+                continue
+
+            result = {}
+            for line in open(path):
+                line = line.rstrip("\n")
+                if not line:
+                    if result:
+                        results.append(result)
+                    result = {}
+                elif not line.startswith("#"):
+                    key, value = line.split("=", 1)
+                    result[key] = value
+            if result:
+                results.append(result)
+
+            os.unlink(path)
+            os.unlink("%s.ok" % path)
+
+        return results
+
+    def close(self):
+        os.close(self.fifo)
+
+class BatchTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.nagios = FakeNagios(self.mktemp())
+
+    def tearDown(self):
+        self.commander.stop()
+        self.commander.writer._close_file()
+        self.nagios.close()
+
+    def start(self, batch_size, batch_window):
+        self.commander = nagios_api.NagiosCommander(
+                self.nagios.command_file, self.nagios.spool_dir,
+                batch_size, batch_window)
+        return self.commander
+
+    def submit(self, commander, count):
+        for i in xrange(count):
+            commander.submit(1000 + i, 'PROCESS_SERVICE_CHECK_RESULT',
+                    'host', 'service %d' % i, 0, 'OK: %d' % i)
+
+    def wait(self, count):
+        """Wait for count spool files to be submitted"""
+
+        deferred = defer.Deferred()
+        results = []
+
+        def check(tries):
+            results.extend(self.nagios.read_results())
+            if len(results) >= count or not tries:
+                deferred.callback(results)
+            else:
+                reactor.callLater(0.05, check, tries - 1)
+
+        check(100)
+        return deferred
+
+    def testForce(self):
+        commander = self.start(10, 60)
+        self.submit(commander, 3)
+        self.assertEquals(commander.stats()['pending'], 3)
+        commander.flush(True)
+
+        results = self.nagios.read_results()
+        self.assertEquals(len(results), 1)
+        self.assertEquals(results[0], [
+            "[1000] PROCESS_SERVICE_CHECK_RESULT;host;service 0;0;OK: 0",
+            "[1001] PROCESS_SERVICE_CHECK_RESULT;host;service 1;0;OK: 1",
+            "[1002] PROCESS_SERVICE_CHECK_RESULT;host;service 2;0;OK: 2"])
+
+        stats = commander.stats()
+        self.assertEquals(stats['batches'], 1)
+        self.assertEquals(stats['commands'], 3)
+        self.assertEquals(stats['pending'], 0)
+        self.assertEquals(stats['size']['max'], 3)
+
+    def testProcessFileTime(self):
+        commander = self.start(10, 60)
+        self.submit(commander, 3)
+        now = int(time.time())
+        commander.flush(True)
+
+        commands = self.nagios.read_commands()
+        self.assertEquals(len(commands), 1)
+        submitted = int(commands[0][1:commands[0].index(']')])
+        self.assert_(submitted >= now)
+
+    def testShortWrites(self):
+        commander = self.start(100, 60)
+        write = os.write
+        def short(fd, data):
+            if fd == commander.writer.fileno():
+                return write(fd, data)
+            return write(fd, data[:100])
+        self.patch(os, 'write', short)
+
+        self.submit(commander, 50)
+        commander.flush(True)
+        results = self.nagios.read_results()
+        self.assertEquals(len(results[0]), 50)
+        self.assertEquals(results[0][-1],
+            "[1049] PROCESS_SERVICE_CHECK_RESULT;host;service 49;0;OK: 49")
+
+    def testStop(self):
+        commander = self.start(10, 60)
+        trigger = commander._shutdown_trigger
+        self.submit(commander, 3)
+        commander.stop()
+        self.assertEquals(commander._shutdown_trigger, None)
+        self.assertRaises(ValueError,
+                reactor.removeSystemEventTrigger, trigger)
+        self.assertEquals(len(self.nagios.read_results()), 1)
+
+    def testSize(self):
+        commander = self.start(2, 60)
+        self.submit(commander, 5)
+        self.assertEquals(commander.stats()['pending'], 1)
+
+        def check(results):
+            self.assertEquals([len(x) for x in results], [2, 2])
+            self.assertEquals(commander.stats()['batches'], 2)
+
+        deferred = self.wait(2)
+        deferred.addCallback(check)
+        return deferred
+
+    def testWindow(self):
+        commander = self.start(100, 0.1)
+        self.submit(commander, 3)
+
+        def check(results):
+            self.assertEquals([len(x) for x in results], [3])
+            self.assertEquals(commander.stats()['pending'], 0)
+
+        deferred = self.wait(1)
+        deferred.addCallback(check)
+        return deferred
+
+    def testCoalesce(self):
+        commander = self.start(10, 60)
+        self.submit(commander, 3)
+        commander.submit(2000, 'PROCESS_SERVICE_CHECK_RESULT',
+                'host', 'service 0', 2, 'CRITICAL: 0')
+        self.assertEquals(commander.stats()['pending'], 3)
+        self.assertEquals(commander.stats()['coalesced'], 1)
+        commander.flush(True)
+
+        results = self.nagios.read_results()
+        self.assertEquals(results[0], [
+            "[2000] PROCESS_SERVICE_CHECK_RESULT;host;service 0;2;CRITICAL: 0",
+            "[1001] PROCESS_SERVICE_CHECK_RESULT;host;service 1;0;OK: 1",
+            "[1002] PROCESS_SERVICE_CHECK_RESULT;host;service 2;0;OK: 2"])
+
+    def testBlocked(self):
+        commander = self.start(2, 0.05)
+        # Pretend nagios hasn't read the last command yet
+        commander.writer.backlog = lambda: 1
+        self.submit(commander, 3)
+        self.submit(commander, 3)
+        self.assertEquals(commander.stats()['pending'], 3)
+
+        def unblock(results):
+            self.assertEquals(results, [])
+            self.assertEquals(commander.stats()['pending'], 3)
+            self.assertEquals(commander.stats()['coalesced'], 3)
+            del commander.writer.backlog
+            return self.wait(2)
+
+        def check(results):
+            self.assertEquals(sorted([len(x) for x in results]), [1, 2])
+            self.assertEquals(commander.stats()['pending'], 0)
+
+        deferred = defer.Deferred()
+        reactor.callLater(0.2, deferred.callback, None)
+        deferred.addCallback(lambda x: self.nagios.read_results())
+        deferred.addCallback(unblock)
+        deferred.addCallback(check)
+        return deferred
+
+    def testBlockedRetry(self):
+        commander = self.start(1, 0)
+        commander.writer.backlog = lambda: 1
+        self.submit(commander, 1)
+        commander.flush()
+        # Held results are retried after a delay, not every reactor tick
+        delay = commander._batch_timer.getTime() - reactor.seconds()
+        self.assert_(delay > 0.5)
+        del commander.writer.backlog
+
+    def testWriterCoalesce(self):
+        commander = self.start(10, 60)
+        writer = commander.writer
+        writer.MAXSIZE = 1
+        # Pretend nagios isn't reading the fifo at all
+        writer.doWrite = lambda: None
+        writer.startWriting = lambda: None
+
+        self.submit(commander, 3)
+        commander.flush(True)
+        commander.submit(2000, 'PROCESS_SERVICE_CHECK_RESULT',
+                'host', 'service 0', 2, 'CRITICAL: 0')
+        commander.flush(True)
+        self.assertEquals(writer.backlog(), 1)
+        self.assertEquals(len(os.listdir(self.nagios.spool_dir)), 1)
+
+        del writer.doWrite
+        del writer.startWriting
+        writer.doWrite()
+        results = self.nagios.read_results()
+        self.assertEquals(results, [[
+            "[1001] PROCESS_SERVICE_CHECK_RESULT;host;service 1;0;OK: 1",
+            "[1002] PROCESS_SERVICE_CHECK_RESULT;host;service 2;0;OK: 2",
+            "[2000] PROCESS_SERVICE_CHECK_RESULT;host;service 0;2;CRITICAL: 0",
+            ]])
+
+class CheckResultTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.nagios = FakeNagios(self.mktemp())
+        self.writer = nagios_api.CheckResultWriter(
+                self.nagios.check_result_path, 10, 60)
+
+    def tearDown(self):
+        self.writer.stop()
+        self.nagios.close()
+
+    def testFormat(self):
+        self.writer.submit(1000, 'PROCESS_SERVICE_CHECK_RESULT',
+                'host', 'service 1', 0, 'OK: fine')
+        self.writer.submit(1001, 'PROCESS_SERVICE_CHECK_RESULT',
+                'host', 'service 2', 2, 'CRITICAL: bad\nmore | text\\')
+        self.assertEquals(self.nagios.read_check_results(), [])
+        self.writer.flush(True)
+
+        # Nothing should go through the command pipe
+        self.assertEquals(self.nagios.read_commands(), [])
+
+        results = self.nagios.read_check_results()
+        self.assertEquals(len(results), 3)
+        self.assert_('file_time' in results[0])
+
+        first = results[1]
+        self.assertEquals(first['host_name'], 'host')
+        self.assertEquals(first['service_description'], 'service 1')
+        self.assertEquals(first['check_type'], '1')
+        self.assertEquals(first['start_time'], '1000.0')
+        self.assertEquals(first['finish_time'], '1000.0')
+        self.assertEquals(first['return_code'], '0')
+        self.assertEquals(first['exited_ok'], '1')
+        self.assertEquals(first['output'], 'OK: fine')
+
+        second = results[2]
+        self.assertEquals(second['service_description'], 'service 2')
+        self.assertEquals(second['return_code'], '2')
+        self.assertEquals(second['output'],
+                r'CRITICAL: bad\nmore \_ text\\')
+
+        self.assertEquals(os.listdir(self.nagios.check_result_path), [])
+        self.assertEquals(self.writer.stats()['commands'], 2)
+
+    def testLongOutput(self):
+        output = "x" * 20000
+        self.writer.submit(1000, 'PROCESS_SERVICE_CHECK_RESULT',
+                'host', 'service', 0, output)
+        self.writer.flush(True)
+        results = self.nagios.read_check_results()
+        self.assertEquals(results[1]['output'], output)
+
+    def testShortWrites(self):
+        write = os.write
+        self.patch(os, 'write', lambda fd, data: write(fd, data[:100]))
+        output = "x" * 1000
+        self.writer.submit(1000, 'PROCESS_SERVICE_CHECK_RESULT',
+                'host', 'service', 0, output)
+        self.writer.flush(True)
+        results = self.nagios.read_check_results()
+        self.assertEquals(results[1]['output'], output)
+
+    def testBadPath(self):
+        self.assertRaises(errors.InitError, nagios_api.CheckResultWriter,
+                "%s/missing" % self.nagios.path)
@@ -13,8 +13,11 @@
 # limitations under the License.
 
 import re
+import pickle
+import collections
+from cStringIO import StringIO
 from twisted.trial import unittest
-from nagcat import nagios_objects, _object_parser_py
+from nagcat import nagios_objects, _object_parser_py, _object_store
 
 try:
     from nagcat import _object_parser_c
@@ -113,6 +116,11 @@ class ObjectsPyTestCase(unittest.TestCase):
         expect = {'host': self.objects['host']}
         self.assertEquals(parsed, expect)
 
+    def testFilterTypeString(self):
+        parser = self.parser(self.mkfile(self.objects), 'host')
+        self.assertEquals(self.todict(parser),
+                {'host': self.objects['host']})
+
     def testFilterValues(self):
         parser = self.parser(self.mkfile(self.objects),
                 object_select={'host_name': "host1"})
@@ -122,6 +130,66 @@ class ObjectsPyTestCase(unittest.TestCase):
         self.assertEquals(parsed, expect)
 
 
+    def testFileObject(self):
+        path = self.mkfile(self.objects)
+        parser = self.parser(open(path))
+        self.assertEquals(self.todict(parser), self.objects)
+        parser = self.parser(StringIO(open(path).read()))
+        self.assertEquals(self.todict(parser), self.objects)
+
+    def testEmpty(self):
+        parser = self.parser(self.mkfile({}), ('host',))
+        self.assertEquals(self.todict(parser), {'host': []})
+
+    def testMapped(self):
+        path = self.mkfile(self.objects)
+        parser = self.parser(path, mapped=True)
+        self.assertEquals(self.todict(parser), self.objects)
+        parser = self.parser(open(path), mapped=True)
+        self.assertEquals(self.todict(parser), self.objects)
+        parser = self.parser(self.mkfile({}), ('host',), mapped=True)
+        self.assertEquals(self.todict(parser), {'host': []})
+
+    def testKeys(self):
+        objects = {'host': [
+            {'host_name': 'host1', 'alias': 'Host 1'},
+            {'host_name_2': 'host2'},
+            {'alias': 'Host 3', 'address': 'x', 'host_name': 'host3'}]}
+        parser = self.parser(self.mkfile(objects))
+        self.assertEquals(self.todict(parser), objects)
+
+    def testFields(self):
+        objects = {'host': [{'host_name': 'host1', 'alias': 'Host 1',
+                             '_TEST': 'yes', '_TAG': 'x'}]}
+        parser = self.parser(self.mkfile(objects),
+                fields=('host_name', '_T*'))
+        self.assertEquals(parser['host'], [{'host_name': 'host1',
+                '_TEST': 'yes', '_TAG': 'x'}])
+
+        parser = self.parser(self.mkfile(self.objects),
+                object_select={'alias': "Host 2"}, fields=('host_name',))
+        self.assertEquals(parser['host'], [{'host_name': 'host2',
+                'alias': 'Host 2'}])
+
+    def testRows(self):
+        parser = self.parser(self.mkfile(self.objects))
+        hosts = parser['host']
+        self.assertEquals(len(hosts), 2)
+        self.assertEquals(hosts[1:], self.objects['host'][1:])
+
+        host = hosts[0]
+        self.assertEquals(host.get('host_name'), 'host1')
+        self.assertEquals(host.get('bogus'), None)
+        self.assertRaises(KeyError, host.__getitem__, 'bogus')
+        self.assertEquals(sorted(host), ['alias', 'host_name'])
+
+        host['members'] = ['a', 'b']
+        self.assertEquals(parser['host'][0]['members'], ['a', 'b'])
+        self.assertNotIn('members', parser['host'][1])
+        self.assertEquals(len(parser['host'][1]), 2)
+        self.assertIsInstance(host.copy(), dict)
+
+
 class StatusPyTestCase(ObjectsPyTestCase):
 
     status = True
@@ -132,8 +200,112 @@ class ObjectsCTestCase(ObjectsPyTestCase):
     else:
         skip = "C module missing"
 
+    def testOnlyMapWhenAsked(self):
+        mapped = []
+        def fake_mmap(*args, **kwargs):
+            data = real_mmap(*args, **kwargs)
+            mapped.append(data)
+            return data
+        real_mmap = _object_parser_c.mmap.mmap
+        self.patch(_object_parser_c.mmap, 'mmap', fake_mmap)
+
+        path = self.mkfile(self.objects)
+        self.assertEquals(self.todict(self.parser(path)), self.objects)
+        self.assertEquals(mapped, [])
+        parser = self.parser(path, mapped=True)
+        self.assertEquals(self.todict(parser), self.objects)
+        self.assertEquals(len(mapped), 1)
+
 class StatusCTestCase(StatusPyTestCase):
     if _object_parser_c:
         parser = _object_parser_c.ObjectParser
     else:
         skip = "C module missing"
+
+class StatusLookupTestCase(StatusPyTestCase):
+
+    def testLookup(self):
+        status = nagios_objects.Status(self.mkfile(self.objects))
+        self.assertEquals(status.host('host2'), self.objects['host'][1])
+        self.assertEquals(status.host('host3'), None)
+        self.assertEquals(status.service('host1', "Service 1"),
+                self.objects['service'][0])
+        self.assertEquals(status.service('host1', "Service 2"), None)
+        self.assertEquals(status['host'], self.objects['host'])
+
+    def testMissingType(self):
+        objects = {'host': self.objects['host']}
+        status = nagios_objects.Status(self.mkfile(objects))
+        self.assertEquals(status.service('host1', "Service 1"), None)
+        self.assertNotIn('service', status)
+
+    def testPickle(self):
+        objects = {'host': [{'host_name': "host1", 'address': "1.2.3.4"},
+                            {'host_name': "host2"}]}
+        status = nagios_objects.Status(self.mkfile(objects))
+        copy = pickle.loads(pickle.dumps(status, -1))
+        self.assertEquals(copy['host'], objects['host'])
+        self.assertEquals(copy.host('host2'), {'host_name': "host2"})
+        self.assertNotIn('address', copy.host('host2'))
+        self.assertEquals(copy.types(), ['host'])
+
+class ObjectStoreTestCase(unittest.TestCase):
+
+    def testIntern(self):
+        store = _object_store.ObjectStore(('host',))
+        store.add('host', [('a', "1"), ('b', "xyz")])
+        store.add('host', [('b', "".join(["xy", "z"])), ('c', "1")])
+        store.finish()
+
+        first, second = store['host']
+        self.assertEquals(first, {'a': "1", 'b': "xyz"})
+        self.assertEquals(second, {'b': "xyz", 'c': "1"})
+        self.assertIdentical(first['b'], second['b'])
+        self.assertEquals(store['host'].keys, ['a', 'b', 'c'])
+
+    def testFilter(self):
+        store = _object_store.ObjectStore()
+        for i in xrange(4):
+            store.add('service', [('id', str(i))])
+        table = store['service'].filter(lambda x: int(x['id']) % 2)
+        self.assertEquals(table, [{'id': "1"}, {'id': "3"}])
+
+    def testDelete(self):
+        store = _object_store.ObjectStore()
+        store.add('host', [('a', "1"), ('b', "2")])
+        host = store['host'][0]
+        del host['a']
+        self.assertEquals(host, {'b': "2"})
+        self.assertRaises(KeyError, host.__delitem__, 'a')
+
+    def testPickle(self):
+        store = _object_store.ObjectStore()
+        store.add('host', [('a', "1"), ('b', "2")])
+        host = pickle.loads(pickle.dumps(store['host'][0]))
+        self.assertEquals(type(host), dict)
+        self.assertEquals(host, {'a': "1", 'b': "2"})
+
+    def testListAPI(self):
+        store = _object_store.ObjectStore()
+        for name in ("b", "c", "a"):
+            store.add('host', [('host_name', name)])
+        hosts = store['host']
+        self.assertIsInstance(hosts, collections.Sequence)
+        self.assertIsInstance(hosts[0], collections.Mapping)
+
+        hosts.sort(lambda x, y: cmp(x['host_name'], y['host_name']))
+        self.assertEquals([h['host_name'] for h in hosts], ["a", "b", "c"])
+        hosts.sort(key=lambda x: x['host_name'], reverse=True)
+        self.assertEquals([h['host_name'] for h in hosts], ["c", "b", "a"])
+
+        both = hosts + [{'host_name': "d"}]
+        self.assertIsInstance(both, list)
+        self.assertEquals(len(both), 4)
+        both = [{'host_name': "d"}] + hosts
+        self.assertIsInstance(both, list)
+        self.assertEquals(both[1], {'host_name': "c"})
+
+        copy = pickle.loads(pickle.dumps(hosts))
+        self.assertEquals(type(copy), list)
+        self.assertEquals(type(copy[0]), dict)
+        self.assertEquals(copy, hosts)
@@ -13,7 +13,7 @@
 # limitations under the License.
 
 from twisted.trial import unittest
-from nagcat import simple, test
+from nagcat import errors, simple, test
 from coil.struct import Struct
 
 class TestTestCase(unittest.TestCase):
@@ -59,3 +59,157 @@ class TestTestCase(unittest.TestCase):
     def endCompound(self, result, t):
         self.assertEquals(result, None)
         self.assertEquals(t.result['output'], "3")
+
+    def compoundConfig(self, expr):
+        return Struct({
+                'query': {
+                    'type': "compound",
+                    'test-a': {
+                        'type': "noop",
+                        'data': "1",
+                    },
+                    'test-b': {
+                        'type': "noop",
+                        'data': "2",
+                    },
+                    'return': expr,
+                },
+            })
+
+    def testCompoundBuiltins(self):
+        config = self.compoundConfig("max($(test-a), $(test-b)) * 10")
+        t = test.Test(simple.NagcatDummy(), config)
+
+        def check(result):
+            self.assertEquals(t.result['output'], "20")
+
+        d = t.start()
+        d.addBoth(check)
+        return d
+
+    def testCompoundRestricted(self):
+        config = self.compoundConfig("__import__('os').getpid()")
+        self.assertRaises(errors.ConfigError,
+                test.Test, simple.NagcatDummy(), config)
+
+    def testCompoundSyntax(self):
+        config = self.compoundConfig("$(test-a) +")
+        self.assertRaises(errors.ConfigError,
+                test.Test, simple.NagcatDummy(), config)
+
+class ReportTestCase(unittest.TestCase):
+
+    def config(self, **kwargs):
+        config = Struct({
+                'test': "report",
+                'query': {
+                    'type': "noop",
+                    'data': "something",
+                },
+            })
+        for key, value in kwargs.iteritems():
+            config[key] = value
+        return config
+
+    def testLazy(self):
+        t = test.Test(simple.NagcatDummy(), self.config())
+        d = t.start()
+        d.addBoth(self.endLazy, t)
+        return d
+
+    def endLazy(self, result, t):
+        self.assertEquals(result, None)
+        self.assertIsInstance(t.result, test.Report)
+        self.assertNotIn('text', t.result)
+        self.assertNotIn('extra', t.result)
+        text = t.result['text']
+        self.assert_(text.startswith("report OK: something\n"))
+        self.assertIn("Full Output:\nsomething\n", text)
+        self.assertIdentical(t.result['text'], text)
+        self.assertEquals(t.result.get('extra'), "")
+        self.assertEquals(t.result.get('bogus'), None)
+
+    def testCompact(self):
+        config = self.config(report_mode="compact", report_refresh="60s")
+        t = test.Test(simple.NagcatDummy(), config)
+        d = t.start()
+        d.addBoth(self.endCompact, t)
+        return d
+
+    def endCompact(self, result, t):
+        # The first report is always the full report
+        self.assertIn("Full Output:", t.result['text'])
+
+        t._now += 10
+        report = t._report("something")
+        self.assertEquals(report['text'], "report OK: something\n")
+
+        # State changes are reported in full
+        t._now += 10
+        failed = errors.Failure(errors.TestCritical("bad"), result="x")
+        report = t._report(failed)
+        self.assertIn("Error:\nbad\n", report['text'])
+        report = t._report(failed)
+        self.assertEquals(report['text'], "report CRITICAL: bad\n")
+
+        # And refreshed periodically
+        t._now += 60
+        report = t._report(failed)
+        self.assertIn("Error:\nbad\n", report['text'])
+
+    def testUnchanged(self):
+        nagcat = simple.NagcatDummy()
+        t = test.Test(nagcat, self.config(repeat="0"))
+
+        def rerun(result):
+            first = t.result
+            first['text']
+            t._now -= 10
+            d = t.start()
+            d.addCallback(check, first)
+            return d
+
+        def check(result, first):
+            self.assertNotIdentical(t.result, first)
+            self.assertIdentical(t.result['text'], first['text'])
+            self.assert_(t.result['time'] > first['time'])
+            self.assertEquals(nagcat.stats()['unchanged']['report'],
+                    {'runs': 2, 'skipped': 1})
+
+        d = t.start()
+        d.addCallback(rerun)
+        return d
+
+    def testUnchangedTimeLimit(self):
+        nagcat = simple.NagcatDummy()
+        t = test.Test(nagcat, self.config(repeat="0",
+                warning_time_limit="1h"))
+
+        def check(result):
+            self.assertEquals(nagcat.stats()['unchanged']['report'],
+                    {'runs': 2, 'skipped': 0})
+
+        d = t.start()
+        d.addCallback(lambda x: t.start())
+        d.addCallback(check)
+        return d
+
+    def testTimeLimitStale(self):
+        nagcat = simple.NagcatDummy()
+        def stale():
+            raise errors.TestUnknown("Nagios status is out of date")
+        nagcat.nagios_status = stale
+
+        t = test.Test(nagcat, self.config(warning_time_limit="1h",
+                warning="= something"))
+
+        def check(result):
+            self.assertEquals(t.result["state"], "WARNING")
+
+        d = t.start()
+        d.addCallback(check)
+        return d
+
+    def testBadMode(self):
+        self.assertRaises(errors.ConfigError, test.Test,
+                simple.NagcatDummy(), self.config(report_mode="bogus"))
@@ -14,9 +14,11 @@
 
 import os
 from glob import glob
+from twisted.internet import defer
 from twisted.trial import unittest
 from coil.struct import Struct
 from nagcat import trend
+from nagcat.plugins.query_subprocess import PerfData
 
 if trend.rrdtool:
     import twirrdy
@@ -55,6 +57,27 @@ class TrendDataTestCase(unittest.TestCase):
 
         data.close()
 
+    def testPerfData(self):
+        conf = Struct({'type': "gauge",
+                       'host': "testhost",
+                       'description': "perfdata",
+                       'repeat': "5m",
+                       'trend': {'type': "gauge"},
+                       'query': {'type': "dummy"}})
+
+        updates = []
+        class RecordAPI(object):
+            def update(self, filename, time, values):
+                updates.append(values)
+                return defer.succeed(None)
+
+        trendobj = trend.Trend(conf, self.tmpdir, rrdapi=RecordAPI())
+        value = PerfData("a=5ms;10;20")['a']
+        trendobj.update({'state_id': 0, 'time': 1000, 'output': value})
+        self.assertEquals(len(updates), 1)
+        values = dict(zip(trendobj._ds_order, updates[0]))
+        self.assertEquals(values['_result'], 5.0)
+
     def testMultiple(self):
         conf = Struct({
             'host': "testhost",
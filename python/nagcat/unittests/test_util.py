@@ -14,6 +14,7 @@
 
 from __future__ import division
 
+import time
 from twisted.trial import unittest
 from nagcat import util
 
@@ -105,6 +106,26 @@ class MathStringTestCase(unittest.TestCase):
         a = util.MathString("string")
         self.assertIsInstance(str(a), str)
 
+    def testNumber(self):
+        a = util.MathString("2")
+        b = util.MathString("1.5")
+        c = util.MathString("string")
+        self.assertEquals(a.number(), 2)
+        self.assertIsInstance(a.number(), int)
+        self.assertEquals(b.number(), 1.5)
+        self.assertIdentical(c.number(), None)
+        self.assertRaises(util.MathError, lambda: c + 1)
+        self.assertRaises(ValueError, float, c)
+        self.assertEquals(int(util.MathString("1e3")), 1000)
+
+    def testReuse(self):
+        a = util.MathString("2")
+        self.assertIdentical(util.MathString(a), a)
+        a.number()
+        self.assertEquals(a._number, 2)
+        self.assertEquals(util.MathString(a) + 1, 3)
+        self.assertTrue(a == util.MathString("2.0"))
+
     def testAdd(self):
         a = util.MathString("2")
         b = util.MathString("1.5")
@@ -340,6 +361,18 @@ class EvalTesterTestCase(unittest.TestCase):
         self.assertFalse(t.test("2"))
         self.assertRaises(util.MathError, t.test, "bleh")
 
+    def test_zero(self):
+        t = util.EvalTester("==", "0")
+        self.assertIdentical(t.current(), t.compiled)
+        self.assertTrue(t.test("0.0"))
+
+    def test_now(self):
+        t = util.EvalTester(">", "$(NOW)")
+        self.assertIdentical(t.compiled, None)
+        self.assertIdentical(t.current(), t._dynamic[1])
+        self.assertTrue(t.test(str(time.time() + 60)))
+        self.assertFalse(t.test("1"))
+
 class RegexTesterTestCase(unittest.TestCase):
 
     def test_eq(self):
@@ -22,6 +22,7 @@ import sys
 import grp
 import pwd
 import time
+import operator
 import resource
 
 from nagcat import log
@@ -78,6 +79,48 @@ class Interval(float):
     def __str__(self):
         return "%s seconds" % super(Interval, self).__str__()
 
+class ParseCache(object):
+    """Remember parsed versions of a result for the current run.
+
+    Entries are looked up by the identity of the input string so
+    filters that parse the same result only do so once.
+    """
+
+    def __init__(self):
+        self._entries = {}
+
+    def get(self, parser, data):
+        """Get parser(data), calling parser only if needed"""
+
+        key = (parser, id(data))
+        entry = self._entries.get(key, None)
+        if entry is not None and entry[0] is data:
+            return entry[1]
+
+        value = parser(data)
+        # Keep a reference to data so the id isn't reused
+        self._entries[key] = (data, value)
+        return value
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+def result_hash(result):
+    """Get a cheap signature of a query result to detect changes.
+
+    Only plain results have one, failures always return None. Equal
+    signatures do not guarantee equal results, compare the results
+    to confirm a match.
+    """
+
+    if isinstance(result, str):
+        return (len(result), hash(result))
+    else:
+        return None
+
 class MathError(Exception):
     """Attempted math on a non-numeric value"""
 
@@ -100,8 +143,37 @@ class MathString(str):
     The == and != operators will do a numeric comparison if the two
     values happen to be numbers, otherwise it will compare them as
     strings.
+
+    The numeric value is parsed the first time it is needed and then
+    reused, MathString(value) returns value itself if it is already a
+    MathString so results can be passed around without parsing again.
     """
 
+    def __new__(cls, value=""):
+        if type(value) is cls:
+            return value
+        return str.__new__(cls, value)
+
+    def number(self):
+        """Get the numeric value or None if this isn't a number"""
+
+        try:
+            return self._number
+        except AttributeError:
+            pass
+
+        if '.' in self:
+            numtype = float
+        else:
+            numtype = int
+
+        try:
+            self._number = numtype(str(self))
+        except ValueError:
+            self._number = None
+
+        return self._number
+
     def __digify_args(*args):
         """Covert all arguments to a number"""
 
@@ -109,34 +181,32 @@ class MathString(str):
 
         for arg in args:
             if isinstance(arg, MathString):
-                if '.' in arg:
-                    numtype = float
-                else:
-                    numtype = int
-
-                try:
-                    arg = numtype(arg)
-                except ValueError:
+                number = arg.number()
+                if number is None:
                     raise MathError("The value '%s' is not a number" % str(arg))
+                arg = number
 
             numbers.append(arg)
 
         return numbers
 
     def __float__(self):
-        return float(str(self))
+        number = self.number()
+        if number is None:
+            return float(str(self))
+        return float(number)
 
     def __int__(self):
-        try:
-            return int(str(self))
-        except ValueError:
+        number = self.number()
+        if number is None:
             return int(float(self))
+        return int(number)
 
     def __long__(self):
-        try:
-            return long(str(self))
-        except ValueError:
+        number = self.number()
+        if number is None:
             return long(float(self))
+        return long(number)
 
     def __add__(self, other):
         nself, nother = self.__digify_args(other)
@@ -276,6 +346,8 @@ class Tester(object):
         self.test_op = test_op
         self.test_val = test_val
         self.compiled = self.compile(static=True)
+        # (second, value) for tests using $(NOW)
+        self._dynamic = None
 
         if test_op not in self.expr_ops:
             raise TesterError("Invalid test operator: %s" % (test_op,))
@@ -285,6 +357,19 @@ class Tester(object):
         if not static or value == self.test_val:
             return value
 
+    def current(self):
+        """Get the compiled test value.
+
+        Values using $(NOW) are compiled at most once per second.
+        """
+        if self.compiled is not None:
+            return self.compiled
+
+        now = int(time.time())
+        if self._dynamic is None or self._dynamic[0] != now:
+            self._dynamic = (now, self.compile())
+        return self._dynamic[1]
+
     def test(self, input_val):
         raise NotImplemented()
 
@@ -301,7 +386,7 @@ class RegexTester(Tester):
                 raise TesterError("Invalid test regex %r: %s" % (expr,ex))
 
     def test(self, input_val):
-        compiled = self.compiled or self.compile()
+        compiled = self.current()
 
         if self.test_op == '=~':
             if compiled.search(input_val):
@@ -317,11 +402,22 @@ class EvalTester(Tester):
     expr_ops = ('>','<','==','>=','<=','<>','!=')
     # '=' is also allowed
 
+    operators = {
+            '>':  operator.gt,
+            '<':  operator.lt,
+            '==': operator.eq,
+            '>=': operator.ge,
+            '<=': operator.le,
+            '<>': operator.ne,
+            '!=': operator.ne,
+        }
+
     def __init__(self, test_op, test_val):
         # Convert non-python operator
         if test_op == '=':
             test_op = '=='
         super(EvalTester, self).__init__(test_op, test_val)
+        self._operator = self.operators[test_op]
 
     def compile(self, static=False):
         value = super(EvalTester, self).compile(static)
@@ -329,10 +425,7 @@ class EvalTester(Tester):
             return MathString(value)
 
     def test(self, input_val):
-        eval_dict = {'a': MathString(input_val),
-                     'b': self.compiled or self.compile()}
-
-        if eval("a %s b" % self.test_op, eval_dict):
+        if self._operator(MathString(input_val), self.current()):
             return "test matched: %s %s" % (self.test_op, self.test_val)
 
 
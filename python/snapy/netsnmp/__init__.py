@@ -47,6 +47,19 @@ EndOfMibView = types.EndOfMibView
 OIDValueError = types.OIDValueError
 OID = types.OID
 
+def load_mib_cache(path):
+    """Persist symbolic OID name lookups in the given file.
+
+    Names saved by a previous process are loaded immediately unless
+    any of the MIB files have changed, call save_mib_cache() once
+    all names have been resolved to write out any new ones.
+    """
+    types.name_cache.load(path)
+
+def save_mib_cache():
+    """Write out the symbolic OID name cache, see load_mib_cache()"""
+    return types.name_cache.save()
+
 class Session(object):
     """Wrapper around a single SNMP Session"""
 
@@ -263,7 +276,7 @@ class Session(object):
             if oids:
                 self._send_request(const.SNMP_MSG_GET, oids[:10], walk_cb)
             else:
-                data.sort(cmp=util.compare_results)
+                data.sort(key=util.result_key)
                 cb(data, *args)
 
         self._send_request(const.SNMP_MSG_GET, oids[:10], walk_cb)
@@ -304,7 +317,7 @@ class Session(object):
                 return
 
             # We must process things in order
-            results.sort(cmp=util.compare_results)
+            results.sort(key=util.result_key)
 
             for oid, value in results:
                 # Stop when an error is hit (ie endOfMibView)
@@ -362,7 +375,7 @@ class Session(object):
 
         def stop(results=None):
             if results is None:
-                data.sort(cmp=util.compare_results)
+                data.sort(key=util.result_key)
                 results = data
             cb(results, *args)
 
@@ -0,0 +1,202 @@
+# snapy - a python snmp library
+#
+# Copyright (C) 2009 ITA Software, Inc.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# version 2 as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+"""Cache of symbolic OID names to their numeric values"""
+
+import os
+import ctypes
+import tempfile
+import cPickle
+
+from snapy.netsnmp import lib
+
+# The default used by net-snmp if nothing else is configured
+DEFAULT_MIBDIRS = "/usr/share/snmp/mibs"
+
+def mib_dirs():
+    """Get the list of directories net-snmp searches for MIBs"""
+
+    try:
+        get_dirs = lib.netsnmp_get_mib_directory
+    except AttributeError:
+        # net-snmp < 5.4 doesn't export this, fall back on the env
+        dirs = os.environ.get("MIBDIRS", DEFAULT_MIBDIRS)
+    else:
+        get_dirs.argtypes = []
+        get_dirs.restype = ctypes.c_char_p
+        dirs = get_dirs() or DEFAULT_MIBDIRS
+
+    return [d for d in dirs.lstrip('+-').split(':') if d]
+
+def mib_signature():
+    """Identify the current set of MIB files by name and mtime"""
+
+    signature = []
+    for mibdir in mib_dirs():
+        try:
+            names = os.listdir(mibdir)
+        except OSError:
+            continue
+
+        for name in sorted(names):
+            path = os.path.join(mibdir, name)
+            try:
+                signature.append((path, os.stat(path).st_mtime))
+            except OSError:
+                continue
+
+    return signature
+
+class MIBCache(object):
+    """Map symbolic names such as IF-MIB::ifInOctets to numeric OIDs.
+
+    Lookups are always memoized in memory. If a path is given to
+    load() the cache is also persisted to disk by save() so later
+    processes can skip reading MIB files until they are needed for
+    display hints, see read_pending(). The saved cache is ignored if
+    any of the MIB files have changed since.
+
+    Only names qualified with a module are saved, what a bare name
+    resolves to depends on which modules happen to be loaded so bare
+    names are also forgotten whenever another module is loaded.
+    """
+
+    # Bumped whenever the format of the saved file changes
+    VERSION = 2
+
+    def __init__(self):
+        self._names = {}
+        self._name_modules = {}
+        self._modules = set()
+        self._pending = set()
+        self._path = None
+        self._signature = None
+        self._dirty = False
+
+    def load(self, path):
+        """Enable persistence and load any saved names from path"""
+
+        self._path = path
+        self._signature = mib_signature()
+
+        try:
+            fd = open(path, 'rb')
+            try:
+                saved = cPickle.load(fd)
+            finally:
+                fd.close()
+        except (IOError, EOFError, cPickle.UnpicklingError):
+            return
+
+        if (not isinstance(saved, dict) or
+                saved.get('version') != self.VERSION or
+                saved.get('signature') != self._signature):
+            self._dirty = True
+            return
+
+        for name, (module, value) in saved['names'].iteritems():
+            if name not in self._names:
+                self._names[name] = value
+                self._name_modules[name] = module
+
+    def save(self):
+        """Write out the cache if persistence is enabled.
+
+        Returns True if the cache was written.
+        """
+
+        if not self._path or not self._dirty:
+            return False
+
+        if self._signature is None:
+            self._signature = mib_signature()
+
+        names = dict((name, (module, self._names[name]))
+                     for name, module in self._name_modules.iteritems())
+        saved = {'version': self.VERSION,
+                 'signature': self._signature,
+                 'names': names}
+        directory = os.path.dirname(os.path.abspath(self._path))
+
+        try:
+            fd, tmp = tempfile.mkstemp(dir=directory)
+            try:
+                fd = os.fdopen(fd, 'wb')
+                cPickle.dump(saved, fd, -1)
+                fd.close()
+                os.rename(tmp, self._path)
+            except:
+                os.unlink(tmp)
+                raise
+        except (IOError, OSError):
+            return False
+
+        self._dirty = False
+        return True
+
+    def read_module(self, module):
+        """Load a MIB module, only asking net-snmp once per module"""
+
+        if module not in self._modules:
+            lib.netsnmp_read_module(module)
+            self._modules.add(module)
+            self._forget_bare()
+        self._pending.discard(module)
+
+    def _forget_bare(self):
+        """Drop names without a module, a new module may change them"""
+
+        for name in self._names.keys():
+            if name not in self._name_modules:
+                del self._names[name]
+
+    def read_pending(self):
+        """Load the modules of any names that were resolved from
+        the saved cache, this must be done before looking up
+        anything else defined by the MIB such as display hints."""
+
+        while self._pending:
+            self.read_module(self._pending.pop())
+
+    def get(self, name):
+        """Get the numeric value for name or None if unknown"""
+
+        value = self._names.get(name, None)
+        if value is not None:
+            module = self._name_modules.get(name, None)
+            if module is not None and module not in self._modules:
+                self._pending.add(module)
+        return value
+
+    def set(self, name, value, module=None):
+        """Record the numeric value for name, only names with
+        a module are saved to disk."""
+
+        self._names[name] = tuple(value)
+        if module is not None:
+            self._name_modules[name] = module
+            self._dirty = True
+
+    def clear(self):
+        """Forget everything, saved files are left untouched"""
+        self._names.clear()
+        self._name_modules.clear()
+        self._modules.clear()
+        self._pending.clear()
+        self._dirty = bool(self._path)
+
+    def __contains__(self, name):
+        return name in self._names
+
+    def __len__(self):
+        return len(self._names)
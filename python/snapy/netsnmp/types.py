@@ -16,7 +16,7 @@ from __future__ import division
 
 import math
 from ctypes import *
-from snapy.netsnmp import const, lib
+from snapy.netsnmp import const, lib, mibcache
 
 # Provide the standard timeval struct
 class timeval(Structure):
@@ -168,6 +168,9 @@ lib.netsnmp_ds_set_boolean(0, 13, 1)
 # Load the MIB tree, various things will expect this
 lib.netsnmp_init_mib()
 
+# Symbolic names resolved by OID(), see mibcache.MIBCache
+name_cache = mibcache.MIBCache()
+
 
 ## Data structures and other random types ##
 
@@ -420,13 +423,14 @@ class OIDValueError(Exception):
 class OID(tuple):
     """An OID and various helper methods.
 
-    The OID.raw attribute can be used for library calls.
+    The OID.raw attribute can be used for library calls, it is
+    created on first use since most OIDs never need it.
 
     >>> oid = OID("1.2.3.4")
     >>> lib.snmp_add_null_var(req, oid.raw, len(oid))
     """
 
-    def __new__(cls, seq, length=None):
+    def __new__(cls, seq=(), length=None):
         """Note: length should only be used for sequence types that
         may not be able to report their length properly."""
         if isinstance(seq, OID):
@@ -438,23 +442,41 @@ class OID(tuple):
                 seq = cls._parse_oid(seq)
         else:
             if length is not None:
-                seq = [seq[i] for i in xrange(length)]
+                seq = seq[:length]
             try:
                 seq = [int(v) for v in seq]
             except (ValueError, TypeError):
                 raise OIDValueError(str(seq))
 
-        self = super(OID, cls).__new__(cls, seq)
-        self.raw = (oid * len(self))()
-        for i, v in enumerate(self):
-            self.raw[i] = v
+        return super(OID, cls).__new__(cls, seq)
+
+    @classmethod
+    def from_c(cls, array, length):
+        """Create an OID directly from a C oid array.
 
-        return self
+        This skips all of the parsing and checking done by OID() and
+        is intended for decoding responses where the values are known
+        to be sane, the array must be a POINTER(oid) or oid array.
+        """
+        return tuple.__new__(cls, array[:length])
+
+    @property
+    def raw(self):
+        try:
+            return self._raw
+        except AttributeError:
+            self._raw = (oid * len(self))(*self)
+            return self._raw
 
     @classmethod
     def _parse_oid(cls, string):
+        cached = name_cache.get(string)
+        if cached is not None:
+            return cached
+
         buf_len = c_size_t(const.MAX_OID_LEN)
         buf = (oid * const.MAX_OID_LEN)()
+        name = string
 
         # It sure would be nice if we could use snmp_parse_oid
         # but it doesn't provide any sort of useful error codes.
@@ -466,7 +488,7 @@ class OID(tuple):
 
             # This is also done in get_module_node but it doesn't
             # tell us if this a missing module is why it failed.
-            lib.netsnmp_read_module(module)
+            name_cache.read_module(module)
             modid = lib.which_module(module)
             if modid == -1:
                 raise OIDValueError("Cannot find module %s" % module)
@@ -481,7 +503,12 @@ class OID(tuple):
                 raise OIDValueError("Cannot find node %s in %s" %
                                     (string, module))
 
-        return [buf[i] for i in xrange(buf_len.value)]
+        value = buf[:buf_len.value]
+        if module == "ANY":
+            name_cache.set(name, value)
+        else:
+            name_cache.set(name, value, module)
+        return value
 
     def __str__(self):
         return ".%s" % ".".join(str(i) for i in self)
@@ -490,7 +517,9 @@ class OID(tuple):
         return "OID(%r)" % list(self)
 
     def __add__(self, other):
-        return OID(super(OID, self).__add__(other))
+        if isinstance(other, OID):
+            return tuple.__new__(OID, super(OID, self).__add__(other))
+        return OID(super(OID, self).__add__(tuple(other)))
 
     def startswith(self, other):
         """String like startswith method for comparing OIDs"""
@@ -501,6 +530,7 @@ class OID(tuple):
 
     def _tree(self):
         """Internal: get the tree object defined by the MIB"""
+        name_cache.read_pending()
         return lib.get_tree(self.raw, len(self), lib.get_tree_head())
 
     def hint(self):
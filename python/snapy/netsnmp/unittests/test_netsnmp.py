@@ -15,6 +15,7 @@ import time
 from twisted.trial import unittest
 from snapy.netsnmp.unittests import TestCase
 from snapy.netsnmp import Session, SnmpError, SnmpTimeout, OID
+from snapy.netsnmp import mibcache, types
 
 class Result(object):
     """Container for async results"""
@@ -162,3 +163,77 @@ class TestOID(unittest.TestCase):
         self.assertEquals(oid, OID("SNMPv2-MIB::sysDescr.0"))
         self.assertEquals(oid, OID("sysDescr.0"))
 
+
+    def test_oid_raw(self):
+        oid = OID(".1.3.6.1.4.2.1.1")
+        self.assertEquals(list(oid.raw), list(oid))
+        self.assertIdentical(oid.raw, oid.raw)
+
+    def test_oid_from_c(self):
+        oid = OID(".1.3.6.1.4.2.1.1")
+        new = OID.from_c(oid.raw, len(oid))
+        self.assertIsInstance(new, OID)
+        self.assertEquals(new, oid)
+        self.assertEquals(new + OID("1.2"), OID(".1.3.6.1.4.2.1.1.1.2"))
+
+    def test_oid_name_cached(self):
+        oid = OID("SNMPv2-MIB::sysDescr.0")
+        self.assertEquals(types.name_cache.get("SNMPv2-MIB::sysDescr.0"),
+                tuple(oid))
+        self.assertEquals(OID("SNMPv2-MIB::sysDescr.0"), oid)
+
+class TestMIBCache(unittest.TestCase):
+
+    def test_persist(self):
+        path = self.mktemp()
+        cache = mibcache.MIBCache()
+        cache.load(path)
+        cache.set("FOO-MIB::foo", [1,3,6,1,4,2,1,1], "FOO-MIB")
+        self.assert_(cache.save())
+        self.failIf(cache.save())
+
+        cache = mibcache.MIBCache()
+        cache.load(path)
+        self.assertEquals(cache._pending, set())
+        self.assertEquals(cache.get("FOO-MIB::foo"), (1,3,6,1,4,2,1,1))
+        self.assertEquals(cache._pending, set(["FOO-MIB"]))
+
+    def test_any_not_saved(self):
+        path = self.mktemp()
+        cache = mibcache.MIBCache()
+        cache.load(path)
+        cache.set("foo", [1,3,6,1,4,2,1,1])
+        self.failIf(cache.save())
+        self.assertEquals(cache.get("foo"), (1,3,6,1,4,2,1,1))
+        cache.set("FOO-MIB::foo", [1,3,6,1,4,2,1,1], "FOO-MIB")
+        self.assert_(cache.save())
+
+        cache = mibcache.MIBCache()
+        cache.load(path)
+        self.assertEquals(cache.get("foo"), None)
+
+    def test_any_forgotten(self):
+        self.patch(mibcache.lib, 'netsnmp_read_module', lambda m: None)
+        cache = mibcache.MIBCache()
+        cache.set("foo", [1,3,6,1,4,2,1,1])
+        cache.set("FOO-MIB::foo", [1,3,6,1,4,2,1,1], "FOO-MIB")
+        cache.read_module("FOO-MIB")
+        self.assertEquals(cache.get("foo"), None)
+        self.assertEquals(cache.get("FOO-MIB::foo"), (1,3,6,1,4,2,1,1))
+
+        # Nothing changes if the module was already loaded
+        cache.set("foo", [1,3,6,1,4,2,1,2])
+        cache.read_module("FOO-MIB")
+        self.assertEquals(cache.get("foo"), (1,3,6,1,4,2,1,2))
+
+    def test_stale(self):
+        path = self.mktemp()
+        cache = mibcache.MIBCache()
+        cache.load(path)
+        cache.set("FOO-MIB::foo", [1,3,6,1,4,2,1,1], "FOO-MIB")
+        cache._signature = [("/nonexistent/FOO-MIB.txt", 0)]
+        self.assert_(cache.save())
+
+        cache = mibcache.MIBCache()
+        cache.load(path)
+        self.assertEquals(cache.get("FOO-MIB::foo"), None)
@@ -13,12 +13,13 @@
 # GNU General Public License for more details.
 
 import ctypes
+import operator
 
 from snapy.netsnmp import lib, const, types
 
 def _decode_objid(objid, var):
-    length = var.val_len / ctypes.sizeof(types.oid)
-    return types.OID(var.val.objid, length)
+    length = var.val_len // ctypes.sizeof(types.oid)
+    return types.OID.from_c(var.val.objid, length)
 
 def _decode_ip(objid, var):
     return '.'.join(map(str, var.val.bitstring[:4]))
@@ -35,7 +36,15 @@ def _decode_string(objid, var):
     snmprint_value to make the string still useful for "special"
     values such as HOST-RESOURCES-MIB::hrSystemDate.0
     """
-    hint = objid.hint()
+    # Look up the MIB tree using the response's own name array
+    # rather than objid.hint() so objid never needs a raw buffer.
+    types.name_cache.read_pending()
+    tree = lib.get_tree(var.name, var.name_length, lib.get_tree_head())
+    if tree:
+        hint = tree.contents.hint
+    else:
+        hint = None
+
     if hint:
         # String hints typically give a size of 256, so we must be
         # larger than that. (alternatively we could use realloc but meh)
@@ -100,7 +109,7 @@ def decode_result(pdu):
     index = 1
     while var:
         var = var.contents
-        oid = types.OID(var.name, var.name_length)
+        oid = types.OID.from_c(var.name, var.name_length)
 
         if err_index is None:
             result.append((oid, _decode_variable(oid, var)))
@@ -116,6 +125,12 @@ def decode_result(pdu):
     else:
         return result
 
+# Sort key for the list returned by decode_result
+result_key = operator.itemgetter(0)
+
 def compare_results(result1, result2):
-    """Useful for sorting the list returned by decode_result"""
+    """Useful for sorting the list returned by decode_result.
+
+    Deprecated, sorting with key=result_key is much cheaper.
+    """
     return cmp(result1[0], result2[0])
@@ -12,6 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import collections
 import json
 import math
 import os
@@ -42,7 +43,15 @@ from railroad.parserrd.views import get_data
 DAY = 86400 # 1 Day in seconds
 
 def json_handle_datetime(obj):
-    return time.mktime(obj.timetuple()) if isinstance(obj, datetime) else obj
+    if isinstance(obj, datetime):
+        return time.mktime(obj.timetuple())
+    # nagcat's parsed objects are only dict and list like
+    elif isinstance(obj, collections.Mapping):
+        return dict(obj)
+    elif isinstance(obj, collections.Sequence):
+        return list(obj)
+    else:
+        return obj
 
 def is_graphable(host, service):
     """Checks if service of host is graphable (has state or trend)"""
@@ -117,10 +126,10 @@ def parse():
     """
     data_path = settings.DATA_PATH
     stat_path = '{0}/status.dat'.format(data_path)
-    stat = nagios_objects.ObjectParser(stat_path)
+    stat = nagios_objects.ObjectParser(stat_path, mapped=True)
 
     obj_path = '%sobjects.cache' % data_path
-    obj = nagios_objects.ObjectParser(obj_path, ('hostgroup'))
+    obj = nagios_objects.ObjectParser(obj_path, ('hostgroup',))
 
     # Convert unix times to python datetimes.
 